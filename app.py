@@ -1,99 +1,152 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from flask import Flask, Blueprint, Response, current_app, g, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash
+from datetime import datetime, timedelta
+import click
+import functools
 import json
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
+import math
+import os
+import time
+import uuid
+import zlib
 from io import BytesIO
+from markupsafe import escape, Markup
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+from models import (db, User, Course, Lesson, QuizQuestion, QuizAttempt, ClickstreamEvent,
+                    AdminUser, VideoWatch, VideoStats, SessionNavigation, PageTransition,
+                    SessionPageVisit, UserActivitySummary, UniqueVisitorSketch, TopClickSummary, RetentionCohort, CohortActivity,
+                    ExportJob, EventCountRollup, FeedConsumer, LessonProgress, upgrade_schema)
+import video_analytics
+import navigation_analytics
+import search_index
+import dedupe
+import rate_limit
+import exports
+import event_reads
+import change_feed
+import unique_counts
+import heavy_hitters
+import retention
+import sql_profiler
+import sampling_profiler
+import enrichment
+import event_data
+import timeseries
+import snapshot
+import password_hashing
+import re
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///learning_website.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Client-side tracking settings published at /api/tracking_config.
+# Any key can be overridden by tracking_config.json without a redeploy.
+DEFAULT_TRACKING_CONFIG = {
+    'flush_interval_ms': 10000,       # How often queued events are uploaded
+    'max_batch_size': 50,             # Upload early once this many events are queued
+    'compress': True,                 # gzip uploads when the browser supports it
+    'heartbeat_interval_ms': 60000,   # time_on_page heartbeat
+    'mouse_path_interval_ms': 30000,  # One polyline event per window
+    'mouse_sample_ms': 500,           # Minimum gap between recorded mouse points
+    'mouse_min_distance_px': 50,      # Ignore jitter below this distance
+    'burst_gap_ms': 2000,             # Idle gap that closes a keystroke burst
+    'sample_rates': {                 # Fraction of events kept, per event type
+        'mouse_movement': 0.25,
+        'keyboard': 0.5,
+        'form_interaction': 1.0,
+        'time_on_page': 1.0,
+        'visibility_change': 0.5,
+        'window_resize': 0.25
+    }
+}
+
+# Ids of events this worker stored recently, for rejecting retried uploads
+recent_event_ids = dedupe.RecentEventIds()
+
+# Token buckets for /api/track_event. Created at import so that, with
+# gunicorn preload_app, the shared memory is inherited by every worker
+rate_limiter = rate_limit.TokenBucketLimiter(rate_limit.create_store())
+
+# All routes, hooks and CLI commands live on this blueprint; create_app()
+# registers it. cli_group=None keeps commands at the top level (flask init-db)
+bp = Blueprint('main', __name__, cli_group=None)
 
-db = SQLAlchemy(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    clickstream_events = db.relationship('ClickstreamEvent', backref='user', lazy=True)
-    quiz_attempts = db.relationship('QuizAttempt', backref='user', lazy=True)
-
-class Course(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    lessons = db.relationship('Lesson', backref='course', lazy=True)
-
-class Lesson(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    content_type = db.Column(db.String(50), nullable=False)  # 'text', 'video', 'quiz'
-    content = db.Column(db.Text)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    order = db.Column(db.Integer, default=0)
-    
-    # Relationships
-    quiz_questions = db.relationship('QuizQuestion', backref='lesson', lazy=True)
-
-class QuizQuestion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    question = db.Column(db.Text, nullable=False)
-    options = db.Column(db.Text)  # JSON string of options
-    correct_answer = db.Column(db.Integer, nullable=False)
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
-
-class QuizAttempt(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
-    score = db.Column(db.Float, nullable=False)
-    answers = db.Column(db.Text)  # JSON string of user answers
-    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class ClickstreamEvent(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Nullable for anonymous users
-    session_id = db.Column(db.String(100), nullable=False)
-    event_type = db.Column(db.String(50), nullable=False)  # 'page_view', 'click', 'video_action', 'quiz_action'
-    element_id = db.Column(db.String(100), nullable=True)
-    element_type = db.Column(db.String(50), nullable=True)  # 'button', 'link', 'video', 'quiz_question'
-    page_url = db.Column(db.String(500), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    additional_data = db.Column(db.Text)  # JSON string for extra data
-    ip_address = db.Column(db.String(45), nullable=True)  # IPv4/IPv6 support
-    
-    # For video tracking
-    video_id = db.Column(db.String(100), nullable=True)
-    video_action = db.Column(db.String(50), nullable=True)  # 'play', 'pause', 'seek', 'complete'
-    video_time = db.Column(db.Float, nullable=True)
-    
-    # For quiz tracking
-    quiz_id = db.Column(db.String(100), nullable=True)
-    question_id = db.Column(db.String(100), nullable=True)
-    answer_selected = db.Column(db.String(100), nullable=True)
-
-class AdminUser(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    is_admin = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+login_manager.login_view = 'main.login'
+
+def create_app(config=None):
+    """Build and configure the Flask application.
+
+    Importing this module does no work beyond defining routes, so WSGI
+    servers can import it cheaply (and share it between forked workers
+    with gunicorn --preload). The database schema is not touched here;
+    run `flask --app app init-db` once to create tables and sample data.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///learning_website.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TRACKING_CONFIG_FILE'] = os.path.join(app.root_path, 'tracking_config.json')
+    app.config['MAX_TRACKING_PAYLOAD'] = 1024 * 1024  # Max decompressed size of one upload
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted; 0
+    # means clients connect directly and forwarded headers are ignored
+    app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+    app.config['RATE_LIMIT_ENABLED'] = True
+    # (burst capacity, refill per second). The per-IP limit is loose because
+    # a whole classroom can share one address behind NAT. Event budgets are
+    # per logged-in account, or per IP for visitors who are not logged in
+    app.config['RATE_LIMITS'] = {
+        'requests_per_ip': (200, 20.0),
+        'events_per_client': (500, 5.0),
+        'event_types': {
+            'mouse_movement': (10, 0.1),
+            'keyboard': (20, 0.2),
+            'time_on_page': (10, 0.05),
+            'visibility_change': (20, 0.2),
+            'window_resize': (10, 0.1),
+            'form_interaction': (60, 1.0)
+        }
+    }
+    app.config['EXPORT_DIR'] = os.path.join(app.instance_path, 'exports')
+    app.config['EXPORT_WORKERS'] = 2  # Export processes per web worker
+    # IP range CSV used to locate events (see enrichment.py); optional
+    app.config['GEOIP_DATABASE'] = os.environ.get('GEOIP_DATABASE', os.path.join(app.instance_path, 'ip_ranges.csv'))
+    # Per-request SQL profiling (see sql_profiler.py); off unless asked for
+    app.config['SQL_PROFILER'] = os.environ.get('SQL_PROFILER') == '1'
+    app.config['SQL_SLOW_QUERY_MS'] = 100  # Statements logged with their query plan
+    app.config['SQL_SLOW_QUERY_LOG'] = os.path.join(app.instance_path, 'logs', 'slow_queries.log')
+    app.config['SQL_SLOW_QUERY_LOG_BYTES'] = 5 * 1024 * 1024
+    app.config['SQL_SLOW_QUERY_LOG_BACKUPS'] = 5
+    # Stack-sampling profiles of single requests (see sampling_profiler.py)
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # Of all requests
+    app.config['PROFILE_INTERVAL_MS'] = 5
+    app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+    app.config['PROFILES_KEPT'] = 200
+    # Read-only copy of the database the admin reports read (see snapshot.py);
+    # used once `flask refresh-snapshot` has written it, '' to always read live
+    app.config['ANALYTICS_SNAPSHOT'] = os.environ.get('ANALYTICS_SNAPSHOT', os.path.join(app.instance_path, 'analytics_snapshot.db'))
+    app.config['SNAPSHOT_REFRESH_SECONDS'] = 300  # Default interval of refresh-snapshot --every
+    # Password hashing processes per web worker (see password_hashing.py), 0 to hash
+    # on the request thread, and how many more hashes may wait for one
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+    app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+    if config:
+        app.config.update(config)
+    
+    if app.config['TRUSTED_PROXY_HOPS']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
+    
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    sampling_profiler.init_app(app, current_user_is_admin)
+    password_hashing.configure(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'])
+    if app.config['SQL_PROFILER']:
+        with app.app_context():
+            sql_profiler.init_app(app, db.engine, current_user_is_admin)
+    return app
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -103,14 +156,66 @@ def load_user(user_id):
         return admin_user
     return User.query.get(int(user_id))
 
+@bp.before_app_request
+def assign_session_id():
+    """Give every browser session an id so its events can be grouped"""
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+
+def snapshot_engine():
+    """Engine of the analytics snapshot, or None if it is disabled or not written yet.
+
+    NullPool: every request opens the file afresh, so it sees a snapshot
+    that was replaced since the last one.
+    """
+    path = current_app.config['ANALYTICS_SNAPSHOT']
+    if not path or not os.path.exists(path):
+        return None
+    engines = current_app.extensions.setdefault('analytics_snapshot', {})
+    if path not in engines:
+        engines[path] = create_engine(f'sqlite:///{snapshot.uri(path)}&uri=true', poolclass=NullPool)
+    return engines[path]
+
+def reads_snapshot(view):
+    """Run a read-only admin report against the analytics snapshot when there is one.
+
+    Reports built on the snapshot show (and send as X-Data-As-Of) when
+    its data was copied. Views that write, or that show something just
+    written (export status, retention after a refresh), stay on the live
+    database.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        engine = snapshot_engine()
+        if engine is not None:
+            g.snapshot_engine = engine
+            g.data_as_of = snapshot.taken_at(current_app.config['ANALYTICS_SNAPSHOT'])
+        return view(*args, **kwargs)
+    return wrapper
+
+@bp.app_context_processor
+def inject_data_as_of():
+    return {'data_as_of': g.get('data_as_of')}
+
+@bp.after_app_request
+def add_data_as_of_header(response):
+    if g.get('data_as_of'):
+        response.headers['X-Data-As-Of'] = g.data_as_of.isoformat()
+    return response
+
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
     track_event('page_view', 'homepage', 'page')
     courses = Course.query.all()
     return render_template('index.html', courses=courses)
 
-@app.route('/register', methods=['GET', 'POST'])
+def too_busy(template):
+    """503 for a login or registration that found the password hashing queue full"""
+    flash('Lots of people are signing in right now. Please try again in a few seconds.', 'error')
+    return render_template(template), 503, {'Retry-After': str(password_hashing.QUEUE_WAIT)}
+
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -119,112 +224,154 @@ def register():
         
         if User.query.filter_by(username=username).first():
             flash('Username already exists')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         
         if User.query.filter_by(email=email).first():
             flash('Email already registered')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         
-        user = User(username=username, email=email, password_hash=generate_password_hash(password))
+        try:
+            password_hash = password_hashing.hash_password(password)
+        except password_hashing.Busy:
+            return too_busy('register.html')
+        user = User(username=username, email=email, password_hash=password_hash)
         db.session.add(user)
         db.session.commit()
         
         flash('Registration successful! Please login.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     track_event('page_view', 'register_page', 'page')
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid = bool(user) and password_hashing.check_password(user.password_hash, password)
+        except password_hashing.Busy:
+            return too_busy('login.html')
+        if valid:
             login_user(user)
             track_event('login', 'login_button', 'button', user_id=user.id)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid username or password')
     
     track_event('page_view', 'login_page', 'page')
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     track_event('logout', 'logout_button', 'button')
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
     track_event('page_view', 'dashboard', 'page')
     courses = Course.query.all()
-    return render_template('dashboard.html', courses=courses)
+    # Lessons and this student's completions and quiz scores per course, in one
+    # query that looks up lesson_progress by its (user_id, lesson_id) key
+    rows = db.session.query(
+        Lesson.course_id, db.func.count(Lesson.id), db.func.count(LessonProgress.completed_at),
+        db.func.sum(LessonProgress.quiz_best_score), db.func.count(LessonProgress.quiz_best_score)
+    ).outerjoin(LessonProgress, db.and_(LessonProgress.lesson_id == Lesson.id,
+                                        LessonProgress.user_id == current_user.id)
+    ).group_by(Lesson.course_id).all()
+    progress = {course_id: {'lessons': lessons, 'completed': completed}
+                for course_id, lessons, completed, _, _ in rows}
+    score_total = sum(row[3] or 0.0 for row in rows)
+    scores = sum(row[4] for row in rows)
+    return render_template('dashboard.html', courses=courses, progress=progress,
+                           lessons_completed=sum(row[2] for row in rows),
+                           average_score=round(score_total / scores) if scores else None)
 
-@app.route('/course/<int:course_id>')
+@bp.route('/course/<int:course_id>')
 @login_required
 def course_detail(course_id):
     track_event('page_view', f'course_{course_id}', 'page')
     course = Course.query.get_or_404(course_id)
-    lessons = Lesson.query.filter_by(course_id=course_id).order_by(Lesson.order).all()
-    return render_template('course_detail.html', course=course, lessons=lessons)
+    rows = db.session.query(Lesson, LessonProgress).outerjoin(
+        LessonProgress, db.and_(LessonProgress.lesson_id == Lesson.id, LessonProgress.user_id == current_user.id)
+    ).filter(Lesson.course_id == course_id).order_by(Lesson.order).all()
+    lessons = [lesson for lesson, _ in rows]
+    progress = {lesson.id: row for lesson, row in rows if row is not None}
+    return render_template('course_detail.html', course=course, lessons=lessons, progress=progress,
+                           completed=sum(1 for row in progress.values() if row.completed_at))
 
-@app.route('/lesson/<int:lesson_id>')
+@bp.route('/lesson/<int:lesson_id>')
 @login_required
 def lesson_detail(lesson_id):
     track_event('page_view', f'lesson_{lesson_id}', 'page')
     lesson = Lesson.query.get_or_404(lesson_id)
     return render_template('lesson_detail.html', lesson=lesson)
 
-@app.route('/api/track_event', methods=['POST'])
+@bp.route('/api/track_event', methods=['POST'])
 def api_track_event():
-    """API endpoint for tracking events from frontend"""
-    data = request.get_json()
+    """API endpoint for tracking events from frontend.
+
+    Accepts either a single event or a batch of the form
+    {"events": [...], "sent_at": <ms>}, optionally gzip-compressed.
+    Rate limits are applied before the body is parsed and before any
+    ORM object is built, so rejected uploads cost very little.
+    """
+    limits = current_app.config['RATE_LIMITS']
+    enabled = current_app.config['RATE_LIMIT_ENABLED']
+    if enabled:
+        wait = rate_limiter.allow_request(get_client_ip(), limits)
+        if wait:
+            return rate_limited_response(wait)
     
-    event_type = data.get('event_type')
-    element_id = data.get('element_id')
-    element_type = data.get('element_type')
-    page_url = data.get('page_url')
-    additional_data = data.get('additional_data', {})
+    try:
+        data = read_tracking_payload()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
-    # Extract video-specific data
-    video_id = additional_data.get('video_id')
-    video_action = additional_data.get('video_action')
-    video_time = additional_data.get('video_time')
+    if isinstance(data.get('events'), list):
+        events_data = data['events']
+        sent_at = data.get('sent_at')
+    else:
+        events_data = [data]
+        sent_at = None
     
-    # Extract quiz-specific data
-    quiz_id = additional_data.get('quiz_id')
-    question_id = additional_data.get('question_id')
-    answer_selected = additional_data.get('answer_selected')
+    # Events with fields of the wrong type are dropped here rather than
+    # failing the insert of the whole batch, which the client would retry forever
+    uploaded = len(events_data)
+    events_data = [event_data for event_data in map(clean_event_data, events_data) if event_data]
+    received = len(events_data)
+    throttled = 0
+    if enabled:
+        events_data, wait = rate_limiter.admit_events(event_budget_key(), events_data, limits)
+        if wait:
+            return rate_limited_response(wait)
+        throttled = received - len(events_data)
     
-    event = ClickstreamEvent(
-        user_id=current_user.id if current_user.is_authenticated else None,
-        session_id=session.get('session_id', 'anonymous'),
-        event_type=event_type,
-        element_id=element_id,
-        element_type=element_type,
-        page_url=page_url,
-        additional_data=json.dumps(additional_data),
-        ip_address=get_client_ip(),
-        video_id=video_id,
-        video_action=video_action,
-        video_time=video_time,
-        quiz_id=quiz_id,
-        question_id=question_id,
-        answer_selected=answer_selected
-    )
+    events = [build_clickstream_event(event_data, sent_at) for event_data in events_data]
+    admitted = len(events)
+    events = filter_duplicate_events(events)
+    enrich_events(events)
     
-    db.session.add(event)
-    db.session.commit()
+    events = store_new_events(events)
+    recent_event_ids.add([event.event_id for event in events if event.event_id])
     
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'received': received, 'invalid': uploaded - received, 'throttled': throttled,
+                    'duplicates': admitted - len(events)})
 
-@app.route('/api/quiz-questions/<int:lesson_id>')
+@bp.route('/api/tracking_config')
+def api_tracking_config():
+    """Publish the client-side sampling and batching settings"""
+    response = jsonify(get_tracking_config())
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+@bp.route('/api/quiz-questions/<int:lesson_id>')
 @login_required
 def get_quiz_questions(lesson_id):
     """Get quiz questions for a specific lesson"""
@@ -241,7 +388,7 @@ def get_quiz_questions(lesson_id):
     
     return jsonify({'questions': quiz_data})
 
-@app.route('/api/submit_quiz', methods=['POST'])
+@bp.route('/api/submit_quiz', methods=['POST'])
 @login_required
 def submit_quiz():
     """Submit quiz answers and track results"""
@@ -279,6 +426,8 @@ def submit_quiz():
         answers=json.dumps(answers)
     )
     db.session.add(quiz_attempt)
+    record_quiz_attempt(quiz_attempt)
+    record_quiz_progress(quiz_attempt)
     db.session.commit()
     
     # Track quiz completion
@@ -288,41 +437,58 @@ def submit_quiz():
     return jsonify({'score': score, 'correct_count': correct_count, 'total_questions': total_questions})
 
 # Admin routes
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
         admin_user = AdminUser.query.filter_by(username=username).first()
-        if admin_user and check_password_hash(admin_user.password_hash, password):
+        try:
+            valid = bool(admin_user) and password_hashing.check_password(admin_user.password_hash, password)
+        except password_hashing.Busy:
+            return too_busy('admin_login.html')
+        if valid:
             login_user(admin_user)
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
         else:
             flash('Invalid admin credentials', 'error')
     
     return render_template('admin_login.html')
 
-@app.route('/admin/dashboard')
+@bp.route('/admin/dashboard')
 @login_required
+@reads_snapshot
 def admin_dashboard():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Get summary statistics
     total_users = User.query.count()
-    total_events = ClickstreamEvent.query.count()
-    total_meaningful_events = ClickstreamEvent.query.filter(
+    # Sampled event types are weighted back up to the number of events they stand for
+    weighted_count = db.func.sum(db.text(event_data.WEIGHT_SQL))
+    total_events = int(db.session.query(weighted_count).select_from(ClickstreamEvent).scalar() or 0)
+    total_meaningful_events = int(db.session.query(weighted_count).select_from(ClickstreamEvent).filter(
         ~ClickstreamEvent.event_type.in_(['mouse_movement', 'visibility_change', 'time_on_page', 'scroll'])
-    ).count()
+    ).scalar() or 0)
     total_courses = Course.query.count()
     total_lessons = Lesson.query.count()
+    today = datetime.utcnow().date()
+    visitors = unique_visitors('site', today - timedelta(days=6), today, key='').get(
+        '', dict.fromkeys(UNIQUE_METRICS, 0))
+    
+    # Most clicked elements from the heavy-hitter summaries, not the event table
+    top_field = request.args.get('top', 'element_id')
+    if top_field not in TOP_CLICK_FIELDS:
+        top_field = 'element_id'
+    top_click_panels = {window: top_clicks(top_field, window) for window in TOP_CLICK_WINDOWS}
     
     # Get recent meaningful events (filter out excessive tracking and scroll events)
-    meaningful_events = ClickstreamEvent.query.filter(
+    meaningful_events = db.session.execute(event_reads.select_events(
+        event_reads.RECENT_COLUMNS,
         ~ClickstreamEvent.event_type.in_(['mouse_movement', 'visibility_change', 'time_on_page', 'scroll'])
-    ).order_by(ClickstreamEvent.timestamp.desc()).limit(20).all()
+    ).order_by(ClickstreamEvent.timestamp.desc()).limit(20)).all()
     
         # Get click analytics by category
     click_analytics = db.session.query(
@@ -342,121 +508,317 @@ def admin_dashboard():
                            total_meaningful_events=total_meaningful_events,
                            total_courses=total_courses,
                            total_lessons=total_lessons,
+                           visitors=visitors,
+                           top_field=top_field,
+                           top_click_panels=top_click_panels,
                            recent_events=meaningful_events,
                            click_analytics=click_analytics)
 
-@app.route('/admin/export-excel')
+@bp.route('/admin/export-excel')
 @login_required
+@reads_snapshot
 def export_excel():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Get meaningful clickstream events (filter out excessive tracking and scroll events)
-    events = db.session.query(
-        ClickstreamEvent, User.username, User.email
-    ).outerjoin(User, ClickstreamEvent.user_id == User.id).filter(
-        ~ClickstreamEvent.event_type.in_(['mouse_movement', 'visibility_change', 'time_on_page', 'scroll'])
-    ).order_by(ClickstreamEvent.timestamp.desc()).all()
-    
-    # Create Excel workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "User Analytics"
-    
-    # Define headers
-    headers = ['Time', 'Event Context', 'Component', 'Event Name', 'Description', 'Origin', 'IP Address']
-    
-    # Style the header row
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Add headers
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
-    # Add data rows
-    for row, (event, username, email) in enumerate(events, 2):
-        # Time - More precise format
-        ws.cell(row=row, column=1, value=event.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3])
-        
-        # Event Context (page URL)
-        ws.cell(row=row, column=2, value=event.page_url or 'N/A')
-        
-        # Component (element type)
-        ws.cell(row=row, column=3, value=event.element_type or 'N/A')
-        
-        # Event Name (event type)
-        ws.cell(row=row, column=4, value=event.event_type)
-        
-        # Description (additional data or element details)
-        description = 'N/A'
-        if event.additional_data:
-            try:
-                data = json.loads(event.additional_data)
-                if isinstance(data, dict):
-                    description = ', '.join([f"{k}: {v}" for k, v in data.items()])
-                else:
-                    description = str(data)
-            except:
-                description = event.additional_data
-        elif event.element_id:
-            description = f"Element: {event.element_id}"
-        ws.cell(row=row, column=5, value=description)
-        
-        # Origin (user info)
-        origin = 'Anonymous'
-        if username:
-            origin = f"User: {username} ({email})"
-        ws.cell(row=row, column=6, value=origin)
-        
-        # IP Address
-        ws.cell(row=row, column=7, value=event.ip_address or 'N/A')
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Save to BytesIO
+    events = event_reads.stream(db.session.connection(), exports.export_select(exports.normalize_filters({})))
+    
+    # Small exports can still be downloaded directly; large ones should go
+    # through /admin/exports so they are built outside the request
     excel_file = BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
+    exports.write_xlsx(excel_file, (exports.export_row(event, event.username, event.email) for event in events))
     
     return excel_file.getvalue(), 200, {
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'Content-Type': exports.FORMATS['xlsx'],
         'Content-Disposition': 'attachment; filename=user_analytics.xlsx'
     }
 
-@app.route('/admin/user-activity')
+@bp.route('/admin/exports')
+@login_required
+def admin_exports():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    jobs = ExportJob.query.order_by(ExportJob.created_at.desc()).limit(20).all()
+    return render_template('admin_exports.html', jobs=[export_job_to_dict(job) for job in jobs],
+                           formats=list(exports.FORMATS))
+
+@bp.route('/admin/api/exports', methods=['GET', 'POST'])
+@login_required
+def admin_api_exports():
+    """Submit an export job (POST) or list recent ones (GET).
+
+    POST body: {"format": "csv", "date_from": "2024-01-01", "date_to":
+    "2024-01-31", "event_types": [...], "user_id": 2, "include_noise": false}.
+    An identical export of unchanged data returns the existing job.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    if request.method == 'GET':
+        jobs = ExportJob.query.order_by(ExportJob.created_at.desc()).limit(50).all()
+        return jsonify({'jobs': [export_job_to_dict(job) for job in jobs]})
+    
+    params = request.get_json(silent=True) or request.form.to_dict()
+    export_format = params.get('format', 'xlsx')
+    if export_format not in exports.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(exports.FORMATS)}"}), 400
+    try:
+        filters = exports.normalize_filters(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job, created = submit_export(export_format, filters)
+    return jsonify(export_job_to_dict(job)), 202 if created else 200
+
+@bp.route('/admin/api/exports/<job_id>')
+@login_required
+def admin_api_export_status(job_id):
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    job = db.session.get(ExportJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify(export_job_to_dict(job))
+
+@bp.route('/admin/exports/<job_id>/download')
+@login_required
+def download_export(job_id):
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.status != 'done' or not os.path.exists(job.file_path or ''):
+        flash('That export is not available. Please request it again.', 'error')
+        return redirect(url_for('main.admin_exports'))
+    return send_file(job.file_path, mimetype=exports.FORMATS[job.format], as_attachment=True,
+                     download_name=f'user_analytics_{job.created_at:%Y%m%d_%H%M%S}.{job.format}')
+
+def submit_export(export_format, filters):
+    """Queue an export, or return a job that already covers it.
+
+    Returns (job, created). A matching finished job is reused while its file
+    exists, and a matching job still in progress is shared rather than
+    started twice.
+    """
+    key = exports.cache_key(export_format, filters, exports.data_version(db.session.connection()))
+    for job in ExportJob.query.filter_by(cache_key=key).order_by(ExportJob.created_at.desc()):
+        if exports.is_reusable(job):
+            return job, False
+    
+    job = ExportJob(id=uuid.uuid4().hex, format=export_format, filters=json.dumps(filters),
+                    cache_key=key, status='queued', requested_by=current_user.username)
+    db.session.add(job)
+    db.session.commit()
+    
+    database_url = db.engine.url.render_as_string(hide_password=False)
+    pool = exports.get_pool(current_app.config['EXPORT_WORKERS'])
+    pool.submit(exports.run_export, job.id, database_url, current_app.config['EXPORT_DIR'])
+    return job, True
+
+def export_job_to_dict(job):
+    status = job.status
+    error = job.error
+    if exports.is_stale(job):
+        status, error = 'failed', 'The export worker stopped before finishing'
+    progress = None
+    if status == 'done':
+        progress = 1.0
+    elif job.rows_total:
+        progress = round(min(job.rows_done / job.rows_total, 1.0), 3)
+    elif job.rows_total == 0:
+        progress = 0.0
+    return {
+        'id': job.id,
+        'format': job.format,
+        'filters': json.loads(job.filters or '{}'),
+        'status': status,
+        'progress': progress,
+        'rows_total': job.rows_total,
+        'rows_done': job.rows_done,
+        'file_size': job.file_size,
+        'error': error,
+        'requested_by': job.requested_by,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': url_for('main.download_export', job_id=job.id) if status == 'done' else None
+    }
+
+FEED_CONSUMER_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+
+def feed_consumer_to_dict(consumer, latest):
+    return {
+        'name': consumer.name,
+        'position': consumer.position,
+        'lag': max(latest - (consumer.position or 0), 0),
+        'created_at': consumer.created_at.isoformat() if consumer.created_at else None,
+        'updated_at': consumer.updated_at.isoformat() if consumer.updated_at else None
+    }
+
+def commit_feed_offset(name, position, rewind=False):
+    """Move a feed consumer's offset, registering the consumer on first use.
+
+    Raises ValueError for a position past the newest event, or behind the
+    current offset without `rewind` (a late commit from an overlapping run
+    must not send a consumer back over events it has loaded).
+    """
+    if not FEED_CONSUMER_NAME.match(name or ''):
+        raise ValueError('consumer names are up to 100 letters, digits, dots, dashes and underscores')
+    if not isinstance(position, int) or isinstance(position, bool) or position < 0:
+        raise ValueError('position must be a non-negative event id')
+    if position > change_feed.latest_id(db.session.connection()):
+        raise ValueError('position is past the newest event')
+    consumer = db.session.get(FeedConsumer, name)
+    if consumer is None:
+        consumer = FeedConsumer(name=name, position=0)
+        db.session.add(consumer)
+    elif position < (consumer.position or 0) and not rewind:
+        raise ValueError(f'position is behind the committed offset {consumer.position}; pass rewind to re-read')
+    consumer.position = position
+    consumer.updated_at = datetime.utcnow()
+    db.session.commit()
+    return consumer
+
+@bp.route('/admin/api/feed/events')
+@login_required
+def admin_api_feed_events():
+    """Events after a watermark as NDJSON, e.g. ?after=1200&limit=10000 or ?consumer=warehouse.
+
+    With consumer= (and no after=) the feed starts after that consumer's
+    committed offset. At most `limit` events are sent, oldest first, and
+    streamed as they are read. X-Feed-Cursor holds the id of the last one,
+    the after= of the next request, and X-Feed-More says whether newer
+    events are waiting. Each line carries its id, so an interrupted
+    download resumes after the last complete line. Reading never moves
+    an offset; commit it with POST /admin/api/feed/consumers/<name>.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    if request.args.get('after'):
+        try:
+            after = int(request.args['after'])
+        except ValueError:
+            return jsonify({'error': 'after must be an event id'}), 400
+    elif request.args.get('consumer'):
+        consumer = db.session.get(FeedConsumer, request.args['consumer'])
+        if consumer is None:
+            return jsonify({'error': 'Unknown consumer; commit an offset for it first (0 to start at the beginning)'}), 404
+        after = consumer.position or 0
+    else:
+        after = 0
+    limit = min(max(request.args.get('limit', change_feed.DEFAULT_LIMIT, type=int), 1), change_feed.MAX_LIMIT)
+    
+    upto, more = change_feed.window_end(db.session.connection(), after, limit)
+    lines = change_feed.ndjson_lines(change_feed.iter_records(db.engine, after, upto))
+    return Response(lines, mimetype='application/x-ndjson', headers={
+        'X-Feed-After': str(after),
+        'X-Feed-Cursor': str(upto),
+        'X-Feed-More': 'true' if more else 'false'
+    })
+
+@bp.route('/admin/api/feed/consumers')
+@login_required
+def admin_api_feed_consumers():
+    """Registered feed consumers with their offsets and how many events they are behind"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    latest = change_feed.latest_id(db.session.connection())
+    consumers = FeedConsumer.query.order_by(FeedConsumer.name).all()
+    return jsonify({'latest_id': latest, 'consumers': [feed_consumer_to_dict(c, latest) for c in consumers]})
+
+@bp.route('/admin/api/feed/consumers/<name>', methods=['GET', 'POST', 'DELETE'])
+@login_required
+def admin_api_feed_consumer(name):
+    """A consumer's offset (GET), commit a new one (POST {"position": 1200}) or forget the consumer (DELETE).
+
+    Commit the id of the last event loaded, once the load itself has
+    committed downstream. Moving an offset backwards needs "rewind": true.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+        try:
+            consumer = commit_feed_offset(name, params.get('position'), rewind=bool(params.get('rewind')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(feed_consumer_to_dict(consumer, change_feed.latest_id(db.session.connection())))
+    
+    consumer = db.session.get(FeedConsumer, name)
+    if consumer is None:
+        return jsonify({'error': 'Consumer not found'}), 404
+    if request.method == 'DELETE':
+        db.session.delete(consumer)
+        db.session.commit()
+        return jsonify({'deleted': name})
+    return jsonify(feed_consumer_to_dict(consumer, change_feed.latest_id(db.session.connection())))
+
+@bp.cli.command('feed-events')
+@click.option('--consumer', help="Start after this consumer's offset and commit the new offset once the output is written")
+@click.option('--after', type=int, help='Start after this event id instead')
+@click.option('--limit', type=int, help='Write at most this many events')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='NDJSON file to write (default: standard output)')
+@click.option('--no-commit', is_flag=True, help="Leave the consumer's offset where it is")
+def feed_events(consumer, after, limit, output, no_commit):
+    """Write the events after a watermark as NDJSON, e.g. for a nightly warehouse load"""
+    if after is None:
+        registered = db.session.get(FeedConsumer, consumer) if consumer else None
+        after = (registered.position or 0) if registered else 0
+    if limit:
+        upto, more = change_feed.window_end(db.session.connection(), after, limit)
+    else:
+        upto, more = max(change_feed.latest_id(db.session.connection()), after), False
+    
+    target = open(output + '.part', 'w', encoding='utf-8') if output else click.get_text_stream('stdout')
+    written = 0
+    try:
+        for line in change_feed.ndjson_lines(change_feed.iter_records(db.engine, after, upto)):
+            target.write(line)
+            written += 1
+        target.flush()
+        if output:
+            os.fsync(target.fileno())
+    finally:
+        if output:
+            target.close()
+    if output:
+        os.replace(output + '.part', output)
+    
+    if consumer and not no_commit:
+        try:
+            commit_feed_offset(consumer, upto)
+        except ValueError as e:
+            raise click.ClickException(f"Offset of {consumer} not committed: {e}")
+    # Progress goes to stderr so it never mixes with NDJSON on stdout
+    click.echo(f"Wrote {written} events after id {after} up to id {upto}"
+               + (" (more waiting)" if more else ""), err=True)
+
+@bp.route('/admin/user-activity')
 @login_required
+@reads_snapshot
 def admin_user_activity():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Get all meaningful events with user information
-    events = db.session.query(
-        ClickstreamEvent, User.username, User.email
-    ).outerjoin(User, ClickstreamEvent.user_id == User.id).filter(
-        ~ClickstreamEvent.event_type.in_(['mouse_movement', 'visibility_change', 'time_on_page', 'scroll'])
-    ).order_by(ClickstreamEvent.timestamp.desc()).all()
+    events = event_reads.stream(db.session.connection(), event_reads.select_events(
+        event_reads.ACTIVITY_COLUMNS,
+        ~ClickstreamEvent.event_type.in_(exports.NOISY_EVENT_TYPES)
+    ).order_by(ClickstreamEvent.timestamp.desc()))
     
     # Process events to create detailed descriptions
     processed_events = []
-    for event, username, email in events:
+    for event in events:
+        username, email = event.username, event.email
         # Create event context (page URL)
         event_context = event.page_url or 'N/A'
         if event.page_url:
@@ -519,15 +881,11 @@ def admin_user_activity():
         elif event.event_type == 'logout':
             description += f" logged out of the system"
         elif event.event_type == 'quiz_action':
-            if event.additional_data:
-                try:
-                    data = json.loads(event.additional_data)
-                    if 'score' in data:
-                        description += f" completed a quiz with score {data['score']}%"
-                    elif 'answer_selected' in data:
-                        description += f" answered a quiz question"
-                except:
-                    description += f" performed a quiz action"
+            data = event_data.load(event)
+            if 'score' in data:
+                description += f" completed a quiz with score {data['score']}%"
+            elif 'answer_selected' in data:
+                description += f" answered a quiz question"
             else:
                 description += f" performed a quiz action"
         elif event.event_type == 'video_action':
@@ -537,18 +895,14 @@ def admin_user_activity():
                 description += f" interacted with video content"
         
         # Add additional context
-        if event.additional_data:
-            try:
-                data = json.loads(event.additional_data)
-                if 'button_text' in data:
-                    description += f" (Button: '{data['button_text']}')"
-                elif 'link_text' in data:
-                    description += f" (Link: '{data['link_text']}')"
-            except:
-                pass
-        
-        # Origin (web, mobile, etc.)
-        origin = 'web'  # Default to web
+        button_text, link_text = event.button_text, event.link_text
+        if event.additional_data:  # Stored before these had their own columns
+            data = event_data.load(event)
+            button_text, link_text = data.get('button_text'), data.get('link_text')
+        if button_text is not None:
+            description += f" (Button: '{button_text}')"
+        elif link_text is not None:
+            description += f" (Link: '{link_text}')"
         
         processed_events.append({
             'timestamp': event.timestamp,
@@ -556,7 +910,7 @@ def admin_user_activity():
             'component': component,
             'event_name': event_name,
             'description': description,
-            'origin': origin,
+            'origin': event_origin(event),
             'ip_address': event.ip_address or 'N/A',
             'username': username or 'Anonymous',
             'email': email or 'N/A'
@@ -564,14 +918,653 @@ def admin_user_activity():
     
     return render_template('admin_user_activity.html', events=processed_events)
 
+@bp.route('/admin/api/videos')
+@login_required
+@reads_snapshot
+def admin_api_videos():
+    """Watch coverage, rewatch heatmap and drop-off points for every video"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    videos = VideoStats.query.order_by(VideoStats.video_id).all()
+    return jsonify({'videos': [video_stats_to_dict(video) for video in videos]})
+
+@bp.route('/admin/api/videos/<video_id>')
+@login_required
+@reads_snapshot
+def admin_api_video_detail(video_id):
+    """Watch statistics for one video, including each viewer's coverage"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    video = VideoStats.query.get_or_404(video_id)
+    result = video_stats_to_dict(video)
+    
+    watches = db.session.query(VideoWatch, User.username).join(
+        User, VideoWatch.user_id == User.id
+    ).filter(VideoWatch.video_id == video_id).order_by(VideoWatch.watched_seconds.desc()).all()
+    result['users'] = [{
+        'user_id': watch.user_id,
+        'username': username,
+        'watched_seconds': round(watch.watched_seconds or 0.0, 1),
+        'coverage': round(watch.watched_seconds / video.duration, 4) if video.duration else 0.0,
+        'intervals': json.loads(watch.intervals or '[]'),
+        'dropoff_seconds': (watch.dropoff_bucket * video_analytics.BUCKET_SECONDS
+                            if watch.dropoff_bucket is not None else None)
+    } for watch, username in watches]
+    
+    return jsonify(result)
+
+def video_stats_to_dict(video):
+    """Serialize a VideoStats row, converting heatmap seconds into view counts"""
+    bucket_seconds = video_analytics.BUCKET_SECONDS
+    average_coverage = 0.0
+    if video.viewers and video.duration:
+        average_coverage = video.watched_seconds / (video.viewers * video.duration)
+    
+    return {
+        'video_id': video.video_id,
+        'duration': video.duration,
+        'viewers': video.viewers,
+        'average_coverage': round(min(average_coverage, 1.0), 4),
+        'bucket_seconds': bucket_seconds,
+        'heatmap': [round(seconds / bucket_seconds, 2) for seconds in json.loads(video.heatmap or '[]')],
+        'dropoffs': json.loads(video.dropoffs or '[]'),
+        'updated_at': video.updated_at.isoformat() if video.updated_at else None
+    }
+
+@bp.route('/admin/funnel')
+@login_required
+@reads_snapshot
+def admin_funnel():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    pages_param = request.args.get('pages', '')
+    pages = parse_funnel_pages(pages_param)
+    steps = funnel_conversion(pages) if pages else []
+    
+    from_page = navigation_analytics.normalize_page(request.args.get('from', ''))
+    query = PageTransition.query
+    if from_page:
+        query = query.filter_by(from_page=from_page)
+    transitions = [transition_to_dict(t) for t in
+                   query.order_by(PageTransition.count.desc()).limit(50).all()]
+    
+    return render_template('admin_funnel.html', pages_param=pages_param, steps=steps,
+                           from_page=from_page or '', transitions=transitions)
+
+@bp.route('/admin/api/funnel')
+@login_required
+@reads_snapshot
+def admin_api_funnel():
+    """Step conversion for an ordered list of pages, e.g. ?pages=/course/1,/lesson/1,/lesson/3"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    pages = parse_funnel_pages(request.args.get('pages', ''))
+    if not pages:
+        return jsonify({'error': 'Pass at least one page in ?pages='}), 400
+    return jsonify({'steps': funnel_conversion(pages)})
+
+@bp.route('/admin/api/transitions')
+@login_required
+@reads_snapshot
+def admin_api_transitions():
+    """Most common page transitions, optionally only those leaving ?from=<page>"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    query = PageTransition.query
+    from_page = navigation_analytics.normalize_page(request.args.get('from', ''))
+    if from_page:
+        query = query.filter_by(from_page=from_page)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    transitions = query.order_by(PageTransition.count.desc()).limit(limit).all()
+    return jsonify({'transitions': [transition_to_dict(t) for t in transitions]})
+
+def parse_funnel_pages(pages_param, max_steps=10):
+    """Split a comma-separated list of page URLs into normalized funnel steps"""
+    pages = [navigation_analytics.normalize_page(page.strip())
+             for page in pages_param.split(',') if page.strip()]
+    return pages[:max_steps]
+
+@bp.route('/admin/retention')
+@login_required
+def admin_retention():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    weeks = min(max(request.args.get('weeks', 12, type=int), 1), 52)
+    cohorts, computed_at = cohort_retention(weeks)
+    return render_template('admin_retention.html', cohorts=cohorts, weeks=weeks,
+                           computed_at=computed_at)
+
+@bp.route('/admin/retention/refresh', methods=['POST'])
+@login_required
+def admin_retention_refresh():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    retention.refresh_retention(db.session.connection())
+    db.session.commit()
+    flash('Retention refreshed with the latest activity.')
+    return redirect(url_for('main.admin_retention'))
+
+@bp.route('/admin/api/retention')
+@login_required
+def admin_api_retention():
+    """Weekly signup-cohort retention, e.g. ?weeks=8 for weeks 0-7 after signup"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    weeks = min(max(request.args.get('weeks', 12, type=int), 1), 52)
+    cohorts, computed_at = cohort_retention(weeks)
+    return jsonify({
+        'computed_at': computed_at.isoformat() if computed_at else None,
+        'cohorts': cohorts
+    })
+
+def cohort_retention(weeks):
+    """The materialized retention matrix and when it was last refreshed"""
+    cohorts = [(row.cohort_week, row.users) for row in RetentionCohort.query.all()]
+    activity = [(row.cohort_week, row.activity_week, row.active_users)
+                for row in CohortActivity.query.all()]
+    refreshed = [db.session.query(db.func.max(RetentionCohort.computed_at)).scalar(),
+                 db.session.query(db.func.max(CohortActivity.computed_at)).scalar()]
+    computed_at = max([timestamp for timestamp in refreshed if timestamp], default=None)
+    return retention.retention_matrix(cohorts, activity, weeks), computed_at
+
+@bp.route('/admin/search')
+@login_required
+@reads_snapshot
+def admin_search():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    events, lessons = [], []
+    if query:
+        events = search_events(query, limit=50, offset=(page - 1) * 50)
+        lessons = search_lessons(query, limit=10) if page == 1 else []
+    
+    return render_template('admin_search.html', query=query, page=page,
+                           events=events, lessons=lessons)
+
+@bp.route('/admin/api/search')
+@login_required
+@reads_snapshot
+def admin_api_search():
+    """Ranked full-text search over events and lessons, e.g. ?q=submit+quiz&scope=events"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    query = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'all')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if not query:
+        return jsonify({'error': 'Pass a search query in ?q='}), 400
+    
+    result = {'query': query}
+    if scope in ('all', 'events'):
+        result['events'] = [dict(event, timestamp=event['timestamp'].isoformat() if event['timestamp'] else None)
+                            for event in search_events(query, limit, offset)]
+    if scope in ('all', 'lessons'):
+        result['lessons'] = [dict(lesson, snippet=str(lesson['snippet']))
+                             for lesson in search_lessons(query, limit, offset)]
+    return jsonify(result)
+
+def search_events(query, limit=50, offset=0):
+    """Events whose element id, page URL, button or link text match, best first"""
+    match = search_index.build_fts_query(query)
+    if not match:
+        return []
+    
+    rows = db.session.execute(db.text("""
+        SELECT ce.id, ce.timestamp, ce.event_type, ce.element_id, ce.element_type,
+               ce.page_url, ce.button_text, ce.link_text, ce.additional_data, ce.ip_address, u.username
+        FROM (SELECT rowid, rank FROM event_search WHERE event_search MATCH :match
+              ORDER BY rank LIMIT :limit OFFSET :offset) AS hits
+        JOIN clickstream_event ce ON ce.id = hits.rowid
+        LEFT JOIN user u ON ce.user_id = u.id
+        ORDER BY hits.rank
+    """), {'match': match, 'limit': limit, 'offset': offset}).mappings().all()
+    
+    events = []
+    for row in rows:
+        event = dict(row)
+        if isinstance(event['timestamp'], str):
+            event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+        event['username'] = event['username'] or 'Anonymous'
+        button_text, link_text = event.pop('button_text'), event.pop('link_text')
+        if event.pop('additional_data'):  # Stored before button and link text had columns
+            data = event_data.load(row)
+            button_text, link_text = data.get('button_text'), data.get('link_text')
+        event['label'] = button_text or link_text
+        events.append(event)
+    return events
+
+def search_lessons(query, limit=10, offset=0):
+    """Lessons matching by title or content, with a highlighted snippet"""
+    match = search_index.build_fts_query(query)
+    if not match:
+        return []
+    
+    rows = db.session.execute(db.text("""
+        SELECT l.id, l.title, l.content_type, l.course_id,
+               snippet(lesson_search, -1, :start, :end, '...', 16) AS snippet
+        FROM lesson_search
+        JOIN lesson l ON l.id = lesson_search.rowid
+        WHERE lesson_search MATCH :match
+        ORDER BY rank LIMIT :limit OFFSET :offset
+    """), {'match': match, 'limit': limit, 'offset': offset,
+           'start': search_index.HIGHLIGHT_START, 'end': search_index.HIGHLIGHT_END}).mappings().all()
+    
+    lessons = []
+    for row in rows:
+        lesson = dict(row)
+        lesson['snippet'] = Markup(str(escape(lesson['snippet'] or ''))
+                                   .replace(search_index.HIGHLIGHT_START, '<mark>')
+                                   .replace(search_index.HIGHLIGHT_END, '</mark>'))
+        lessons.append(lesson)
+    return lessons
+
+@bp.route('/admin/users')
+@login_required
+@reads_snapshot
+def admin_users():
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    rows = db.session.query(User, UserActivitySummary).outerjoin(
+        UserActivitySummary, UserActivitySummary.user_id == User.id
+    ).order_by(UserActivitySummary.last_seen.desc().nullslast(), User.id).limit(50).offset((page - 1) * 50).all()
+    users = [user_summary_to_dict(summary, user) for user, summary in rows]
+    
+    return render_template('admin_users.html', users=users, page=page)
+
+@bp.route('/admin/users/<int:user_id>')
+@login_required
+@reads_snapshot
+def admin_user_detail(user_id):
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    user = User.query.get_or_404(user_id)
+    profile = user_summary_to_dict(db.session.get(UserActivitySummary, user_id), user)
+    lesson_titles = dict(db.session.query(Lesson.id, Lesson.title).filter(
+        Lesson.id.in_(profile['lessons_viewed'] + [int(k) for k in profile['quiz_best_scores']])
+    ).all())
+    
+    return render_template('admin_user_detail.html', profile=profile, lesson_titles=lesson_titles)
+
+@bp.route('/admin/api/users/<int:user_id>')
+@login_required
+@reads_snapshot
+def admin_api_user_detail(user_id):
+    """A student's activity summary as JSON"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    user = User.query.get_or_404(user_id)
+    return jsonify(user_summary_to_dict(db.session.get(UserActivitySummary, user_id), user))
+
+@bp.route('/admin/api/rate_limits')
+@login_required
+def admin_api_rate_limits():
+    """Tracking endpoint admission counters, summed over all workers sharing the store"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    return jsonify({
+        'enabled': current_app.config['RATE_LIMIT_ENABLED'],
+        'shared': isinstance(rate_limiter.store, rate_limit.SharedMemoryBucketStore),
+        'limits': current_app.config['RATE_LIMITS'],
+        'counters': rate_limiter.store.read_counters()
+    })
+
+@bp.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    """Recent request profiles. Profile a page by opening it with ?_profile=1"""
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    profiles = sampling_profiler.list_profiles(current_app.config['PROFILE_DIR'])
+    return render_template('admin_profiles.html', profiles=profiles,
+                           sample_rate=current_app.config['PROFILE_SAMPLE_RATE'])
+
+@bp.route('/admin/profiles/<name>')
+@login_required
+def admin_profile_detail(name):
+    if not current_user_is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    
+    directory = current_app.config['PROFILE_DIR']
+    path = sampling_profiler.profile_path(directory, name, '.folded')
+    if path is None:
+        flash('Profile not found; it may have been replaced by newer ones.', 'error')
+        return redirect(url_for('main.admin_profiles'))
+    with open(sampling_profiler.profile_path(directory, name, '.json'), encoding='utf-8') as f:
+        profile = dict(json.load(f), name=name)
+    samples, functions = sampling_profiler.hottest_functions(path)
+    return render_template('admin_profile_detail.html', profile=profile, samples=samples, functions=functions)
+
+@bp.route('/admin/profiles/<name>/download')
+@login_required
+def download_profile(name):
+    """The collapsed stacks, for flamegraph.pl or https://www.speedscope.app"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    path = sampling_profiler.profile_path(current_app.config['PROFILE_DIR'], name, '.folded')
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name + '.folded')
+
+def current_user_is_admin():
+    """Check whether the logged-in account is an admin"""
+    return current_user.is_authenticated and getattr(current_user, 'is_admin', False)
+
 def get_client_ip():
-    """Get the client's IP address"""
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    elif request.headers.get('X-Real-IP'):
-        return request.headers.get('X-Real-IP')
-    else:
-        return request.remote_addr
+    """Get the client's IP address.
+
+    Headers such as X-Forwarded-For are set by the client unless a proxy
+    replaces them, so they are only read through ProxyFix, which takes
+    the address TRUSTED_PROXY_HOPS proxies back (see create_app()).
+    """
+    return request.remote_addr
+
+def event_budget_key():
+    """Who an upload's events are charged to: the logged-in account, else the client IP.
+
+    Not the session id: a client that drops its cookie gets a new one,
+    and with it fresh budgets, on every request.
+    """
+    if current_user.is_authenticated:
+        kind = 'admin' if isinstance(current_user._get_current_object(), AdminUser) else 'user'
+        return f'{kind}:{current_user.id}'
+    return f'ip:{get_client_ip()}'
+
+def get_tracking_config():
+    """Get the tracking config, merging tracking_config.json over the defaults"""
+    path = current_app.config['TRACKING_CONFIG_FILE']
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return DEFAULT_TRACKING_CONFIG
+    
+    if _tracking_config_cache.get('mtime') != mtime:
+        config = dict(DEFAULT_TRACKING_CONFIG)
+        try:
+            with open(path, encoding='utf-8') as f:
+                overrides = json.load(f)
+            config.update(overrides)
+            config['sample_rates'] = {**DEFAULT_TRACKING_CONFIG['sample_rates'],
+                                      **overrides.get('sample_rates', {})}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Ignoring invalid tracking config {path}: {e}")
+            config = DEFAULT_TRACKING_CONFIG
+        _tracking_config_cache.update(mtime=mtime, config=config)
+    return _tracking_config_cache['config']
+
+_tracking_config_cache = {}
+
+def read_tracking_payload():
+    """Read the JSON body of a tracking upload, decompressing gzip bodies"""
+    body = request.get_data(cache=False)
+    limit = current_app.config['MAX_TRACKING_PAYLOAD']
+    
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, limit)
+        except zlib.error:
+            raise ValueError('Invalid gzip payload')
+        if decompressor.unconsumed_tail:
+            raise ValueError('Payload too large')
+    elif len(body) > limit:
+        raise ValueError('Payload too large')
+    
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise ValueError('Invalid JSON payload')
+    if not isinstance(data, dict):
+        raise ValueError('Payload must be a JSON object')
+    return data
+
+def rate_limited_response(wait):
+    """429 telling the client how long to back off"""
+    response = jsonify({'status': 'error', 'message': 'Too many tracking requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(min(wait, 3600)) + 1)
+    return response
+
+def store_events(events):
+    """Insert events and update the aggregates in one transaction"""
+    db.session.add_all(events)
+    update_aggregates(events)
+    db.session.commit()
+
+# Times an upload is stored again after finding event ids that other workers stored first
+STORE_ATTEMPTS = 3
+
+def store_new_events(events):
+    """store_events() for the events whose event_id no other worker has stored meanwhile.
+
+    Between filter_duplicate_events() and the commit another worker may
+    store a retry of the same events; the unique index then fails the
+    insert, and the batch is stored again without them. Returns the
+    events stored. Other constraint errors are raised.
+    """
+    for attempt in range(STORE_ATTEMPTS):
+        try:
+            store_events(events)
+            return events
+        except IntegrityError:
+            db.session.rollback()
+            existing = find_existing_event_ids([event.event_id for event in events if event.event_id])
+            if not existing or attempt == STORE_ATTEMPTS - 1:
+                raise
+            events = [event for event in events if event.event_id not in existing]
+            for event in events:
+                event.id = None  # May have been assigned by the failed flush
+
+def filter_duplicate_events(events):
+    """Drop events whose client event_id was already stored.
+
+    Ids this worker stored recently are rejected from memory. Only ids
+    the Bloom filter cannot rule out are looked up in the database; the
+    unique index on event_id catches anything that slips through.
+    """
+    batch_ids = set()
+    unique_events = []
+    to_check = []
+    for event in events:
+        if event.event_id:
+            if event.event_id in batch_ids or recent_event_ids.seen(event.event_id):
+                continue
+            batch_ids.add(event.event_id)
+            if recent_event_ids.maybe_seen(event.event_id):
+                to_check.append(event.event_id)
+        unique_events.append(event)
+    
+    if to_check:
+        existing = find_existing_event_ids(to_check)
+        unique_events = [event for event in unique_events if event.event_id not in existing]
+    return unique_events
+
+def find_existing_event_ids(event_ids):
+    """Which of these client event ids are already stored"""
+    if not event_ids:
+        return set()
+    return set(db.session.scalars(
+        db.select(ClickstreamEvent.event_id).where(ClickstreamEvent.event_id.in_(event_ids))
+    ))
+
+# Top-level fields of an uploaded event stored in text columns
+EVENT_TEXT_FIELDS = ('event_type', 'element_id', 'element_type', 'page_url')
+
+def text_value(value, length):
+    """A text column value: strings and numbers as strings of at most `length`, else None"""
+    if isinstance(value, str):
+        return value[:length]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)[:length]
+    return None
+
+def float_value(value):
+    """A float column value: finite numbers, or strings holding one, else None"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    return None
+
+def clean_event_data(data):
+    """One uploaded event with its text fields coerced to strings, or None if it cannot be stored"""
+    if not isinstance(data, dict):
+        return None
+    cleaned = dict(data)
+    for name in EVENT_TEXT_FIELDS:
+        if data.get(name) is None:
+            continue
+        cleaned[name] = text_value(data[name], ClickstreamEvent.__table__.c[name].type.length)
+        if cleaned[name] is None:
+            return None
+    return cleaned if cleaned.get('event_type') else None
+
+def build_clickstream_event(data, sent_at=None):
+    """Build a ClickstreamEvent from one event posted by clickstream.js"""
+    additional_data = data.get('additional_data') or {}
+    if not isinstance(additional_data, dict):
+        additional_data = {'value': additional_data}
+    
+    # Batched events are queued on the client before upload, so back-date
+    # them by their age in the queue (measured on the client's own clock)
+    timestamp = datetime.utcnow()
+    client_ts = data.get('client_ts')
+    client_timestamp = None
+    if isinstance(client_ts, (int, float)) and not isinstance(client_ts, bool):
+        try:
+            client_timestamp = datetime.utcfromtimestamp(client_ts / 1000)
+        except (OverflowError, OSError, ValueError):
+            client_ts = None
+    if isinstance(sent_at, (int, float)) and isinstance(client_ts, (int, float)):
+        age_ms = min(max(sent_at - client_ts, 0), 24 * 60 * 60 * 1000)
+        timestamp -= timedelta(milliseconds=age_ms)
+    
+    event_id = data.get('event_id')
+    if not isinstance(event_id, str) or not 0 < len(event_id) <= 64:
+        event_id = None
+    
+    # Video- and quiz-specific data get their own columns; values of the
+    # wrong type are left out of them but kept in the event's extra data
+    columns = {}
+    for key in event_data.COLUMN_KEYS:
+        if key == 'video_time':
+            columns[key] = float_value(additional_data.get(key))
+        else:
+            columns[key] = text_value(additional_data.get(key), ClickstreamEvent.__table__.c[key].type.length)
+    return ClickstreamEvent(
+        user_id=current_user.id if current_user.is_authenticated else None,
+        session_id=session.get('session_id', 'anonymous'),
+        event_type=data.get('event_type'),
+        element_id=data.get('element_id'),
+        element_type=data.get('element_type'),
+        page_url=data.get('page_url'),
+        timestamp=timestamp,
+        event_id=event_id,
+        client_timestamp=client_timestamp,
+        ip_address=get_client_ip(),
+        **columns,
+        **event_data.pack(additional_data, columns)
+    )
+
+def enrich_events(events):
+    """Fill in device, browser, OS and location from the request that sent the events"""
+    device_type, browser, os_name = enrichment.parse_user_agent(request.headers.get('User-Agent', ''))
+    country, region = enrichment.locate_ip(get_client_ip(), current_app.config['GEOIP_DATABASE'])
+    for event in events:
+        event.device_type = device_type
+        event.browser = browser
+        event.os = os_name
+        event.country = country
+        event.region = region
+
+@bp.cli.command('compact-event-data')
+def compact_event_data():
+    """Split the additional_data JSON of older events into columns and compact payloads.
+
+    Also moves the sample_rate of sampled event types stored before it
+    had a column out of their payloads, so the aggregates weight them.
+    """
+    table = ClickstreamEvent.__table__
+    columns = [table.c.id] + [table.c[name] for name in event_reads.EVENT_DATA_COLUMNS]
+    sampled_types = [event_type for event_type, rate in get_tracking_config()['sample_rates'].items() if rate < 1]
+    compacted = last_id = 0
+    while True:
+        rows = db.session.execute(db.select(*columns).where(
+            db.or_(table.c.additional_data.is_not(None),
+                   db.and_(table.c.sample_rate.is_(None), table.c.extra_data.is_not(None),
+                           table.c.event_type.in_(sampled_types))),
+            table.c.id > last_id
+        ).order_by(table.c.id).limit(5000)).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            values = event_data.pack(event_data.load(row), {key: getattr(row, key) for key in event_data.COLUMN_KEYS})
+            updates.append(dict(values, row_id=row.id, additional_data=None))
+        db.session.execute(table.update().where(table.c.id == db.bindparam('row_id')), updates)
+        db.session.commit()
+        compacted += len(rows)
+        last_id = rows[-1].id
+    print(f"Compacted {compacted} events; run VACUUM on the database to return the freed space")
+
+@bp.cli.command('locate-events')
+def locate_events():
+    """Fill in country and region of stored events from the IP range database"""
+    path = current_app.config['GEOIP_DATABASE']
+    if enrichment.get_ip_ranges(path) is None:
+        print(f"No IP range database at {path} (set GEOIP_DATABASE)")
+        return
+    
+    addresses = db.session.scalars(db.select(ClickstreamEvent.ip_address).distinct().where(
+        ClickstreamEvent.country.is_(None), ClickstreamEvent.ip_address.is_not(None))).all()
+    located = 0
+    for ip in addresses:
+        country, region = enrichment.locate_ip(ip, path)
+        if country:
+            located += db.session.execute(db.update(ClickstreamEvent).where(
+                ClickstreamEvent.ip_address == ip, ClickstreamEvent.country.is_(None)
+            ).values(country=country, region=region)).rowcount
+    db.session.commit()
+    print(f"Located {located} events from {len(addresses)} addresses")
+
+def event_origin(event):
+    """'Chrome on Windows (desktop), Maharashtra, IN' for the activity report"""
+    if not event.browser:
+        return 'web'  # Recorded before devices were captured
+    origin = f"{event.browser} on {event.os} ({event.device_type})"
+    if event.country:
+        origin += ', ' + ', '.join(part for part in (event.region, event.country) if part)
+    return origin
 
 def track_event(event_type, element_id, element_type, user_id=None, additional_data=None):
     """Helper function to track events"""
@@ -582,69 +1575,960 @@ def track_event(event_type, element_id, element_type, user_id=None, additional_d
         element_id=element_id,
         element_type=element_type,
         page_url=request.url,
-        additional_data=json.dumps(additional_data) if additional_data else None,
-        ip_address=get_client_ip()
+        ip_address=get_client_ip(),
+        **event_data.pack(additional_data)
     )
+    enrich_events([event])
     db.session.add(event)
+    update_aggregates([event])
+    db.session.commit()
+
+def update_aggregates(events):
+    """Fold newly ingested events into the incrementally maintained tables.
+
+    Called with the events already added to the session, before commit,
+    so the aggregates are written in the same transaction as the events.
+    """
+    update_video_watch(events)
+    update_navigation(events)
+    update_user_summaries(events)
+    update_unique_visitors(events)
+    update_top_clicks(events)
+    update_event_counts(events)
+    update_lesson_progress(events)
+
+# Events handed to an aggregate's update function at a time when rebuilding it
+REPLAY_BATCH_SIZE = 1000
+
+def replay_events(query, update):
+    """Feed the events of `query` to `update` in batches, as ingest would, for the rebuild commands.
+
+    Returns the number of events replayed.
+    """
+    batch = []
+    replayed = 0
+    for event in query.yield_per(REPLAY_BATCH_SIZE):
+        batch.append(event)
+        if len(batch) == REPLAY_BATCH_SIZE:
+            update(batch)
+            replayed += len(batch)
+            batch = []
+    update(batch)
+    return replayed + len(batch)
+
+def event_weight(event):
+    """How many events an event counts for in the aggregates; more than 1 for client-sampled types"""
+    return event_data.weight(event.sample_rate)
+
+# Gaps between a student's events longer than this are idle time, not active time
+ACTIVE_IDLE_TIMEOUT_SECONDS = 5 * 60
+# Activity spans kept for merging late events into; uploads are back-dated
+# by at most a day, so anything older is final
+ACTIVE_SPANS_KEPT_SECONDS = 2 * 24 * 60 * 60
+
+def add_activity(spans, at):
+    """Add an event at `at` (epoch seconds) to a student's activity spans.
+
+    Spans are sorted, and events no more than the idle timeout apart
+    share one, so the spans' total length is the sum of the short gaps
+    between the events in time order, whatever order they arrived in.
+    Returns the change in total length.
+    """
+    merged = [at, at]
+    before = 0.0
+    kept = []
+    for start, end in spans:
+        if start - ACTIVE_IDLE_TIMEOUT_SECONDS <= merged[1] and merged[0] <= end + ACTIVE_IDLE_TIMEOUT_SECONDS:
+            before += end - start
+            merged = [min(start, merged[0]), max(end, merged[1])]
+        else:
+            kept.append([start, end])
+    kept.append(merged)
+    kept.sort()
+    spans[:] = kept
+    return (merged[1] - merged[0]) - before
+
+LESSON_PAGE = re.compile(r'^/lesson/(\d+)$')
+COURSE_PAGE = re.compile(r'^/course/(\d+)$')
+
+def get_user_summary(user_id, summaries=None):
+    """Load or create a student's UserActivitySummary, caching it in `summaries`"""
+    if summaries is not None and user_id in summaries:
+        return summaries[user_id]
+    summary = db.session.get(UserActivitySummary, user_id)
+    if summary is None:
+        summary = UserActivitySummary(user_id=user_id, total_events=0, event_counts='{}',
+                                      lessons_viewed='[]', active_seconds=0.0, active_spans='[]', quiz_attempts=0,
+                                      quiz_score_total=0.0, quiz_best_scores='{}')
+        db.session.add(summary)
+    if summaries is not None:
+        summaries[user_id] = summary
+    return summary
+
+def update_user_summaries(events):
+    """Add new events to each student's running activity summary"""
+    summaries = {}
+    counts = {}
+    lessons = {}
+    spans = {}
+    
+    for event in events:
+        if not event.user_id:
+            continue
+        summary = get_user_summary(event.user_id, summaries)
+        timestamp = event.timestamp or datetime.utcnow()
+        
+        # Batched events arrive back-dated, often before events stored
+        # earlier, so they are merged into the spans rather than compared
+        # with last_seen
+        user_spans = spans.setdefault(event.user_id, json.loads(summary.active_spans or '[]'))
+        added = add_activity(user_spans, (timestamp - datetime(1970, 1, 1)).total_seconds())
+        summary.active_seconds = (summary.active_seconds or 0.0) + added
+        if not summary.last_seen or timestamp > summary.last_seen:
+            summary.last_seen = timestamp
+        if not summary.first_seen or timestamp < summary.first_seen:
+            summary.first_seen = timestamp
+        weight = event_weight(event)
+        summary.total_events = (summary.total_events or 0) + weight
+        
+        event_counts = counts.setdefault(event.user_id, json.loads(summary.event_counts or '{}'))
+        event_counts[event.event_type] = event_counts.get(event.event_type, 0) + weight
+        
+        if event.event_type == 'page_view':
+            match = LESSON_PAGE.match(navigation_analytics.event_page(event.page_url) or '')
+            if match:
+                viewed = lessons.setdefault(event.user_id, set(json.loads(summary.lessons_viewed or '[]')))
+                viewed.add(int(match.group(1)))
+    
+    for user_id, event_counts in counts.items():
+        summaries[user_id].event_counts = json.dumps(event_counts)
+    for user_id, user_spans in spans.items():
+        # Spans too old to grow are already counted in active_seconds
+        newest = user_spans[-1][1]
+        summaries[user_id].active_spans = json.dumps(
+            [span for span in user_spans if span[1] >= newest - ACTIVE_SPANS_KEPT_SECONDS])
+    for user_id, viewed in lessons.items():
+        summaries[user_id].lessons_viewed = json.dumps(sorted(viewed))
+
+def record_quiz_attempt(quiz_attempt):
+    """Add a quiz attempt to the student's best and average scores"""
+    summary = get_user_summary(quiz_attempt.user_id)
+    summary.quiz_attempts = (summary.quiz_attempts or 0) + 1
+    summary.quiz_score_total = (summary.quiz_score_total or 0.0) + quiz_attempt.score
+    best_scores = json.loads(summary.quiz_best_scores or '{}')
+    lesson_key = str(quiz_attempt.lesson_id)
+    best_scores[lesson_key] = max(best_scores.get(lesson_key, 0.0), quiz_attempt.score)
+    summary.quiz_best_scores = json.dumps(best_scores)
+
+def user_summary_to_dict(summary, user):
+    """Serialize a student's activity summary"""
+    best_scores = json.loads(summary.quiz_best_scores or '{}') if summary else {}
+    attempts = summary.quiz_attempts if summary else 0
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'registered_at': user.created_at.isoformat() if user.created_at else None,
+        'first_seen': summary.first_seen.isoformat() if summary and summary.first_seen else None,
+        'last_seen': summary.last_seen.isoformat() if summary and summary.last_seen else None,
+        'total_events': summary.total_events if summary else 0,
+        'event_counts': json.loads(summary.event_counts or '{}') if summary else {},
+        'lessons_viewed': json.loads(summary.lessons_viewed or '[]') if summary else [],
+        'active_seconds': round(summary.active_seconds or 0.0) if summary else 0,
+        'quiz_attempts': attempts,
+        'quiz_average_score': round(summary.quiz_score_total / attempts, 1) if attempts else None,
+        'quiz_best_score': max(best_scores.values()) if best_scores else None,
+        'quiz_best_scores': best_scores
+    }
+
+@bp.cli.command('rebuild-user-summaries')
+def rebuild_user_summaries():
+    """Rebuild every UserActivitySummary from the event and quiz attempt tables"""
+    UserActivitySummary.query.delete()
+    
+    query = ClickstreamEvent.query.filter(
+        ClickstreamEvent.user_id.isnot(None)
+    ).order_by(ClickstreamEvent.timestamp, ClickstreamEvent.id)
+    
+    replayed = replay_events(query, update_user_summaries)
+    
+    for quiz_attempt in QuizAttempt.query.order_by(QuizAttempt.id).yield_per(1000):
+        record_quiz_attempt(quiz_attempt)
+    db.session.commit()
+    print(f"Replayed {replayed} events")
+
+# A video lesson is completed by playing it to the end having watched this much of it
+VIDEO_COMPLETE_PERCENT = 90
+# A quiz lesson is completed by a submission scoring at least this
+QUIZ_PASS_SCORE = 60
+
+LESSON_COMPLETE = re.compile(r'^lesson_(\d+)_complete$')
+
+def get_lesson_progress(user_id, lesson_id, progress=None):
+    """Load or create a student's LessonProgress for a lesson, caching it in `progress`"""
+    key = (user_id, lesson_id)
+    if progress is not None and key in progress:
+        return progress[key]
+    row = db.session.get(LessonProgress, key)
+    if row is None:
+        row = LessonProgress(user_id=user_id, lesson_id=lesson_id, viewed=False)
+        db.session.add(row)
+    if progress is not None:
+        progress[key] = row
+    return row
+
+def complete_lesson(row, timestamp):
+    """Record when a lesson was first completed; replayed events may arrive out of order"""
+    if row.completed_at is None or timestamp < row.completed_at:
+        row.completed_at = timestamp
+
+def update_lesson_progress(events):
+    """Fold lesson views, text lesson completions and video watching into LessonProgress.
+
+    Runs after update_video_watch(), whose merged intervals give the
+    watched percentage of video lessons.
+    """
+    progress = {}
+    lessons = {}
+    videos = {}  # (user_id, lesson_id) -> time the student played the video to the end, or None
+    
+    def lesson_for(lesson_id):
+        if lesson_id not in lessons:
+            lessons[lesson_id] = db.session.get(Lesson, lesson_id)
+        return lessons[lesson_id]
+    
+    for event in events:
+        if not event.user_id:
+            continue
+        timestamp = event.timestamp or datetime.utcnow()
+        
+        if event.event_type == 'page_view':
+            match = LESSON_PAGE.match(navigation_analytics.event_page(event.page_url) or '')
+            if match and lesson_for(int(match.group(1))):
+                row = get_lesson_progress(event.user_id, int(match.group(1)), progress)
+                row.viewed = True
+                if row.first_viewed_at is None or timestamp < row.first_viewed_at:
+                    row.first_viewed_at = timestamp
+        elif event.event_type == 'lesson_action':
+            match = LESSON_COMPLETE.match(event.element_id or '')
+            lesson = lesson_for(int(match.group(1))) if match else None
+            if lesson and lesson.content_type == 'text':
+                complete_lesson(get_lesson_progress(event.user_id, lesson.id, progress), timestamp)
+        elif event.video_action and str(event.video_id).isdigit() and lesson_for(int(event.video_id)):
+            # Video lessons play the video whose id is the lesson id
+            key = (event.user_id, int(event.video_id))
+            ended = videos.get(key)
+            if event.video_action == 'complete' and (ended is None or timestamp < ended):
+                ended = timestamp
+            videos[key] = ended
+    
+    for (user_id, lesson_id), ended in videos.items():
+        watch = VideoWatch.query.filter_by(user_id=user_id, video_id=str(lesson_id)).first()
+        video_stats = db.session.get(VideoStats, str(lesson_id))
+        if watch is None or not (video_stats and video_stats.duration):
+            continue
+        row = get_lesson_progress(user_id, lesson_id, progress)
+        row.video_watched_percent = round(min(100.0, 100.0 * (watch.watched_seconds or 0.0) / video_stats.duration), 1)
+        if (ended and lessons[lesson_id].content_type == 'video'
+                and row.video_watched_percent >= VIDEO_COMPLETE_PERCENT):
+            complete_lesson(row, ended)
+    
+    for row in progress.values():
+        row.updated_at = datetime.utcnow()
+
+def record_quiz_progress(quiz_attempt):
+    """Add a quiz attempt to the student's progress through the quiz lesson"""
+    row = get_lesson_progress(quiz_attempt.user_id, quiz_attempt.lesson_id)
+    if row.quiz_best_score is None or quiz_attempt.score > row.quiz_best_score:
+        row.quiz_best_score = quiz_attempt.score
+    if quiz_attempt.score >= QUIZ_PASS_SCORE:
+        complete_lesson(row, quiz_attempt.completed_at or datetime.utcnow())
+    row.updated_at = datetime.utcnow()
+
+@bp.cli.command('rebuild-lesson-progress')
+def rebuild_lesson_progress():
+    """Rebuild every LessonProgress row from the event and quiz attempt tables.
+
+    Video percentages come from the current VideoWatch rows, so run
+    rebuild-video-stats first if those are being rebuilt too.
+    """
+    LessonProgress.query.delete()
+    
+    query = ClickstreamEvent.query.filter(
+        ClickstreamEvent.user_id.isnot(None),
+        db.or_(ClickstreamEvent.event_type.in_(('page_view', 'lesson_action')),
+               ClickstreamEvent.video_action.isnot(None))
+    ).order_by(ClickstreamEvent.timestamp, ClickstreamEvent.id)
+    
+    replayed = replay_events(query, update_lesson_progress)
+    
+    for quiz_attempt in QuizAttempt.query.order_by(QuizAttempt.id).yield_per(1000):
+        record_quiz_progress(quiz_attempt)
+    db.session.commit()
+    print(f"Replayed {replayed} events")
+
+UNIQUE_DIMENSIONS = ('site', 'page', 'lesson', 'course')
+UNIQUE_METRICS = ('users', 'sessions', 'ips')
+
+def is_site_page(page):
+    """Whether a path is a page this app serves, so arbitrary client-sent paths get no sketches"""
+    try:
+        current_app.url_map.bind('localhost').match(page, method='GET')
+    except HTTPException:
+        return False
+    return True
+
+def unique_visitor_keys(page):
+    """The (dimension, key) sketches an event on this page is counted in.
+
+    Only pages of the site, and lessons and courses that exist, are
+    counted: page_url comes from the client, and every new key costs a
+    row of sketches.
+    """
+    keys = [('site', '')]
+    if not page or not is_site_page(page):
+        return keys
+    lesson_match = LESSON_PAGE.match(page)
+    course_match = COURSE_PAGE.match(page)
+    if lesson_match:
+        lesson = db.session.get(Lesson, int(lesson_match.group(1)))
+        if not lesson:
+            return keys
+        keys.extend([('page', page), ('lesson', lesson_match.group(1)), ('course', str(lesson.course_id))])
+    elif course_match:
+        if not db.session.get(Course, int(course_match.group(1))):
+            return keys
+        keys.extend([('page', page), ('course', course_match.group(1))])
+    else:
+        keys.append(('page', page))
+    return keys
+
+def update_unique_visitors(events):
+    """Count each event's user, session and IP in the daily sketches it belongs to.
+
+    Sketches are only written back when a register changed, which after
+    the first few events of a visit is almost never.
+    """
+    sketches = {}
+    changed = set()
+    
+    for event in events:
+        day = (event.timestamp or datetime.utcnow()).date()
+        values = {'users': event.user_id, 'sessions': event.session_id, 'ips': event.ip_address}
+        for dimension, key in unique_visitor_keys(navigation_analytics.event_page(event.page_url)):
+            sketch_key = (dimension, key, day)
+            if sketch_key not in sketches:
+                row = db.session.get(UniqueVisitorSketch, sketch_key)
+                if row is None:
+                    empty = unique_counts.pack(unique_counts.new_sketch())
+                    row = UniqueVisitorSketch(dimension=dimension, key=key, day=day,
+                                              users=empty, sessions=empty, ips=empty)
+                    db.session.add(row)
+                sketches[sketch_key] = (row, {metric: unique_counts.unpack(getattr(row, metric))
+                                              for metric in UNIQUE_METRICS})
+            registers = sketches[sketch_key][1]
+            for metric, value in values.items():
+                if value is not None and unique_counts.add(registers[metric], value):
+                    changed.add(sketch_key)
+    
+    for sketch_key in changed:
+        row, registers = sketches[sketch_key]
+        for metric in UNIQUE_METRICS:
+            setattr(row, metric, unique_counts.pack(registers[metric]))
+
+def unique_visitors(dimension, start, end, key=None):
+    """Estimated unique users, sessions and IPs per key between two dates (inclusive).
+
+    Daily sketches in the range are merged, so a visitor seen on several
+    days is counted once. Returns {key: {'users': n, 'sessions': n, 'ips': n}}.
+    """
+    query = UniqueVisitorSketch.query.filter(
+        UniqueVisitorSketch.dimension == dimension,
+        UniqueVisitorSketch.day >= start,
+        UniqueVisitorSketch.day <= end
+    )
+    if key is not None:
+        query = query.filter(UniqueVisitorSketch.key == key)
+    
+    merged = {}
+    for row in query.yield_per(100):
+        if row.key not in merged:
+            merged[row.key] = {metric: unique_counts.unpack(getattr(row, metric)) for metric in UNIQUE_METRICS}
+        else:
+            for metric in UNIQUE_METRICS:
+                unique_counts.merge(merged[row.key][metric], unique_counts.unpack(getattr(row, metric)))
+    return {sketch_key: {metric: unique_counts.estimate(registers[metric]) for metric in UNIQUE_METRICS}
+            for sketch_key, registers in merged.items()}
+
+@bp.route('/admin/api/uniques')
+@login_required
+@reads_snapshot
+def admin_api_uniques():
+    """Unique users/sessions/IPs, e.g. ?dimension=page&key=/lesson/1&start=2024-01-01&end=2024-01-31.
+
+    Without a key every page, lesson or course in the range is listed,
+    most unique users first. The range defaults to the last 30 days;
+    by_day=1 adds one estimate per day.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    dimension = request.args.get('dimension', 'site')
+    if dimension not in UNIQUE_DIMENSIONS:
+        return jsonify({'error': f"dimension must be one of {', '.join(UNIQUE_DIMENSIONS)}"}), 400
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.utcnow().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    
+    key = '' if dimension == 'site' else request.args.get('key')
+    result = {'dimension': dimension, 'start': start.isoformat(), 'end': end.isoformat()}
+    if key is None:
+        totals = unique_visitors(dimension, start, end)
+        result['keys'] = sorted(({'key': k, **counts} for k, counts in totals.items()),
+                                key=lambda item: item['users'], reverse=True)
+        return jsonify(result)
+    
+    empty = dict.fromkeys(UNIQUE_METRICS, 0)
+    result.update(key=key, **unique_visitors(dimension, start, end, key).get(key, empty))
+    if request.args.get('by_day') in ('1', 'true'):
+        rows = UniqueVisitorSketch.query.filter(
+            UniqueVisitorSketch.dimension == dimension,
+            UniqueVisitorSketch.key == key,
+            UniqueVisitorSketch.day >= start,
+            UniqueVisitorSketch.day <= end
+        ).all()
+        by_day = {row.day: {metric: unique_counts.estimate(unique_counts.unpack(getattr(row, metric)))
+                           for metric in UNIQUE_METRICS}
+                  for row in rows}
+        result['days'] = [{'day': (start + timedelta(days=i)).isoformat(),
+                           **by_day.get(start + timedelta(days=i), empty)}
+                          for i in range((end - start).days + 1)]
+    return jsonify(result)
+
+@bp.cli.command('rebuild-unique-visitors')
+def rebuild_unique_visitors():
+    """Rebuild the unique visitor sketches from the event table"""
+    UniqueVisitorSketch.query.delete()
+    
+    replayed = replay_events(ClickstreamEvent.query.order_by(ClickstreamEvent.id), update_unique_visitors)
+    db.session.commit()
+    print(f"Replayed {replayed} events")
+
+TOP_CLICK_FIELDS = ('element_id', 'page_url', 'button_text')
+# Window -> (summary period, number of most recent buckets merged)
+TOP_CLICK_WINDOWS = {'hour': ('hour', 1), 'day': ('hour', 24), 'week': ('day', 7)}
+HOURLY_TOP_CLICKS_KEPT = timedelta(days=2)  # Older hourly summaries are no longer shown
+
+def click_field_values(event):
+    """The values of a click event that the top-click summaries count"""
+    button_text = event.button_text
+    if event.additional_data:  # Stored before button_text had a column
+        button_text = event_data.load(event).get('button_text')
+    if button_text:
+        button_text = ' '.join(str(button_text).split())[:200]
+    return {
+        'element_id': event.element_id,
+        'page_url': navigation_analytics.event_page(event.page_url),
+        'button_text': button_text
+    }
+
+def summary_bucket_start(timestamp, period):
+    if period == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def update_top_clicks(events):
+    """Count clicked elements, pages and button texts in hourly and daily Space-Saving summaries"""
+    batches = {}
+    for event in events:
+        if event.event_type != 'click':
+            continue
+        timestamp = event.timestamp or datetime.utcnow()
+        for field, value in click_field_values(event).items():
+            if not value:
+                continue
+            for period in ('hour', 'day'):
+                counts = batches.setdefault((field, period, summary_bucket_start(timestamp, period)), {})
+                counts[value] = counts.get(value, 0) + event_weight(event)
+    
+    new_hour = False
+    for (field, period, bucket_start), counts in batches.items():
+        row = db.session.get(TopClickSummary, (field, period, bucket_start))
+        if row is None:
+            row = TopClickSummary(field=field, period=period, bucket_start=bucket_start, total=0, counters='{}')
+            db.session.add(row)
+            new_hour = new_hour or period == 'hour'
+        row.counters = json.dumps(heavy_hitters.add_counts(json.loads(row.counters or '{}'), counts))
+        row.total = (row.total or 0) + sum(counts.values())
+    
+    if new_hour:
+        TopClickSummary.query.filter(
+            TopClickSummary.period == 'hour',
+            TopClickSummary.bucket_start < datetime.utcnow() - HOURLY_TOP_CLICKS_KEPT
+        ).delete(synchronize_session=False)
+
+def top_clicks(field, window, limit=20):
+    """Most clicked values of a field in the current hour, last 24 hours or last 7 days"""
+    period, buckets = TOP_CLICK_WINDOWS[window]
+    current = summary_bucket_start(datetime.utcnow(), period)
+    first = current - (timedelta(hours=buckets - 1) if period == 'hour' else timedelta(days=buckets - 1))
+    rows = TopClickSummary.query.filter(
+        TopClickSummary.field == field,
+        TopClickSummary.period == period,
+        TopClickSummary.bucket_start >= first
+    ).all()
+    merged = heavy_hitters.merge(json.loads(row.counters or '{}') for row in rows)
+    return {
+        'total': sum(row.total or 0 for row in rows),
+        'top': [{'value': value, 'count': count, 'max_overcount': error}
+                for value, count, error in heavy_hitters.top(merged, limit)]
+    }
+
+@bp.route('/admin/api/top_clicks')
+@login_required
+@reads_snapshot
+def admin_api_top_clicks():
+    """Most clicked elements, pages or button texts, e.g. ?field=button_text&window=day"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    field = request.args.get('field', 'element_id')
+    window = request.args.get('window', 'day')
+    if field not in TOP_CLICK_FIELDS:
+        return jsonify({'error': f"field must be one of {', '.join(TOP_CLICK_FIELDS)}"}), 400
+    if window not in TOP_CLICK_WINDOWS:
+        return jsonify({'error': f"window must be one of {', '.join(TOP_CLICK_WINDOWS)}"}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    return jsonify({'field': field, 'window': window, **top_clicks(field, window, limit)})
+
+@bp.cli.command('rebuild-top-clicks')
+def rebuild_top_clicks():
+    """Rebuild the top-click summaries from the last week of click events"""
+    TopClickSummary.query.delete()
+    
+    since = summary_bucket_start(datetime.utcnow(), 'day') - timedelta(days=TOP_CLICK_WINDOWS['week'][1] - 1)
+    query = ClickstreamEvent.query.filter(
+        ClickstreamEvent.event_type == 'click',
+        ClickstreamEvent.timestamp >= since
+    ).order_by(ClickstreamEvent.id)
+    
+    replayed = replay_events(query, update_top_clicks)
+    db.session.commit()
+    print(f"Replayed {replayed} events")
+
+def update_event_counts(events):
+    """Count events per type and page in the hourly and daily rollups behind the time-series API"""
+    counts = {}
+    hourly_since = datetime.utcnow() - timeseries.HOURLY_KEPT
+    for event in events:
+        timestamp = event.timestamp or datetime.utcnow()
+        page = navigation_analytics.event_page(event.page_url) or ''
+        for period in ('hour', 'day'):
+            if period == 'hour' and timestamp < hourly_since:
+                continue  # Back-dated or replayed events older than any hourly rollup kept
+            key = (period, summary_bucket_start(timestamp, period), event.event_type, page)
+            counts[key] = counts.get(key, 0) + event_weight(event)
+    
+    new_hour = False
+    for key, count in counts.items():
+        row = db.session.get(EventCountRollup, key)
+        if row is None:
+            period, bucket_start, event_type, page = key
+            row = EventCountRollup(period=period, bucket_start=bucket_start, event_type=event_type, page=page, count=0)
+            db.session.add(row)
+            new_hour = new_hour or period == 'hour'
+        row.count = (row.count or 0) + count
+    
+    if new_hour:
+        EventCountRollup.query.filter(
+            EventCountRollup.period == 'hour',
+            EventCountRollup.bucket_start < summary_bucket_start(hourly_since, 'hour')
+        ).delete(synchronize_session=False)
+
+TIMESERIES_GROUPS = ('none', 'type', 'page')
+
+@bp.route('/admin/api/timeseries')
+@login_required
+@reads_snapshot
+def admin_api_timeseries():
+    """Event counts over time, e.g. ?start=2024-01-01&end=2024-12-31&group_by=type&points=300.
+
+    start and end are dates or ISO timestamps (UTC); the range defaults
+    to the last 7 days. group_by is none, type or page; event_type (comma
+    separated) and page filter the events counted. The bucket size is
+    chosen from the range unless bucket= names one (1m, 5m, 15m, 1h, 6h,
+    1d, 1w), and each series is downsampled to at most `points` points.
+    Only the `series` largest series are returned, the rest are summed
+    into 'other'.
+    """
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    now = datetime.utcnow()
+    try:
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else now
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=7)
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates (YYYY-MM-DD) or ISO timestamps'}), 400
+    if start.tzinfo or end.tzinfo:
+        return jsonify({'error': 'start and end must be UTC times without an offset'}), 400
+    if start >= end:
+        return jsonify({'error': 'start must be before end'}), 400
+    group_by = request.args.get('group_by', 'none')
+    if group_by not in TIMESERIES_GROUPS:
+        return jsonify({'error': f"group_by must be one of {', '.join(TIMESERIES_GROUPS)}"}), 400
+    points = min(max(request.args.get('points', 300, type=int), 10), 2000)
+    series_limit = min(max(request.args.get('series', 10, type=int), 1), 50)
+    event_types = [t.strip() for t in request.args.get('event_type', '').split(',') if t.strip()]
+    page = navigation_analytics.normalize_page(request.args.get('page'))
+    
+    allowed = timeseries.allowed_buckets(start, end, now)
+    if request.args.get('bucket'):
+        bucket = next((b for b in allowed if b[0] == request.args['bucket']), None)
+        if bucket is None:
+            return jsonify({'error': f"bucket must be one of {', '.join(name for name, _ in allowed)} for this range"}), 400
+    else:
+        bucket = timeseries.choose_bucket(start, end, points, now)
+    name, seconds = bucket
+    
+    origin, slots, series = timeseries.count_series(
+        db.session.connection(), start, end, seconds,
+        group_by=None if group_by == 'none' else group_by, event_types=event_types, page=page
+    )
+    series = timeseries.keep_top(series, series_limit)
+    kept = timeseries.downsample(series, points)
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_by': group_by,
+        'bucket': name,
+        'bucket_seconds': seconds,
+        'source': 'rollup' if seconds >= timeseries.HOUR else 'events',
+        'buckets': slots,
+        'downsampled': len(kept) < slots,
+        'timestamps': [timeseries.from_epoch(origin + slot * seconds).isoformat() for slot in kept],
+        'series': [{'key': key, 'total': sum(counts), 'counts': [counts[slot] for slot in kept]}
+                   for key, counts in sorted(series.items(), key=lambda item: sum(item[1]), reverse=True)]
+    })
+
+@bp.cli.command('rebuild-event-counts')
+def rebuild_event_counts():
+    """Rebuild the hourly and daily event count rollups from the event table"""
+    EventCountRollup.query.delete()
+    
+    replayed = replay_events(ClickstreamEvent.query.order_by(ClickstreamEvent.id), update_event_counts)
+    db.session.commit()
+    print(f"Replayed {replayed} events")
+
+def update_video_watch(events):
+    """Merge video play/pause/seek/progress events into watched intervals"""
+    watches = {}
+    stats = {}
+    
+    for event in events:
+        if not (event.video_id is not None and event.video_action and event.user_id):
+            continue
+        try:
+            position = float(event.video_time)
+        except (TypeError, ValueError):
+            continue
+        
+        video_id = str(event.video_id)
+        key = (event.user_id, video_id)
+        watch = watches.get(key)
+        if watch is None:
+            watch = VideoWatch.query.filter_by(user_id=event.user_id, video_id=video_id).first()
+            if watch is None:
+                watch = VideoWatch(user_id=event.user_id, video_id=video_id, intervals='[]',
+                                   watched_seconds=0.0, playing=False)
+                db.session.add(watch)
+            watches[key] = watch
+        
+        video_stats = stats.get(video_id)
+        if video_stats is None:
+            video_stats = db.session.get(VideoStats, video_id)
+            if video_stats is None:
+                video_stats = VideoStats(video_id=video_id, duration=0.0, viewers=0,
+                                         watched_seconds=0.0, heatmap='[]', dropoffs='[]')
+                db.session.add(video_stats)
+            stats[video_id] = video_stats
+        
+        timestamp = event.timestamp or datetime.utcnow()
+        elapsed = (timestamp - watch.last_event_at).total_seconds() if watch.last_event_at else 0.0
+        state = {'playing': watch.playing, 'position': watch.position}
+        segment = video_analytics.advance_playback(state, event.video_action, position, elapsed)
+        watch.playing = state['playing']
+        watch.position = state['position']
+        watch.last_event_at = timestamp
+        video_stats.duration = max(video_stats.duration or 0.0, position)
+        
+        if segment:
+            start, end = segment
+            intervals, added = video_analytics.merge_interval(json.loads(watch.intervals or '[]'), start, end)
+            if not watch.watched_seconds:
+                # First watched segment makes this user a viewer
+                video_stats.viewers = (video_stats.viewers or 0) + 1
+            watch.intervals = json.dumps(intervals)
+            watch.watched_seconds = (watch.watched_seconds or 0.0) + added
+            video_stats.watched_seconds = (video_stats.watched_seconds or 0.0) + added
+            
+            heatmap = video_analytics.add_to_heatmap(json.loads(video_stats.heatmap or '[]'), start, end)
+            video_stats.heatmap = json.dumps(heatmap)
+        
+        # The drop-off point is where the viewer's playback last stopped
+        if (segment or event.video_action in ('pause', 'complete')) and watch.watched_seconds:
+            new_bucket = video_analytics.bucket_for(position)
+            dropoffs = video_analytics.move_dropoff(json.loads(video_stats.dropoffs or '[]'),
+                                                    watch.dropoff_bucket, new_bucket)
+            video_stats.dropoffs = json.dumps(dropoffs)
+            watch.dropoff_bucket = new_bucket
+        video_stats.updated_at = datetime.utcnow()
+
+def update_navigation(events):
+    """Extend the page-transition index and funnel visits with new page views"""
+    positions = {}
+    visits = {}
+    transitions = {}
+    
+    for event in events:
+        page = navigation_analytics.event_page(event.page_url)
+        if event.event_type != 'page_view' or not page or not event.session_id:
+            continue
+        timestamp = event.timestamp or datetime.utcnow()
+        
+        position = positions.get(event.session_id)
+        if position is None:
+            position = db.session.get(SessionNavigation, event.session_id)
+            if position is None:
+                position = SessionNavigation(session_id=event.session_id, page=page,
+                                             entered_at=timestamp, last_seen_at=timestamp)
+                db.session.add(position)
+            positions[event.session_id] = position
+        elif position.last_seen_at and timestamp < position.last_seen_at:
+            # Late events (e.g. a page's own batched page_view) never rewind the session
+            continue
+        
+        record_session_visit(visits, event.session_id, page, timestamp)
+        
+        if page == position.page:
+            # Reload, or the browser-side duplicate of a server-side page view
+            position.last_seen_at = timestamp
+            continue
+        
+        gap = (timestamp - position.last_seen_at).total_seconds()
+        if gap <= navigation_analytics.SESSION_TIMEOUT_SECONDS:
+            key = (position.page, page)
+            transition = transitions.get(key)
+            if transition is None:
+                transition = db.session.get(PageTransition, key)
+                if transition is None:
+                    transition = PageTransition(from_page=position.page, to_page=page,
+                                                count=0, dwell_histogram='{}')
+                    db.session.add(transition)
+                transitions[key] = transition
+            dwell = (timestamp - position.entered_at).total_seconds()
+            transition.count += 1
+            transition.dwell_histogram = json.dumps(navigation_analytics.add_dwell(
+                json.loads(transition.dwell_histogram or '{}'), dwell))
+        
+        position.page = page
+        position.entered_at = timestamp
+        position.last_seen_at = timestamp
+
+def record_session_visit(visits, session_id, page, timestamp):
+    """Update the first/last view time of a page within a session"""
+    key = (session_id, page)
+    visit = visits.get(key)
+    if visit is None:
+        visit = db.session.get(SessionPageVisit, key)
+        if visit is None:
+            visit = SessionPageVisit(session_id=session_id, page=page,
+                                     first_seen=timestamp, last_seen=timestamp, views=0)
+            db.session.add(visit)
+        visits[key] = visit
+    visit.first_seen = min(visit.first_seen, timestamp)
+    visit.last_seen = max(visit.last_seen, timestamp)
+    visit.views += 1
+
+def funnel_conversion(pages):
+    """Count the sessions reaching each step of an ordered list of pages.
+
+    A session reaches step k if it viewed pages[k] after reaching step k-1.
+    Only the first and last view of each page are indexed, so a step is
+    timed at its first view if that came late enough, else its last view.
+    """
+    ctes = ["s0 AS (SELECT session_id, first_seen AS t FROM session_page_visit WHERE page = :p0)"]
+    for i in range(1, len(pages)):
+        ctes.append(
+            f"s{i} AS (SELECT v.session_id, "
+            f"CASE WHEN v.first_seen >= s.t THEN v.first_seen ELSE v.last_seen END AS t "
+            f"FROM session_page_visit v JOIN s{i - 1} s ON v.session_id = s.session_id "
+            f"WHERE v.page = :p{i} AND v.last_seen >= s.t)"
+        )
+    counts = ', '.join(f"(SELECT COUNT(*) FROM s{i})" for i in range(len(pages)))
+    sql = f"WITH {', '.join(ctes)} SELECT {counts}"
+    params = {f'p{i}': page for i, page in enumerate(pages)}
+    row = db.session.execute(db.text(sql), params).one()
+    
+    steps = []
+    for i, (page, sessions) in enumerate(zip(pages, row)):
+        previous = row[i - 1] if i else sessions
+        steps.append({
+            'page': page,
+            'sessions': sessions,
+            'conversion_from_previous': round(sessions / previous, 4) if previous else 0.0,
+            'conversion_from_start': round(sessions / row[0], 4) if row[0] else 0.0
+        })
+    return steps
+
+def transition_to_dict(transition):
+    """Serialize a PageTransition row with its approximate median dwell time"""
+    return {
+        'from_page': transition.from_page,
+        'to_page': transition.to_page,
+        'count': transition.count,
+        'median_dwell_seconds': navigation_analytics.histogram_median(
+            json.loads(transition.dwell_histogram or '{}'))
+    }
+
+@bp.cli.command('refresh-retention')
+@click.option('--full', is_flag=True, help='Recompute every week instead of only the newest ones')
+def refresh_retention_command(full):
+    """Update the cohort retention tables; run nightly, e.g. from cron"""
+    start = retention.refresh_retention(db.session.connection(), full=full)
+    db.session.commit()
+    print(f"Recomputed activity from {start.isoformat()}" if start else "Recomputed all weeks")
+
+@bp.cli.command('refresh-snapshot')
+@click.option('--every', type=int, default=None, is_flag=False, flag_value=-1,
+              help='Keep running and refresh every N seconds (default SNAPSHOT_REFRESH_SECONDS)')
+def refresh_snapshot_command(every):
+    """Copy the database to the read-only analytics snapshot the admin reports read"""
+    path = current_app.config['ANALYTICS_SNAPSHOT']
+    if not path:
+        raise click.ClickException("ANALYTICS_SNAPSHOT is not set")
+    if db.engine.url.get_backend_name() != 'sqlite':
+        raise click.ClickException("Snapshots need a SQLite database; point reports at a read replica instead")
+    if every == -1:
+        every = current_app.config['SNAPSHOT_REFRESH_SECONDS']
+    
+    while True:
+        started = time.monotonic()
+        taken_at = snapshot.refresh(db.engine.url.database, path)
+        elapsed = time.monotonic() - started
+        print(f"Snapshot as of {taken_at:%Y-%m-%d %H:%M:%S} UTC written to {path} in {elapsed:.1f}s", flush=True)
+        if not every:
+            break
+        time.sleep(max(every - elapsed, 1))
+
+@bp.cli.command('rebuild-navigation')
+def rebuild_navigation():
+    """Rebuild the page-transition index by replaying all page views once"""
+    SessionNavigation.query.delete()
+    PageTransition.query.delete()
+    SessionPageVisit.query.delete()
+    
+    query = ClickstreamEvent.query.filter(
+        ClickstreamEvent.event_type == 'page_view'
+    ).order_by(ClickstreamEvent.timestamp, ClickstreamEvent.id)
+    
+    replayed = replay_events(query, update_navigation)
     db.session.commit()
+    print(f"Replayed {replayed} page views")
+
+@bp.cli.command('rebuild-video-stats')
+def rebuild_video_stats():
+    """Rebuild VideoWatch and VideoStats by replaying all video events once"""
+    VideoWatch.query.delete()
+    VideoStats.query.delete()
+    
+    query = ClickstreamEvent.query.filter(
+        ClickstreamEvent.video_action.isnot(None)
+    ).order_by(ClickstreamEvent.id)
+    
+    replayed = replay_events(query, update_video_watch)
+    db.session.commit()
+    print(f"Replayed {replayed} video events")
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Drop and rebuild the FTS5 search tables from clickstream_event and lesson"""
+    with db.engine.begin() as connection:
+        search_index.create_search_index(connection, rebuild=True)
+    print("Full-text search index rebuilt")
 
 # Initialize database and create sample data
 def create_tables():
+    """Create the schema and sample data. Must run inside an app context."""
     try:
-        with app.app_context():
-            db.create_all()
-            print("Database tables created successfully!")
+        db.create_all()
+        upgrade_schema()
+        with db.engine.begin() as connection:
+            if search_index.create_search_index(connection):
+                print("Full-text search index built")
+        print("Database tables created successfully!")
+        
+        # Create sample data if database is empty
+        if not Course.query.first():
+            # Create sample course
+            course = Course(title='Introduction to Python Programming', 
+                           description='Learn the basics of Python programming language')
+            db.session.add(course)
+            db.session.commit()
+            
+            # Create sample lessons
+            lesson1 = Lesson(title='What is Python?', content_type='text', 
+                            content='Python is a high-level programming language that emphasizes code readability and simplicity. It was created by Guido van Rossum and first released in 1991. Python supports multiple programming paradigms including procedural, object-oriented, and functional programming.', 
+                            course_id=course.id, order=1)
+            lesson2 = Lesson(title='Python Basics', content_type='video', 
+                            content='https://sample-videos.com/zip/10/mp4/SampleVideo_1280x720_1mb.mp4', 
+                            course_id=course.id, order=2)
+            lesson3 = Lesson(title='Python Quiz', content_type='quiz', 
+                            content='Test your knowledge about Python programming', 
+                            course_id=course.id, order=3)
+            
+            db.session.add_all([lesson1, lesson2, lesson3])
+            db.session.commit()
             
-            # Create sample data if database is empty
-            if not Course.query.first():
-                # Create sample course
-                course = Course(title='Introduction to Python Programming', 
-                               description='Learn the basics of Python programming language')
-                db.session.add(course)
-                db.session.commit()
-                
-                # Create sample lessons
-                lesson1 = Lesson(title='What is Python?', content_type='text', 
-                                content='Python is a high-level programming language that emphasizes code readability and simplicity. It was created by Guido van Rossum and first released in 1991. Python supports multiple programming paradigms including procedural, object-oriented, and functional programming.', 
-                                course_id=course.id, order=1)
-                lesson2 = Lesson(title='Python Basics', content_type='video', 
-                                content='https://sample-videos.com/zip/10/mp4/SampleVideo_1280x720_1mb.mp4', 
-                                course_id=course.id, order=2)
-                lesson3 = Lesson(title='Python Quiz', content_type='quiz', 
-                                content='Test your knowledge about Python programming', 
-                                course_id=course.id, order=3)
-                
-                db.session.add_all([lesson1, lesson2, lesson3])
-                db.session.commit()
-                
-                # Create quiz questions
-                q1 = QuizQuestion(question='What is Python?', 
-                                 options=json.dumps(['A snake', 'A programming language', 'A game', 'A book']),
-                                 correct_answer=1, lesson_id=lesson3.id)
-                q2 = QuizQuestion(question='Python was created by?', 
-                                 options=json.dumps(['Bill Gates', 'Guido van Rossum', 'Steve Jobs', 'Mark Zuckerberg']),
-                                 correct_answer=1, lesson_id=lesson3.id)
-                
-                db.session.add_all([q1, q2])
-                db.session.commit()
-                
-                # Create admin user
-                admin_password = generate_password_hash('admin123')
-                admin_user = AdminUser(
-                    username='admin',
-                    email='admin@learningwebsite.com',
-                    password_hash=admin_password,
-                    is_admin=True
-                )
-                db.session.add(admin_user)
-                db.session.commit()
-                print("Sample data and admin user created successfully!")
+            # Create quiz questions
+            q1 = QuizQuestion(question='What is Python?', 
+                             options=json.dumps(['A snake', 'A programming language', 'A game', 'A book']),
+                             correct_answer=1, lesson_id=lesson3.id)
+            q2 = QuizQuestion(question='Python was created by?', 
+                             options=json.dumps(['Bill Gates', 'Guido van Rossum', 'Steve Jobs', 'Mark Zuckerberg']),
+                             correct_answer=1, lesson_id=lesson3.id)
+            
+            db.session.add_all([q1, q2])
+            db.session.commit()
+            
+            # Create admin user
+            admin_password = generate_password_hash('admin123')
+            admin_user = AdminUser(
+                username='admin',
+                email='admin@learningwebsite.com',
+                password_hash=admin_password,
+                is_admin=True
+            )
+            db.session.add(admin_user)
+            db.session.commit()
+            print("Sample data and admin user created successfully!")
     except Exception as e:
         print(f"Error creating database: {e}")
         import traceback
         traceback.print_exc()
 
-# Initialize database when app starts
-if __name__ == '__main__':
+@bp.cli.command('init-db')
+def init_db():
+    """Create tables, search index, sample data and the admin user (run once)"""
     create_tables()
+
+# Development server; production runs `gunicorn -c gunicorn.conf.py wsgi:app`
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        create_tables()
     app.run(debug=True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Event Data Storage Benchmark
+Compares storing additional_data as JSON text (how events were stored
+before) with the promoted columns and compact payloads of event_data.py:
+bytes per row on disk and the cost of encoding and decoding a row.
+
+The events are read from an existing database, so fill one first, e.g.
+with `python generate_data.py --events 200000`. Both layouts are written
+to scratch SQLite files holding only the columns that differ.
+
+Usage:
+    python bench_event_data.py                          # instance/learning_website.db
+    python bench_event_data.py --db other.db --rows 50000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import event_data
+
+LEGACY_COLUMNS = ('additional_data',) + event_data.COLUMN_KEYS
+PACKED_COLUMNS = event_data.PACKED_COLUMNS + event_data.COLUMN_KEYS
+
+
+def read_events(path, limit):
+    """(additional_data dict, video/quiz column values) of the newest events"""
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    rows = connection.execute('SELECT * FROM clickstream_event ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    connection.close()
+    return [(event_data.load(row), {key: row[key] for key in event_data.COLUMN_KEYS}) for row in rows]
+
+
+def bytes_per_row(columns, rows):
+    """On-disk size of a table with these columns and rows, after VACUUM"""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(path)
+        connection.execute(f"CREATE TABLE events (id INTEGER PRIMARY KEY, {', '.join(columns)})")
+        connection.executemany(f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                               rows)
+        connection.commit()
+        connection.execute('VACUUM')
+        pages = connection.execute('PRAGMA page_count').fetchone()[0]
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        connection.close()
+        return pages * page_size / len(rows)
+    finally:
+        os.remove(path)
+
+
+def per_row_us(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JSON text and compact event data storage')
+    parser.add_argument('--db', default=os.path.join('instance', 'learning_website.db'), help='SQLite database to sample')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of recent events to use')
+    args = parser.parse_args()
+
+    events = read_events(args.db, args.rows)
+    if not events:
+        raise SystemExit(f"No events in {args.db}; run generate_data.py first")
+
+    # Before: json.dumps of the whole dict, as build_clickstream_event() used to
+    legacy_rows = [(json.dumps(data) if data else None, *columns.values()) for data, columns in events]
+    encode_legacy = per_row_us(lambda event: json.dumps(event[0]), events)
+    packed = [event_data.pack(data, columns) for data, columns in events]
+    encode_packed = per_row_us(lambda event: event_data.pack(*event), events)
+    packed_rows = [(*values.values(), *columns.values()) for values, (_, columns) in zip(packed, events)]
+
+    legacy_texts = [row[0] for row in legacy_rows if row[0]]
+    decode_legacy = per_row_us(json.loads, legacy_texts) if legacy_texts else 0.0
+    packed_dicts = [dict(values, additional_data=None, **columns) for values, (_, columns) in zip(packed, events)]
+    decode_packed = per_row_us(event_data.load, packed_dicts)
+    payloads = [values['extra_data'] for values in packed if values['extra_data']]
+
+    legacy_bytes = bytes_per_row(LEGACY_COLUMNS, legacy_rows)
+    packed_bytes = bytes_per_row(PACKED_COLUMNS, packed_rows)
+
+    print("Event Data Storage Benchmark")
+    print("=" * 50)
+    print(f"Events:                    {len(events)} from {args.db}")
+    print(f"With a payload left:       {len(payloads)} ({len(payloads) / len(events):.0%})")
+    print(f"JSON text, avg length:     {sum(map(len, legacy_texts)) / max(len(legacy_texts), 1):.1f} bytes")
+    print(f"Compact payload, avg:      {sum(map(len, payloads)) / max(len(payloads), 1):.1f} bytes")
+    print(f"Bytes per row, JSON text:  {legacy_bytes:.1f}")
+    print(f"Bytes per row, compact:    {packed_bytes:.1f} ({packed_bytes / legacy_bytes - 1:+.0%})")
+    print(f"Encode per row, JSON text: {encode_legacy:.2f} us")
+    print(f"Encode per row, compact:   {encode_packed:.2f} us")
+    print(f"Decode per row, JSON text: {decode_legacy:.2f} us")
+    print(f"Decode per row, compact:   {decode_packed:.2f} us (full dict; promoted columns alone need none)")
+
+
+if __name__ == "__main__":
+    main()
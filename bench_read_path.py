@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Event Read Path Benchmark
+Compares reading events for the admin pages and exports through ORM
+queries (a ClickstreamEvent object per row, as admin_user_activity() and
+export_excel() used to) with the Core selects of event_reads.py: rows
+per second and peak Python memory (tracemalloc) of each.
+
+Each path reads the same events, newest first, and touches the columns
+the user activity page uses. Fill a database first, e.g. with
+`python generate_data.py --events 200000`.
+
+Usage:
+    python bench_read_path.py                           # instance/learning_website.db
+    python bench_read_path.py --db other.db --rows 50000
+"""
+
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+
+import app as app_module
+import event_reads
+import exports
+from models import db, ClickstreamEvent, User
+
+TOUCHED = ('timestamp', 'page_url', 'element_type', 'event_type', 'element_id', 'ip_address',
+           'button_text', 'browser')
+
+
+def touch(event, username, email):
+    for name in TOUCHED:
+        getattr(event, name)
+
+
+def orm_all(limit):
+    """The old admin_user_activity(): every matching event loaded as an object up front"""
+    rows = db.session.query(ClickstreamEvent, User.username, User.email).outerjoin(
+        User, ClickstreamEvent.user_id == User.id
+    ).filter(~ClickstreamEvent.event_type.in_(exports.NOISY_EVENT_TYPES)).order_by(
+        ClickstreamEvent.timestamp.desc()).limit(limit).all()
+    for event, username, email in rows:
+        touch(event, username, email)
+    return len(rows)
+
+
+def orm_yield_per(limit):
+    """The old export_excel(): objects loaded 1000 at a time, still kept in the identity map"""
+    count = 0
+    for event, username, email in db.session.query(ClickstreamEvent, User.username, User.email).outerjoin(
+        User, ClickstreamEvent.user_id == User.id
+    ).filter(~ClickstreamEvent.event_type.in_(exports.NOISY_EVENT_TYPES)).order_by(
+            ClickstreamEvent.timestamp.desc()).limit(limit).yield_per(1000):
+        touch(event, username, email)
+        count += 1
+    return count
+
+
+def core_stream(limit):
+    """event_reads: only the columns used, as rows from a server-side cursor"""
+    count = 0
+    statement = event_reads.select_events(
+        event_reads.ACTIVITY_COLUMNS, ~ClickstreamEvent.event_type.in_(exports.NOISY_EVENT_TYPES)
+    ).order_by(ClickstreamEvent.timestamp.desc()).limit(limit)
+    for row in event_reads.stream(db.session.connection(), statement):
+        touch(row, row.username, row.email)
+        count += 1
+    return count
+
+
+PATHS = [('ORM, all()', orm_all), ('ORM, yield_per(1000)', orm_yield_per), ('Core, stream()', core_stream)]
+
+
+def measure(function, limit, trace=False):
+    """(rows, seconds, peak bytes) of one run in a fresh session.
+
+    tracemalloc slows allocation-heavy code several times over, so the
+    time comes from untraced runs and the peak from a traced one.
+    """
+    db.session.remove()
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    rows = function(limit)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    db.session.remove()
+    return rows, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ORM and Core reads of clickstream events')
+    parser.add_argument('--db', default=os.path.join('instance', 'learning_website.db'), help='SQLite database to read')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of recent events to read')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per path; the fastest is reported')
+    args = parser.parse_args()
+
+    flask_app = app_module.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(args.db)})
+    with flask_app.app_context():
+        print("Event Read Path Benchmark")
+        print("=" * 50)
+        print(f"Database: {args.db}, reading up to {args.rows} events")
+        results = {}
+        for name, function in PATHS:
+            function(min(args.rows, 1000))  # Warm the page cache and compiled statement cache
+            runs = [measure(function, args.rows) for _ in range(args.runs)]
+            rows = runs[0][0]
+            seconds = min(run[1] for run in runs)
+            peak = measure(function, args.rows, trace=True)[2]
+            results[name] = (rows / seconds, peak)
+            print(f"{name:22} {rows:>8} rows  {rows / seconds:>10,.0f} rows/s  peak {peak / 2**20:8.1f} MiB")
+
+        orm_rate, orm_peak = results['ORM, all()']
+        core_rate, core_peak = results['Core, stream()']
+        print(f"Core vs ORM all(): {core_rate / orm_rate:.1f}x the rows/s, {core_peak / orm_peak:.1%} of the peak memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+Measures how long a fresh worker process takes to import and build the
+Flask app, and how much memory it holds afterwards. Each run is a new
+interpreter, so nothing is served from an already-warm module cache.
+
+Usage:
+    python bench_startup.py                      # import app; app.create_app()
+    python bench_startup.py --stmt "import app"  # e.g. for an older checkout
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_STMT = "import app; app.create_app()"
+
+# Runs inside the child interpreter: time the statement, then report memory
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+try:
+    import psutil
+    rss = psutil.Process().memory_info().rss
+except ImportError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_bytes': rss,
+    'modules': len(sys.modules),
+    'openpyxl_loaded': 'openpyxl' in sys.modules
+}))
+"""
+
+
+def run_once(stmt):
+    """Run the statement in a new interpreter and return its measurements"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, stmt],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start time and RSS of a worker')
+    parser.add_argument('--stmt', default=DEFAULT_STMT, help='Python statement to time')
+    parser.add_argument('--runs', type=int, default=10, help='Number of fresh interpreters')
+    args = parser.parse_args()
+
+    baseline = run_once('pass')
+    results = [run_once(args.stmt) for _ in range(args.runs)]
+
+    seconds = [r['seconds'] for r in results]
+    rss = [r['rss_bytes'] for r in results]
+    print("Startup Benchmark")
+    print("=" * 50)
+    print(f"Statement:          {args.stmt}")
+    print(f"Runs:               {args.runs}")
+    print(f"Cold start (median): {statistics.median(seconds) * 1000:.1f} ms")
+    print(f"Cold start (min):    {min(seconds) * 1000:.1f} ms")
+    print(f"Worker RSS (median): {statistics.median(rss) / 2**20:.1f} MiB")
+    print(f"  over bare Python:  {(statistics.median(rss) - baseline['rss_bytes']) / 2**20:.1f} MiB")
+    print(f"Modules loaded:      {results[0]['modules']}")
+    print(f"openpyxl loaded:     {results[0]['openpyxl_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Tracking Volume Benchmark
+Replays one scripted student session through clickstream.js and counts
+what it uploads: requests, events and bytes per active minute. Run it on
+the current script and on an older one to compare, e.g. the script
+before batching and sampling:
+
+    git show bc4c2c3^:static/js/clickstream.js > /tmp/clickstream_old.js
+    python bench_tracking_volume.py --baseline /tmp/clickstream_old.js
+
+The scripts run under Node.js (needed for this benchmark only) with a
+minimal stand-in for the browser: a virtual clock, seeded Math.random,
+fetch recorded instead of sent, and the sampling config the server
+publishes. The session is synthetic but busy: on every page the mouse
+moves for 3 of every 10 seconds, a button is clicked every 30 seconds,
+the student types answers in bursts, uses a few shortcuts and switches
+tabs once, and the window is resized on the first page.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+
+import app as app_module
+
+HARNESS = r"""
+const fs = require('fs');
+const vm = require('vm');
+const zlib = require('zlib');
+
+const [scriptPath, configPath, tracePath] = process.argv.slice(2);
+const source = fs.readFileSync(scriptPath, 'utf8');
+const config = JSON.parse(fs.readFileSync(configPath, 'utf8'));
+const pages = JSON.parse(fs.readFileSync(tracePath, 'utf8'));
+
+let now = Date.UTC(2024, 0, 15, 9, 0, 0);
+let seed = 12345;
+const storage = () => {
+    const items = {};
+    return {
+        getItem: key => (key in items ? items[key] : null),
+        setItem: (key, value) => { items[key] = String(value); },
+        removeItem: key => { delete items[key]; }
+    };
+};
+const sessionStorage = storage();
+const localStorage = storage();
+const uploads = { requests: 0, events: 0, bytes: 0, gzip_bytes: 0, by_type: {} };
+const flush = () => new Promise(resolve => setImmediate(resolve));
+
+function respond(body) {
+    return Promise.resolve({
+        status: 200, ok: true, headers: { get: () => null },
+        json: () => Promise.resolve(body)
+    });
+}
+
+function element(properties) {
+    const classes = (properties.className || '').split(' ');
+    return Object.assign({
+        textContent: '', className: '', name: '', id: '', type: '', value: '',
+        classList: { contains: name => classes.includes(name) },
+        getBoundingClientRect: () => ({ left: 100, top: 200, width: 120, height: 40 }),
+        closest: () => null
+    }, properties);
+}
+
+const button = element({ tagName: 'BUTTON', className: 'btn btn-primary', textContent: 'Next' });
+const field = element({ tagName: 'INPUT', type: 'text', name: 'answer', id: 'answer' });
+
+async function runPage(page) {
+    const timers = new Map();
+    let nextTimer = 1;
+    const listeners = {};
+    const on = (type, handler) => { (listeners[type] = listeners[type] || []).push(handler); };
+    const dispatch = async (type, event) => {
+        for (const handler of listeners[type] || []) handler(event);
+        await flush();
+    };
+
+    const context = {
+        console: { log() {}, error() {} },
+        sessionStorage, localStorage, setImmediate,
+        location: { href: 'http://localhost:5000' + page.path },
+        innerWidth: 1280, innerHeight: 800, pageXOffset: 0, pageYOffset: 0,
+        screen: { width: 1920, height: 1080 },
+        addEventListener: on,
+        crypto: { randomUUID: () => 'e' + (seed = (seed * 48271) % 2147483647) },
+        setTimeout: (fn, ms, ...args) => { timers.set(nextTimer, { at: now + (ms || 0), fn, args }); return nextTimer++; },
+        setInterval: (fn, ms) => { timers.set(nextTimer, { at: now + ms, fn, args: [], every: Math.max(ms, 1) }); return nextTimer++; },
+        clearTimeout: id => timers.delete(id),
+        clearInterval: id => timers.delete(id),
+        fetch: (url, options) => {
+            if (url === '/api/tracking_config') return respond(config);
+            const body = typeof options.body === 'string' ? options.body : Buffer.from(options.body).toString();
+            const data = JSON.parse(body);
+            const events = Array.isArray(data.events) ? data.events : [data];
+            uploads.requests += 1;
+            uploads.events += events.length;
+            uploads.bytes += Buffer.byteLength(body);
+            uploads.gzip_bytes += zlib.gzipSync(body).length;
+            for (const event of events) uploads.by_type[event.event_type] = (uploads.by_type[event.event_type] || 0) + 1;
+            return respond({ status: 'success', received: events.length });
+        }
+    };
+    context.window = context;
+    context.document = {
+        title: page.title, referrer: '', readyState: 'complete', hidden: false,
+        addEventListener: on, querySelector: () => null, querySelectorAll: () => []
+    };
+    vm.createContext(context);
+    vm.runInContext(`Math.random = (() => { let s = ${seed}; return () => (s = (s * 48271) % 2147483647) / 2147483647; })();
+                     Date.now = () => __now(); delete globalThis.CompressionStream;`, Object.assign(context, { __now: () => now }));
+    vm.runInContext(source, context);
+    await flush();
+
+    const advance = async until => {
+        for (;;) {
+            let next = null;
+            for (const [id, timer] of timers) if (timer.at <= until && (!next || timer.at < next[1].at)) next = [id, timer];
+            if (!next) break;
+            const [id, timer] = next;
+            now = timer.at;
+            if (timer.every) timer.at += timer.every; else timers.delete(id);
+            timer.fn(...timer.args);
+            await flush();
+        }
+        now = until;
+    };
+
+    const start = now;
+    for (const step of page.steps) {
+        await advance(start + step.t);
+        if (step.type === 'mousemove') await dispatch('mousemove', { clientX: step.x, clientY: step.y });
+        else if (step.type === 'click') await dispatch('click', { target: button });
+        else if (step.type === 'input') await dispatch('input', { target: field });
+        else if (step.type === 'focusout') await dispatch('focusout', { target: field });
+        else if (step.type === 'keydown') await dispatch('keydown', { key: step.key, ctrlKey: true, metaKey: false, altKey: false, shiftKey: false });
+        else if (step.type === 'resize') { context.innerWidth = step.width; await dispatch('resize', {}); }
+        else if (step.type === 'visibility') { context.document.hidden = step.hidden; await dispatch('visibilitychange', {}); }
+    }
+    await advance(start + page.seconds * 1000);
+    await dispatch('beforeunload', {});
+    await dispatch('pagehide', {});
+}
+
+(async () => {
+    for (const page of pages) await runPage(page);
+    console.log(JSON.stringify(uploads));
+})();
+"""
+
+PAGES = ['/dashboard', '/course/1', '/lesson/1', '/lesson/2', '/lesson/3']
+
+
+def student_session(pages, page_seconds, seed):
+    """The scripted DOM events of a session, one list of steps per page"""
+    rng = random.Random(seed)
+    session = []
+    for index in range(pages):
+        steps = []
+        for burst in range(0, page_seconds, 10):
+            # 3 seconds of mouse movement at 60 Hz
+            x, y = rng.randrange(1200), rng.randrange(700)
+            for frame in range(180):
+                x = min(max(x + rng.randint(-12, 12), 0), 1279)
+                y = min(max(y + rng.randint(-8, 8), 0), 799)
+                steps.append({'t': burst * 1000 + frame * 16, 'type': 'mousemove', 'x': x, 'y': y})
+        for second in range(15, page_seconds, 30):
+            steps.append({'t': second * 1000 + 500, 'type': 'click'})
+        for second in range(20, page_seconds, 60):
+            # An answer typed at about 6 keystrokes a second
+            for key in range(40):
+                steps.append({'t': second * 1000 + key * 160 + rng.randrange(40), 'type': 'input'})
+            steps.append({'t': second * 1000 + 8000, 'type': 'focusout'})
+        for second, key in ((25, 'c'), (26, 'v'), (40, 'z')):
+            if second < page_seconds:
+                steps.append({'t': second * 1000 + 200, 'type': 'keydown', 'key': key})
+        if index == 0:
+            for step in range(40):
+                steps.append({'t': 5000 + step * 20, 'type': 'resize', 'width': 1280 - step * 5})
+        hidden_at = rng.randrange(page_seconds // 2, page_seconds - 20) * 1000
+        steps.append({'t': hidden_at, 'type': 'visibility', 'hidden': True})
+        steps.append({'t': hidden_at + 15000, 'type': 'visibility', 'hidden': False})
+        steps.sort(key=lambda step: step['t'])
+        path = PAGES[index % len(PAGES)]
+        session.append({'path': path, 'title': path, 'seconds': page_seconds, 'steps': steps})
+    return session
+
+
+def measure(script, config_path, trace_path, harness_path):
+    output = subprocess.run(['node', harness_path, script, config_path, trace_path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(name, uploads, minutes):
+    print(f"{name}: {uploads['requests'] / minutes:7.1f} requests/min  {uploads['events'] / minutes:7.1f} events/min  "
+          f"{uploads['bytes'] / minutes / 1024:7.1f} KiB/min ({uploads['gzip_bytes'] / minutes / 1024:.1f} KiB gzipped)")
+    print("    " + ', '.join(f'{event_type} {count}' for event_type, count in sorted(uploads['by_type'].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure what clickstream.js uploads for a scripted student session')
+    parser.add_argument('--script', default=os.path.join('static', 'js', 'clickstream.js'), help='Tracking script to measure')
+    parser.add_argument('--baseline', help='Older tracking script to compare against')
+    parser.add_argument('--pages', type=int, default=10, help='Pages visited')
+    parser.add_argument('--page-seconds', type=int, default=120, help='Time spent on each page')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    minutes = args.pages * args.page_seconds / 60
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name) for name in ('harness.js', 'config.json', 'trace.json')}
+        with open(paths['harness.js'], 'w') as f:
+            f.write(HARNESS)
+        with open(paths['config.json'], 'w') as f:
+            json.dump(app_module.DEFAULT_TRACKING_CONFIG, f)
+        with open(paths['trace.json'], 'w') as f:
+            json.dump(student_session(args.pages, args.page_seconds, args.seed), f)
+
+        print("Tracking Volume Benchmark")
+        print("=" * 50)
+        print(f"{args.pages} pages of {args.page_seconds}s ({minutes:.0f} active minutes)")
+        current = measure(args.script, paths['config.json'], paths['trace.json'], paths['harness.js'])
+        report(args.script, current, minutes)
+        if args.baseline:
+            baseline = measure(args.baseline, paths['config.json'], paths['trace.json'], paths['harness.js'])
+            report(args.baseline, baseline, minutes)
+            print(f"Reduction: {baseline['requests'] / current['requests']:.1f}x fewer requests, "
+                  f"{baseline['events'] / current['events']:.1f}x fewer events, "
+                  f"{baseline['bytes'] / current['gzip_bytes']:.1f}x fewer bytes sent")
+
+
+if __name__ == "__main__":
+    main()
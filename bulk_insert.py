@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Bulk Loading
+Helpers for writing millions of events into the SQLite database quickly,
+shared by generate_data.py and import_events.py. They work on plain
+sqlite3 connections and bypass the ingest-time aggregates, so the
+aggregate tables are rebuilt afterwards with the flask rebuild-* commands.
+"""
+
+import contextlib
+import sqlite3
+
+import event_data
+import search_index
+
+# clickstream_event columns written by the bulk loaders. additional_data is
+# written as event_data.pack() splits it, into the PACKED_COLUMNS
+EVENT_COLUMNS = ('user_id', 'session_id', 'event_type', 'element_id', 'element_type', 'page_url',
+                 'timestamp', *event_data.PACKED_COLUMNS, 'ip_address', 'event_id', 'client_timestamp',
+                 'video_id', 'video_action', 'video_time', 'quiz_id', 'question_id', 'answer_selected')
+
+# Commands replaying the event table into the incrementally maintained tables
+REBUILD_COMMANDS = ('rebuild-video-stats', 'rebuild-navigation', 'rebuild-user-summaries',
+                    'rebuild-lesson-progress', 'rebuild-unique-visitors', 'rebuild-top-clicks',
+                    'rebuild-event-counts', 'refresh-retention --full')
+
+# Formats DateTime values the way SQLAlchemy stores them in SQLite
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def connect(path):
+    """A sqlite3 connection tuned for loading; transactions are explicit (BEGIN/COMMIT)"""
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute('PRAGMA temp_store = MEMORY')
+    connection.execute('PRAGMA cache_size = -262144')  # 256 MiB, for rebuilding indexes
+    return connection
+
+
+@contextlib.contextmanager
+def deferred_indexes(connection, table='clickstream_event', keep_unique=False):
+    """Drop a table's secondary indexes and triggers for the duration of a load.
+
+    Updating every index B-tree for each inserted row costs far more than
+    building the index once at the end. On exit the indexes and triggers
+    are recreated, even if the load failed part way, and events added
+    meanwhile are added to the full-text search index the triggers would
+    have maintained. If the process dies first, create_tables() recreates
+    them on the next start and search_index indexes the events from the
+    id recorded in event_search_pending. keep_unique leaves unique indexes
+    in place, for loaders that rely on INSERT OR IGNORE to skip duplicates.
+    """
+    last_id = connection.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table}"').fetchone()[0]
+    objects = connection.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+    if keep_unique:
+        objects = [o for o in objects if not o[2].upper().startswith('CREATE UNIQUE INDEX')]
+    search = table == 'clickstream_event' and any(name == 'clickstream_event_search_insert'
+                                                 for _, name, _ in objects)
+    connection.execute('BEGIN')
+    if search:
+        connection.execute(search_index.PENDING_SCHEMA)
+        connection.execute('INSERT INTO event_search_pending (last_id) VALUES (?)', (last_id,))
+    for object_type, name, _ in objects:
+        connection.execute(f'DROP {object_type.upper()} IF EXISTS "{name}"')
+    connection.execute('COMMIT')
+    try:
+        yield
+    finally:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')  # The chunk the load failed in
+        connection.execute('BEGIN')
+        # The app may have been started meanwhile and put them back already
+        present = {row[0] for row in connection.execute('SELECT name FROM sqlite_master')}
+        for object_type, name, sql in sorted(objects, key=lambda o: o[0] != 'index'):
+            if name not in present:
+                connection.execute(sql)
+        if search:
+            pending = connection.execute('SELECT MIN(last_id) FROM event_search_pending').fetchone()[0]
+            if pending is not None:
+                connection.execute(search_index.INDEX_EVENTS_AFTER, {'last_id': pending})
+                connection.execute('DELETE FROM event_search_pending')
+        connection.execute('COMMIT')
+
+
+def rebuild_aggregates(app, run=True):
+    """Replay the loaded events into the aggregate tables, or say how to"""
+    if not run:
+        print("Aggregate tables were not updated; run these (or pass --rebuild-aggregates):")
+        for command in REBUILD_COMMANDS:
+            print(f"    flask --app app {command}")
+        return
+    runner = app.test_cli_runner()
+    for command in REBUILD_COMMANDS:
+        print(f"flask {command}")
+        print(runner.invoke(args=command.split()).output.strip())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Event Change Feed
+Incremental NDJSON feed of clickstream events for downstream consumers
+such as the data warehouse, instead of re-exporting the whole table.
+
+The watermark is the event id. SQLite lets one writer at a time hold the
+database from its first insert until it commits, so ids become visible
+in increasing order and a reader that has seen every event up to id N
+will never later find a new event below it (events are never deleted,
+so ids are not reused either). A consumer therefore only
+has to remember the last id it has loaded: its offset, kept in the
+feed_consumer table and moved forward by the consumer once its load has
+committed (at-least-once delivery; records carry their id and event_id
+to deduplicate on).
+
+The feed carries inserts only. Events are not edited after ingest apart
+from maintenance commands (locate-events, compact-event-data) that fill
+in derived columns, and re-reading those is what the rewind option is for.
+"""
+
+import json
+
+from sqlalchemy import func, select
+
+import event_data
+from models import ClickstreamEvent, User
+
+# Event columns sent as they are
+FEED_COLUMNS = ('id', 'event_id', 'timestamp', 'client_timestamp', 'user_id', 'session_id',
+                'event_type', 'element_id', 'element_type', 'page_url', 'ip_address',
+                'video_id', 'video_action', 'video_time', 'quiz_id', 'question_id', 'answer_selected',
+                'device_type', 'browser', 'os', 'country', 'region')
+
+# Columns additional_data is stored in (see event_data.py), sent as one additional_data object
+STORAGE_COLUMNS = tuple(name for name in ('additional_data',) + event_data.PACKED_COLUMNS if name not in FEED_COLUMNS)
+
+BATCH_ROWS = 1000  # Rows per read while streaming
+DEFAULT_LIMIT = 10000  # Events per response unless the request asks otherwise
+MAX_LIMIT = 100000
+
+_events = ClickstreamEvent.__table__
+_users = User.__table__
+
+
+def latest_id(connection):
+    """The newest event id, 0 for an empty table"""
+    return connection.execute(select(func.max(_events.c.id))).scalar() or 0
+
+
+def window_end(connection, after, limit):
+    """(last id, more) of the next `limit` events after `after`.
+
+    Fixing the end before streaming lets the cursor go in a response
+    header and keeps events committed mid-response out of it.
+    """
+    ids = select(_events.c.id).where(_events.c.id > after).order_by(_events.c.id).limit(limit).subquery()
+    upto = connection.execute(select(func.max(ids.c.id))).scalar()
+    if upto is None:
+        return after, False
+    more = connection.execute(select(_events.c.id).where(_events.c.id > upto).limit(1)).first() is not None
+    return upto, more
+
+
+def _feed_query(after, upto):
+    return select(
+        *[_events.c[name] for name in FEED_COLUMNS],
+        *[_events.c[name] for name in STORAGE_COLUMNS],
+        _users.c.username
+    ).select_from(
+        _events.outerjoin(_users, _events.c.user_id == _users.c.id)
+    ).where(_events.c.id > after, _events.c.id <= upto).order_by(_events.c.id).limit(BATCH_ROWS)
+
+
+def feed_record(row):
+    """The feed dict of one event row"""
+    record = {}
+    for name in FEED_COLUMNS:
+        value = row._mapping[name]
+        record[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    record['username'] = row.username
+    data = event_data.load(row._mapping)
+    for name in event_data.COLUMN_KEYS:
+        # Also columns of their own; load() only adds them for old readers
+        if name in data and data[name] == record[name]:
+            del data[name]
+    record['additional_data'] = data
+    return record
+
+
+def iter_records(engine, after, upto):
+    """Feed dicts of the events in (after, upto], oldest first.
+
+    Each batch is its own short read, so a slow consumer never holds a
+    read transaction open against the writers.
+    """
+    while after < upto:
+        with engine.connect() as connection:
+            rows = connection.execute(_feed_query(after, upto)).all()
+        if not rows:
+            return
+        for row in rows:
+            yield feed_record(row)
+        after = rows[-1].id
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
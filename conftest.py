@@ -0,0 +1,3 @@
+# test_tracking.py drives a running server on localhost:5000 and is run
+# by hand (python test_tracking.py); pytest only collects the unit tests
+collect_ignore = ['test_tracking.py']
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Duplicate Event Filtering
+In-memory structures that let the ingest path reject retried events
+without a database round trip:
+
+- an exact LRU set of the most recently stored event ids, and
+- a rotating Bloom filter over a much longer horizon, used only to
+  prove an id is new. A "maybe seen" answer is confirmed against the
+  database, so Bloom false positives never drop a real event.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class RotatingBloomFilter:
+    """Bloom filter that forgets old entries by keeping two generations.
+
+    New ids go into the current generation; once it holds `capacity` ids
+    it becomes the previous generation and a fresh one is started, so the
+    filter always covers between `capacity` and 2 * `capacity` recent ids.
+    """
+
+    def __init__(self, capacity=500000, hashes=7, bits_per_item=10):
+        self.capacity = capacity
+        self.hashes = hashes
+        self.size = capacity * bits_per_item  # ~1% false positives at 10 bits, 7 hashes
+        self.current = bytearray(self.size // 8 + 1)
+        self.previous = bytearray(self.size // 8 + 1)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = bytearray(self.size // 8 + 1)
+            self.count = 0
+        for position in self._positions(key):
+            self.current[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        for bits in (self.current, self.previous):
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return True
+        return False
+
+
+class RecentEventIds:
+    """Exact recent-id LRU in front of a rotating Bloom filter"""
+
+    def __init__(self, lru_size=100000, bloom_capacity=500000):
+        self.lru_size = lru_size
+        self.recent = OrderedDict()
+        self.bloom = RotatingBloomFilter(bloom_capacity)
+        self.lock = threading.Lock()
+
+    def seen(self, event_id):
+        """True if the id was stored recently (certain, no false positives)"""
+        with self.lock:
+            if event_id in self.recent:
+                self.recent.move_to_end(event_id)
+                return True
+            return False
+
+    def maybe_seen(self, event_id):
+        """False if the id was certainly never added; True means "check the database" """
+        with self.lock:
+            return event_id in self.bloom
+
+    def add(self, event_ids):
+        with self.lock:
+            for event_id in event_ids:
+                self.recent[event_id] = None
+                self.recent.move_to_end(event_id)
+                self.bloom.add(event_id)
+            while len(self.recent) > self.lru_size:
+                self.recent.popitem(last=False)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Event Enrichment
+Derives the device, browser and operating system (from the User-Agent
+header) and the country and region (from the IP address) of tracked
+events at ingest, so reports read them from columns instead of working
+them out per row.
+
+Every event in an upload comes from the same request, so a batch needs
+one User-Agent parse and one IP lookup. Parsed User-Agents are also kept
+in an LRU cache, since a classroom sends the same few strings over and
+over.
+
+Locations come from a local IP range database: a CSV file with one range
+per row, `first_ip,last_ip,country_code[,region]`, e.g. the free DB-IP
+"IP to Country Lite" download. Addresses may be written as dotted/colon
+text or as integers. The file is loaded once per process into sorted
+arrays and searched with bisect, O(log n) per lookup in a few bytes per
+range.
+"""
+
+import bisect
+import csv
+import functools
+import ipaddress
+import os
+import re
+import threading
+from array import array
+
+UNKNOWN = 'Other'
+
+BOT = re.compile(r'bot|crawl|spider|slurp|headless|curl/|wget/|python-requests|httpclient', re.IGNORECASE)
+
+# (pattern, name), first match wins; the order matters because most
+# browsers also claim to be Chrome, Safari and Mozilla
+BROWSERS = [(re.compile(pattern), name) for pattern, name in [
+    (r'Edg(e|A|iOS)?/', 'Edge'),
+    (r'OPR/|Opera', 'Opera'),
+    (r'SamsungBrowser/', 'Samsung Internet'),
+    (r'Firefox/|FxiOS/', 'Firefox'),
+    (r'Chrome/|CriOS/|Chromium/', 'Chrome'),
+    (r'Version/[\d.]+.*Safari/', 'Safari'),
+    (r'MSIE |Trident/', 'Internet Explorer'),
+]]
+
+OPERATING_SYSTEMS = [(re.compile(pattern), name) for pattern, name in [
+    (r'Windows', 'Windows'),
+    (r'iPhone|iPad|iPod', 'iOS'),
+    (r'Android', 'Android'),
+    (r'CrOS', 'ChromeOS'),
+    (r'Macintosh|Mac OS X', 'macOS'),
+    (r'Linux|X11', 'Linux'),
+]]
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_user_agent(user_agent):
+    """(device_type, browser, os) of a User-Agent string.
+
+    device_type is 'desktop', 'mobile', 'tablet' or 'bot'; unrecognised
+    browsers and systems are 'Other'. An empty string gives (None, None, None).
+    """
+    if not user_agent:
+        return None, None, None
+    browser = next((name for pattern, name in BROWSERS if pattern.search(user_agent)), UNKNOWN)
+    os_name = next((name for pattern, name in OPERATING_SYSTEMS if pattern.search(user_agent)), UNKNOWN)
+    if BOT.search(user_agent):
+        device_type = 'bot'
+    elif 'iPad' in user_agent or 'Tablet' in user_agent or (os_name == 'Android' and 'Mobile' not in user_agent):
+        device_type = 'tablet'
+    elif 'Mobi' in user_agent or 'iPhone' in user_agent:
+        device_type = 'mobile'
+    else:
+        device_type = 'desktop'
+    return device_type, browser, os_name
+
+
+class IPRanges:
+    """Non-overlapping IP ranges mapped to (country, region), searched with bisect"""
+
+    def __init__(self, ranges):
+        """`ranges` is an iterable of (first_ip, last_ip, country, region) with integer addresses"""
+        locations = {}
+        self.tables = {}
+        by_version = {4: [], 6: []}
+        for first, last, country, region in ranges:
+            location = locations.setdefault((country, region), len(locations))
+            by_version[4 if last <= 0xFFFFFFFF else 6].append((first, last, location))
+        self.locations = list(locations)
+        for version, rows in by_version.items():
+            rows.sort()
+            if version == 4:
+                # 4 bytes per bound; IPv6 bounds do not fit a fixed-size array type
+                columns = (array('I', (r[0] for r in rows)), array('I', (r[1] for r in rows)))
+            else:
+                columns = ([r[0] for r in rows], [r[1] for r in rows])
+            self.tables[version] = columns + (array('I', (r[2] for r in rows)),)
+
+    def __len__(self):
+        return sum(len(table[0]) for table in self.tables.values())
+
+    def lookup(self, ip):
+        """(country, region) of an address, or (None, None) if it is in no range"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None, None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        firsts, lasts, locations = self.tables[address.version]
+        value = int(address)
+        position = bisect.bisect_right(firsts, value) - 1
+        if position < 0 or value > lasts[position]:
+            return None, None
+        return self.locations[locations[position]]
+
+    @classmethod
+    def load(cls, path):
+        """Read a `first_ip,last_ip,country_code[,region]` CSV file"""
+        def parse_address(text):
+            text = text.strip()
+            return int(text) if text.isdigit() else int(ipaddress.ip_address(text))
+
+        def rows(f):
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'):
+                    continue
+                try:
+                    first, last = parse_address(row[0]), parse_address(row[1])
+                except ValueError:
+                    continue  # Header line or malformed row
+                region = row[3].strip() if len(row) > 3 else ''
+                yield first, last, row[2].strip().upper() or None, region or None
+
+        with open(path, newline='', encoding='utf-8') as f:
+            return cls(rows(f))
+
+
+_ip_ranges = {}
+_ip_ranges_lock = threading.Lock()
+
+
+def get_ip_ranges(path):
+    """The range database at `path`, loaded on first use; None if there is no such file"""
+    if path not in _ip_ranges:
+        with _ip_ranges_lock:
+            if path not in _ip_ranges:
+                _ip_ranges[path] = IPRanges.load(path) if path and os.path.isfile(path) else None
+    return _ip_ranges[path]
+
+
+def locate_ip(ip, path):
+    """(country, region) of an address, (None, None) if unknown or without a database"""
+    ranges = get_ip_ranges(path)
+    if ranges is None or not ip:
+        return None, None
+    return ranges.lookup(ip)
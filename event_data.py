@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Event Data Storage
+How the free-form additional_data of a clickstream event is stored.
+
+Keys that reports read all the time (button_text, link_text, the click
+position, score, page_title, referrer, and the sample_rate of sampled
+event types) are promoted to typed columns of clickstream_event. Keys already copied into the video_* / quiz_* columns
+are dropped. Whatever is left is stored in the extra_data column as
+compact JSON, deflated with a preset dictionary of the keys and values
+clickstream.js sends. Most payloads are a few dozen bytes, too short for
+plain compression to help, but the dictionary gives the compressor
+something to refer back to from the first byte. The first byte of a
+payload says how the rest is encoded, so the dictionary can be replaced
+later without rewriting old rows.
+
+Events stored before this scheme keep their JSON text in additional_data;
+load() reads either form and returns the event's original dict.
+Only the standard library is used, so view_data.py and the export
+workers can read payloads without the app.
+"""
+
+import json
+import zlib
+
+# Keys copied to columns of the same name
+PROMOTED_KEYS = ('button_text', 'link_text', 'score', 'page_title', 'referrer', 'sample_rate')
+# click_location {'x', 'y', ...} -> click_x, click_y
+CLICK_KEYS = (('x', 'click_x'), ('y', 'click_y'))
+# Keys build_clickstream_event() copies to the video_* / quiz_* columns
+COLUMN_KEYS = ('video_id', 'video_action', 'video_time', 'quiz_id', 'question_id', 'answer_selected')
+
+# clickstream_event columns written by pack(), in order
+PACKED_COLUMNS = PROMOTED_KEYS + tuple(column for _, column in CLICK_KEYS) + ('extra_data',)
+
+COLUMN_LENGTHS = {'button_text': 200, 'link_text': 200, 'page_title': 200, 'referrer': 500}
+
+# Payload formats (first byte)
+RAW = 0         # Compact JSON
+DEFLATE_V1 = 1  # Raw deflate of compact JSON with DICTIONARY_V1
+
+# Substrings common in additional_data, most frequent last (deflate finds
+# nearer matches with shorter codes)
+DICTIONARY_V1 = (
+    b'"window_width":"window_height":"screen_width":"screen_height":'
+    b'"combos":{"Control+"key_count":"keystrokes":"action":"input_burst""action":"change"'
+    b'"selected_value":"field_name":"field_type":"text""email""password""radio"'
+    b'"menu_item":"menu_class":"nav-link""form_id":"form_type":"form_context":"unknown"'
+    b'"input_type":"input_name":"input_value":"quiz_context":"question_text":"question_'
+    b'"total_questions":"hidden":true"point_count":"window_start":"points":[{"x":'
+    b'"link_href":"http://localhost:5000/lesson/"link_type":"link_context":"navigation"'
+    b'"button_class":"btn btn-primary""btn btn-secondary""button_type":"button_context":"submit"'
+    b'"duration_ms":"sample_rate":0.25,"sample_rate":0.5,"page_x":"page_y":'
+    b'"time_spent_seconds":"page_url":"http://localhost:5000/course/"'
+    b'"page_url":"http://localhost:5000/lesson/'
+)
+
+
+# Raw deflate with a 1 KiB window: enough to hold the dictionary and a
+# payload, and far cheaper to set up per row than the default 32 KiB
+WINDOW_BITS = -10
+
+
+def _compressor():
+    return zlib.compressobj(9, zlib.DEFLATED, WINDOW_BITS, 4, zlib.Z_DEFAULT_STRATEGY, DICTIONARY_V1)
+
+
+def encode(data):
+    """Bytes of a dict, whichever of the payload formats is shorter; None for an empty dict"""
+    if not data:
+        return None
+    text = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    compressor = _compressor()
+    deflated = compressor.compress(text) + compressor.flush()
+    if len(deflated) < len(text):
+        return bytes((DEFLATE_V1,)) + deflated
+    return bytes((RAW,)) + text
+
+
+def decode(payload):
+    """The dict encoded by encode()"""
+    if not payload:
+        return {}
+    payload = bytes(payload)
+    if payload[0] == DEFLATE_V1:
+        text = zlib.decompressobj(WINDOW_BITS, DICTIONARY_V1).decompress(payload[1:])
+    elif payload[0] == RAW:
+        text = payload[1:]
+    else:
+        raise ValueError(f'unknown event payload format {payload[0]}')
+    return json.loads(text)
+
+
+def weight(sample_rate):
+    """How many events one stored event stands for: 1 / sample_rate, rounded; 1 if not sampled"""
+    return int(1 / sample_rate + 0.5) if sample_rate else 1
+
+
+# weight() as an SQL expression over clickstream_event
+WEIGHT_SQL = 'COALESCE(ROUND(1.0 / sample_rate), 1)'
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def pack(data, columns=None):
+    """Split additional_data into column values and the encoded remainder.
+
+    Returns {column: value} for PACKED_COLUMNS. `columns` holds the
+    event's video_* / quiz_* values; keys that were copied there
+    unchanged are dropped from the remainder.
+    """
+    values = dict.fromkeys(PACKED_COLUMNS)
+    rest = dict(data or {})
+    for key in PROMOTED_KEYS:
+        value = rest.get(key)
+        if key == 'score':
+            promotable = _is_number(value)
+        elif key == 'sample_rate':
+            # Aggregates count the event 1 / sample_rate times (see weight())
+            promotable = _is_number(value) and 0 < value <= 1
+        else:
+            promotable = isinstance(value, str) and len(value) <= COLUMN_LENGTHS[key]
+        if promotable:
+            values[key] = rest.pop(key)
+    location = rest.get('click_location')
+    if isinstance(location, dict):
+        location = dict(location)
+        for key, column in CLICK_KEYS:
+            if _is_number(location.get(key)):
+                values[column] = location.pop(key)
+        if location:
+            rest['click_location'] = location
+        else:
+            del rest['click_location']
+    for key in COLUMN_KEYS:
+        if key in rest and columns and columns.get(key) is not None and rest[key] == columns[key] \
+                and type(rest[key]) is type(columns[key]):
+            del rest[key]
+    values['extra_data'] = encode(rest)
+    return values
+
+
+def load(event):
+    """The additional_data dict of an event row or ORM object, in either storage form"""
+    if hasattr(event, 'keys'):  # sqlite3.Row or dict, possibly without some of the columns
+        names = set(event.keys())
+        get = lambda name: event[name] if name in names else None
+    else:
+        get = lambda name: getattr(event, name, None)
+    legacy = get('additional_data')
+    if legacy:
+        try:
+            data = json.loads(legacy)
+        except ValueError:
+            return {'value': legacy}
+        return data if isinstance(data, dict) else {'value': data}
+
+    data = decode(get('extra_data'))
+    for key in PROMOTED_KEYS:
+        value = get(key)
+        if value is not None:
+            data[key] = value
+    location = {key: get(column) for key, column in CLICK_KEYS if get(column) is not None}
+    if location:
+        data['click_location'] = {**location, **data.get('click_location', {})}
+    for key in COLUMN_KEYS:
+        value = get(key)
+        if value is not None and key not in data:
+            data[key] = value
+    return data
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Event Read Path
+Reads of clickstream events for the admin pages and exports as SQLAlchemy
+Core selects of only the columns a report uses, returned as plain named
+rows instead of ClickstreamEvent objects.
+
+An ORM query loads every column of every event (the compressed payloads
+included), builds an object for each row and registers it in the
+session's identity map, where it stays until the request ends; the
+reports read eight or so columns and never change anything. Rows from
+these selects are tuples that support attribute access (row.page_url),
+so event_origin(), event_data.load() and exports.export_row() take them
+as they took ORM objects. stream() reads them through a server-side
+cursor in batches, so memory stays flat however many events match.
+"""
+
+from sqlalchemy import select
+
+import event_data
+from models import ClickstreamEvent, User
+
+_events = ClickstreamEvent.__table__
+_users = User.__table__
+
+# Columns event_data.load() reads to rebuild additional_data
+EVENT_DATA_COLUMNS = ('additional_data',) + event_data.PACKED_COLUMNS + event_data.COLUMN_KEYS
+
+# What exports.export_row() reads
+EXPORT_COLUMNS = ('id', 'timestamp', 'page_url', 'element_type', 'event_type', 'element_id',
+                  'ip_address') + EVENT_DATA_COLUMNS
+
+# What the user activity page reads: the export columns plus the origin (see event_origin())
+ACTIVITY_COLUMNS = EXPORT_COLUMNS + ('device_type', 'browser', 'os', 'country', 'region')
+
+# Recent events on the dashboard
+RECENT_COLUMNS = ('id', 'timestamp', 'event_type', 'page_url', 'ip_address')
+
+BATCH_ROWS = 1000
+
+
+def select_events(columns, *conditions, with_user=True):
+    """Core select of the named event columns, joined to the user's username and email"""
+    selected = [_events.c[name] for name in columns]
+    source = _events
+    if with_user:
+        selected += [_users.c.username, _users.c.email]
+        source = _events.outerjoin(_users, _events.c.user_id == _users.c.id)
+    return select(*selected).select_from(source).where(*conditions)
+
+
+def stream(connection, statement, batch_rows=BATCH_ROWS):
+    """Rows of a select, fetched from a server-side cursor `batch_rows` at a time"""
+    result = connection.execution_options(stream_results=True, yield_per=batch_rows).execute(statement)
+    yield from result
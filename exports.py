@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Background Exports
+Builds clickstream exports (xlsx, CSV, NDJSON) in a pool of worker
+processes, so a large export never holds a web worker past its timeout.
+
+Each export is an ExportJob row. The worker process reads events in
+keyset-paginated chunks, writes the file under a temporary name and
+records its progress on the row after every chunk; the status endpoint
+only reads that row. A finished file is handed out again for any later
+request with the same format and filters while no events or users have
+been added since (see data_version()).
+"""
+
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select, tuple_, update
+
+import event_data
+import event_reads
+from models import ClickstreamEvent, ExportJob, User
+
+FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+HEADERS = ['Time', 'Event Context', 'Component', 'Event Name', 'Description', 'Origin', 'IP Address']
+NDJSON_KEYS = ['time', 'event_context', 'component', 'event_name', 'description', 'origin', 'ip_address']
+XLSX_COLUMN_WIDTHS = [25, 30, 15, 20, 50, 40, 16]  # Write-only sheets cannot be auto-fitted
+
+# High-volume tracking events left out unless the export asks for them
+NOISY_EVENT_TYPES = ['mouse_movement', 'visibility_change', 'time_on_page', 'scroll']
+
+CHUNK_ROWS = 5000  # Rows per read; progress is recorded after each chunk
+STALE_JOB_SECONDS = 600  # An unfinished job not updated for this long is treated as lost
+
+_events = ClickstreamEvent.__table__
+_users = User.__table__
+_jobs = ExportJob.__table__
+
+
+def normalize_filters(params):
+    """Validate export filters from a request into a canonical dict.
+
+    Accepts date_from / date_to (YYYY-MM-DD, both inclusive), event_types
+    (list or comma-separated string), user_id and include_noise. Raises
+    ValueError with a message for the client on bad input.
+    """
+    filters = {}
+    for key in ('date_from', 'date_to'):
+        value = params.get(key) or None
+        if value is not None:
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be a date in YYYY-MM-DD format')
+        filters[key] = value
+    if filters['date_from'] and filters['date_to'] and filters['date_from'] > filters['date_to']:
+        raise ValueError('date_from must not be after date_to')
+
+    event_types = params.get('event_types') or []
+    if isinstance(event_types, str):
+        event_types = event_types.split(',')
+    if not isinstance(event_types, list):
+        raise ValueError('event_types must be a list of event types')
+    filters['event_types'] = sorted({str(t).strip() for t in event_types if str(t).strip()})
+
+    user_id = params.get('user_id')
+    try:
+        filters['user_id'] = int(user_id) if user_id not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('user_id must be an integer')
+
+    include_noise = params.get('include_noise', False)
+    if isinstance(include_noise, str):
+        include_noise = include_noise.lower() in ('1', 'true', 'yes', 'on')
+    filters['include_noise'] = bool(include_noise)
+    return filters
+
+
+def data_version(connection):
+    """Marker that changes whenever events or users are added"""
+    max_event = connection.execute(select(func.max(_events.c.id))).scalar() or 0
+    max_user = connection.execute(select(func.max(_users.c.id))).scalar() or 0
+    return f'{max_event}:{max_user}'
+
+
+def cache_key(export_format, filters, version):
+    """Identical exports of the same data share a key, and so a file"""
+    payload = json.dumps([export_format, filters, version], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _conditions(filters):
+    conditions = []
+    if filters.get('date_from'):
+        conditions.append(_events.c.timestamp >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters.get('date_to'):
+        conditions.append(_events.c.timestamp < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    if filters.get('event_types'):
+        conditions.append(_events.c.event_type.in_(filters['event_types']))
+    elif not filters.get('include_noise'):
+        conditions.append(~_events.c.event_type.in_(NOISY_EVENT_TYPES))
+    if filters.get('user_id') is not None:
+        conditions.append(_events.c.user_id == filters['user_id'])
+    return conditions
+
+
+def export_row(event, username, email):
+    """The exported columns (see HEADERS) of one event"""
+    description = 'N/A'
+    data = event_data.load(event)
+    if data:
+        description = ', '.join([f"{k}: {v}" for k, v in data.items()])
+    elif event.element_id:
+        description = f"Element: {event.element_id}"
+
+    origin = 'Anonymous'
+    if username:
+        origin = f"User: {username} ({email})"
+
+    return [
+        event.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] if event.timestamp else 'N/A',
+        event.page_url or 'N/A',
+        event.element_type or 'N/A',
+        event.event_type,
+        description,
+        origin,
+        event.ip_address or 'N/A'
+    ]
+
+
+def write_xlsx(target, rows):
+    """Stream rows into a workbook; target is a path or binary file object"""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("User Analytics")
+    for col, width in enumerate(XLSX_COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
+    header_row = []
+    for header in HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+        header_row.append(cell)
+    ws.append(header_row)
+    for row in rows:
+        ws.append(row)
+    wb.save(target)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(rows)
+
+
+def write_ndjson(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(NDJSON_KEYS, row))) + '\n')
+
+
+WRITERS = {'xlsx': write_xlsx, 'csv': write_csv, 'ndjson': write_ndjson}
+
+
+# Worker process side
+
+_engines = {}
+
+
+def _get_engine(database_url):
+    if database_url not in _engines:
+        _engines[database_url] = create_engine(database_url)
+    return _engines[database_url]
+
+
+def export_select(filters):
+    """Events matching the filters, newest first, with the columns export_row() reads"""
+    return event_reads.select_events(event_reads.EXPORT_COLUMNS, *_conditions(filters)).order_by(
+        _events.c.timestamp.desc(), _events.c.id.desc())
+
+
+def _export_query(filters, after=None):
+    query = export_select(filters)
+    if after is not None:
+        # Keyset pagination: each chunk is a short read that starts where
+        # the last one ended, so no read transaction stays open while the
+        # worker records progress
+        query = query.where(tuple_(_events.c.timestamp, _events.c.id) < tuple_(*after))
+    return query.limit(CHUNK_ROWS)
+
+
+def _iter_rows(engine, job_id, filters):
+    done, after = 0, None
+    while True:
+        with engine.begin() as connection:
+            if done:
+                connection.execute(update(_jobs).where(_jobs.c.id == job_id).values(
+                    rows_done=done, updated_at=datetime.utcnow()))
+            chunk = connection.execute(_export_query(filters, after)).all()
+        if not chunk:
+            return
+        for row in chunk:
+            yield export_row(row, row.username, row.email)
+        done += len(chunk)
+        after = (chunk[-1].timestamp, chunk[-1].id)
+
+
+def run_export(job_id, database_url, export_dir):
+    """Build the file of one queued job. Runs in a pool process."""
+    engine = _get_engine(database_url)
+    with engine.begin() as connection:
+        job = connection.execute(select(_jobs).where(_jobs.c.id == job_id)).first()
+        if job is None or job.status != 'queued':
+            return
+        filters = json.loads(job.filters)
+        total = connection.execute(
+            select(func.count()).select_from(_events).where(*_conditions(filters))
+        ).scalar()
+        now = datetime.utcnow()
+        connection.execute(update(_jobs).where(_jobs.c.id == job_id).values(
+            status='running', rows_total=total, started_at=now, updated_at=now))
+
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f'{job_id}.{job.format}')
+    partial_path = path + '.part'
+    try:
+        WRITERS[job.format](partial_path, _iter_rows(engine, job_id, filters))
+        os.replace(partial_path, path)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        with engine.begin() as connection:
+            connection.execute(update(_jobs).where(_jobs.c.id == job_id).values(
+                status='failed', error=str(e) or e.__class__.__name__,
+                finished_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+        return
+
+    with engine.begin() as connection:
+        now = datetime.utcnow()
+        connection.execute(update(_jobs).where(_jobs.c.id == job_id).values(
+            status='done', rows_done=total, file_path=path, file_size=os.path.getsize(path),
+            finished_at=now, updated_at=now))
+
+
+# Web process side
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(max_workers):
+    """The export pool of this web worker, started on first use.
+
+    Created lazily so each gunicorn worker starts its own pool after the
+    fork. Pool processes are spawned rather than forked, so they never
+    inherit the web worker's open database connections.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def is_reusable(job, now=None):
+    """Whether a job with a matching cache key can answer a new request"""
+    if job.status == 'done':
+        return bool(job.file_path) and os.path.exists(job.file_path)
+    if job.status in ('queued', 'running'):
+        return not is_stale(job, now)
+    return False
+
+
+def is_stale(job, now=None):
+    """An unfinished job whose worker has stopped reporting (e.g. the web worker was restarted)"""
+    if job.status not in ('queued', 'running'):
+        return False
+    last_update = job.updated_at or job.created_at
+    return (now or datetime.utcnow()) - last_update > timedelta(seconds=STALE_JOB_SECONDS)
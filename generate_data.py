@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Generator
+Fills the database with realistic students, browsing sessions,
+clickstream events (page views, clicks, video and quiz actions,
+heartbeats, mouse paths) and quiz attempts at production scale, so
+performance work can run against realistic volumes.
+
+The date range is split into slices of about SLICE_EVENTS events each.
+Worker processes generate slices in parallel into temporary SQLite
+files, and the main process copies each finished slice into the
+database in time order with INSERT ... SELECT, with the event indexes
+and search triggers dropped until the end. The slicing depends only on
+--events, so the same --seed and options on the same starting database
+always produce the same rows (for a fixed --end date), whatever
+--workers is.
+
+Usage:
+    python generate_data.py --events 1000000
+    python generate_data.py --events 20000000 --days 180 --workers 8 --seed 7
+    python generate_data.py --events 1000000 --rebuild-aggregates
+"""
+
+import argparse
+import bisect
+import json
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import bulk_insert
+import event_data
+
+BASE_URL = 'http://localhost:5000'
+LESSONS_PER_COURSE = 6
+VIDEO_SECONDS = 600
+ANONYMOUS_SESSION_SHARE = 0.25
+USERS_PER_EVENT = 1 / 200  # Default number of students for a given event count
+SLICE_EVENTS = 50_000  # Events per slice; each slice is generated from its own seeded RNG
+
+# Relative share of sessions starting in each hour of the day (UTC)
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 4, 7, 10, 12, 13, 13, 12, 12, 13, 14, 14, 13, 12, 12, 11, 9, 6, 4]
+
+HOMEPAGE_BUTTONS = [('Login', 'btn btn-primary'), ('Register', 'btn btn-secondary'),
+                    ('Browse Courses', 'btn btn-large')]
+LESSON_BUTTONS = [('Next Lesson', 'btn btn-primary'), ('Previous Lesson', 'btn btn-secondary'),
+                  ('Mark Complete', 'btn btn-success')]
+
+
+def format_timestamp(seconds):
+    # Same text as bulk_insert.TIMESTAMP_FORMAT; isoformat is several times faster than strftime
+    return datetime.utcfromtimestamp(seconds).isoformat(' ', 'microseconds')
+
+
+class SessionGenerator:
+    """Generates the events of one browsing session at a time"""
+
+    def __init__(self, rng, catalog, users):
+        self.rng = rng
+        self.courses = catalog['courses']  # {course_id: [lesson ids in order]}
+        self.lessons = catalog['lessons']  # {lesson_id: {...}}
+        self.course_ids = sorted(self.courses)
+        self.lesson_ids = sorted(self.lessons)
+        self.users = users  # [(id, created_at seconds, ip)] sorted by created_at
+        self.user_created = [user[1] for user in users]
+        self.events = []
+        self.attempts = []
+
+    def pick_user(self, start):
+        """A student registered before the session, or None for an anonymous visitor"""
+        registered = bisect.bisect_right(self.user_created, start)
+        if not registered or self.rng.random() < ANONYMOUS_SESSION_SHARE:
+            return None
+        # Recently registered students are more active than long-registered ones
+        return self.users[registered - 1 - min(int(self.rng.expovariate(3 / registered)), registered - 1)]
+
+    def add(self, t, event_type, element_id, element_type, page, data=None,
+            video=(None, None, None), quiz=(None, None, None)):
+        timestamp = format_timestamp(t)
+        self.events.append((
+            self.user_id, self.session_id, event_type, element_id, element_type, BASE_URL + page,
+            timestamp, *event_data.pack(data).values(), self.ip,
+            '%032x' % self.rng.getrandbits(128), timestamp,
+            *video, *quiz
+        ))
+
+    def click_location(self):
+        return {'x': self.rng.randint(20, 1200), 'y': self.rng.randint(20, 800)}
+
+    def session(self, start):
+        rng = self.rng
+        user = self.pick_user(start)
+        self.user_id = user[0] if user else None
+        self.ip = user[2] if user else f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+        self.session_id = '%032x' % rng.getrandbits(128)
+
+        roll = rng.random()
+        if roll < 0.5:
+            page = '/'
+        elif roll < 0.7:
+            page = f'/course/{rng.choice(self.course_ids)}'
+        else:
+            page = f'/lesson/{rng.choice(self.lesson_ids)}'
+
+        t, referrer = start, ''
+        for _ in range(30):
+            t, next_page = self.visit(page, t, referrer)
+            if next_page is None:
+                break
+            referrer, page = BASE_URL + page, next_page
+
+    def visit(self, page, t, referrer):
+        """Events of one page view; returns (time on leaving, next page or None)"""
+        rng = self.rng
+        kind, _, ident = page.strip('/').partition('/')
+        lesson = self.lessons.get(int(ident)) if kind == 'lesson' else None
+        title = lesson['title'] if lesson else 'Learning Website'
+        self.add(t, 'page_view', title, 'page', page, {'page_title': title, 'referrer': referrer})
+
+        dwell = min(rng.lognormvariate(3.7, 1.0), 1800)  # Median about 40 seconds
+        end = t + dwell
+        for heartbeat in range(60, int(dwell), 60):
+            self.add(t + heartbeat, 'time_on_page', f'time_{heartbeat}s', 'time', page,
+                     {'time_spent_seconds': heartbeat, 'page_url': BASE_URL + page})
+        for start in range(0, int(dwell), 30):
+            if rng.random() < 0.5:
+                points = rng.randint(2, 40)
+                self.add(t + start + rng.random() * 30, 'mouse_movement', 'mouse_path', 'mouse', page,
+                         {'point_count': points, 'page_url': BASE_URL + page})
+        if dwell > 120 and rng.random() < 0.3:
+            self.add(t + rng.random() * dwell, 'visibility_change', 'page_hidden', 'visibility', page,
+                     {'hidden': True})
+
+        if lesson and lesson['content_type'] == 'video':
+            self.watch_video(lesson, t, dwell, page)
+        elif lesson and lesson['content_type'] == 'quiz':
+            self.take_quiz(lesson, t, dwell, page)
+        buttons = LESSON_BUTTONS if kind == 'lesson' else HOMEPAGE_BUTTONS
+        for _ in range(rng.choices((0, 1, 2, 3), weights=(4, 3, 2, 1))[0]):
+            text, css_class = rng.choice(buttons)
+            self.add(t + rng.random() * dwell, 'click', text, 'button', page,
+                     {'button_text': text, 'button_class': css_class, 'click_location': self.click_location()})
+
+        next_page = self.next_page(kind, ident)
+        if next_page is not None:
+            link_text = self.lessons[int(next_page.rsplit('/', 1)[1])]['title'] if next_page.startswith('/lesson/') else 'View Course'
+            self.add(end, 'click', BASE_URL + next_page, 'link', page,
+                     {'link_text': link_text, 'link_href': BASE_URL + next_page,
+                      'click_location': self.click_location()})
+        self.add(end + 0.05, 'page_exit', 'page_exit', 'page', page,
+                 {'time_spent_seconds': round(dwell), 'page_url': BASE_URL + page})
+        return end + rng.uniform(0.2, 2.0), next_page
+
+    def next_page(self, kind, ident):
+        rng = self.rng
+        if rng.random() < 0.25:
+            return None
+        if kind == 'course':
+            lessons = self.courses[int(ident)]
+            return f'/lesson/{lessons[0] if rng.random() < 0.6 else rng.choice(lessons)}'
+        if kind == 'lesson':
+            lesson = self.lessons[int(ident)]
+            lessons = self.courses[lesson['course_id']]
+            position = lessons.index(lesson['id'])
+            if position + 1 < len(lessons) and rng.random() < 0.7:
+                return f'/lesson/{lessons[position + 1]}'
+            return f"/course/{lesson['course_id']}"
+        return f'/course/{rng.choice(self.course_ids)}'
+
+    def watch_video(self, lesson, t, dwell, page):
+        rng = self.rng
+        video_id = str(lesson['id'])
+        element_id = f'video_{video_id}'
+        position = 0.0 if rng.random() < 0.7 else rng.uniform(0, VIDEO_SECONDS / 2)
+        clock = t + rng.uniform(1, 5)
+        self.add(clock, 'video_action', element_id, 'video', page, video=(video_id, 'play', position))
+        watched = min(dwell, VIDEO_SECONDS - position) * rng.uniform(0.3, 1.0)
+        for offset in range(10, int(watched), 10):
+            self.add(clock + offset, 'video_action', element_id, 'video', page,
+                     video=(video_id, 'progress', position + offset))
+        if position + watched >= VIDEO_SECONDS - 1:
+            self.add(clock + watched, 'video_action', element_id, 'video', page,
+                     video=(video_id, 'complete', float(VIDEO_SECONDS)))
+        else:
+            self.add(clock + watched, 'video_action', element_id, 'video', page,
+                     video=(video_id, 'pause', position + watched))
+
+    def take_quiz(self, lesson, t, dwell, page):
+        rng = self.rng
+        questions = lesson['questions']  # [(id, correct answer, option count)]
+        if not questions or rng.random() < 0.3:
+            return
+        clock = t + min(dwell * 0.8, 20 + 10 * len(questions))
+        answers, correct = {}, 0
+        for index, (question_id, correct_answer, options) in enumerate(questions):
+            answer = correct_answer if rng.random() < 0.65 else rng.randrange(options)
+            answers[str(index)] = answer
+            correct += answer == correct_answer
+            self.add(clock, 'quiz_action', f'question_{question_id}', 'quiz_question', page,
+                     quiz=(str(lesson['id']), str(question_id), str(answer)))
+        score = correct / len(questions) * 100
+        self.add(clock + 0.5, 'quiz_action', f"quiz_{lesson['id']}_complete", 'quiz', page,
+                 {'score': score, 'total_questions': len(questions)})
+        if self.user_id:
+            self.attempts.append((self.user_id, lesson['id'], score, json.dumps(answers),
+                                  format_timestamp(clock + 0.5)))
+
+
+_worker_state = {}
+
+
+def init_worker(users, catalog):
+    """Hand the students and lessons to a worker once rather than with every slice"""
+    _worker_state['users'] = users
+    _worker_state['catalog'] = catalog
+
+
+def hour_windows(start, end):
+    """The UTC hours overlapping [start, end) as (from, to, weight), weighted
+    by HOUR_WEIGHTS and the share of the hour covered"""
+    windows = []
+    hour = math.floor(start / 3600)
+    while hour * 3600 < end:
+        low, high = max(start, hour * 3600), min(end, (hour + 1) * 3600)
+        if high > low:
+            windows.append((low, high, HOUR_WEIGHTS[hour % 24] * (high - low) / 3600))
+        hour += 1
+    return windows
+
+
+def generate_slice(task):
+    """Generate one time slice into its own SQLite file. Runs in a worker process."""
+    index, seed, path, start, end, quota = task
+    rng = random.Random(f'{seed}:{index}')
+    generator = SessionGenerator(rng, _worker_state['catalog'], _worker_state['users'])
+
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute(f"CREATE TABLE events ({', '.join(bulk_insert.EVENT_COLUMNS)})")
+    connection.execute('CREATE TABLE attempts (user_id, lesson_id, score, answers, completed_at)')
+    event_sql = f"INSERT INTO events VALUES ({', '.join('?' * len(bulk_insert.EVENT_COLUMNS))})"
+
+    # Slices do not start at midnight, so the quota is spread over the UTC
+    # days they overlap by how much of the daily traffic each part covers
+    day_windows = []
+    day_start = math.floor(start / 86400) * 86400
+    while day_start < end:
+        day_windows.append(hour_windows(max(start, day_start), min(end, day_start + 86400)))
+        day_start += 86400
+    total_weight = sum(weight for windows in day_windows for _, _, weight in windows) or 1
+    written = attempts = covered = 0
+    for windows in day_windows:
+        weights = [weight for _, _, weight in windows]
+        covered += sum(weights)
+        target = round(quota * covered / total_weight) - written
+        generator.events, generator.attempts = [], []
+        while len(generator.events) < target:
+            # Draw session start times a batch at a time
+            for low, high, _ in rng.choices(windows, weights=weights, k=256):
+                generator.session(rng.uniform(low, high))
+                if len(generator.events) >= target:
+                    break
+        generator.events.sort(key=lambda event: event[6])
+        connection.execute('BEGIN')
+        connection.executemany(event_sql, generator.events)
+        connection.executemany('INSERT INTO attempts VALUES (?, ?, ?, ?, ?)', generator.attempts)
+        connection.execute('COMMIT')
+        written += len(generator.events)
+        attempts += len(generator.attempts)
+    connection.close()
+    return index, path, written, attempts
+
+
+def ensure_catalog(course_count):
+    """Add synthetic courses up to course_count and describe every lesson. Needs an app context."""
+    from models import db, Course, Lesson, QuizQuestion
+
+    for number in range(Course.query.count() + 1, course_count + 1):
+        course = Course(title=f'Synthetic Course {number}', description='Generated for scale testing')
+        db.session.add(course)
+        db.session.flush()
+        for order in range(1, LESSONS_PER_COURSE + 1):
+            content_type = ('text', 'video', 'quiz')[(order - 1) % 3]
+            lesson = Lesson(title=f'Course {number} Lesson {order}', content_type=content_type,
+                            content=f'Synthetic {content_type} lesson {order} of course {number}',
+                            course_id=course.id, order=order)
+            db.session.add(lesson)
+            db.session.flush()
+            if content_type == 'quiz':
+                for question in range(1, 6):
+                    db.session.add(QuizQuestion(question=f'Question {question}?',
+                                                options=json.dumps(['A', 'B', 'C', 'D']),
+                                                correct_answer=question % 4, lesson_id=lesson.id))
+    db.session.commit()
+
+    catalog = {'courses': {}, 'lessons': {}}
+    for lesson in Lesson.query.order_by(Lesson.course_id, Lesson.order, Lesson.id):
+        catalog['courses'].setdefault(lesson.course_id, []).append(lesson.id)
+        catalog['lessons'][lesson.id] = {
+            'id': lesson.id, 'course_id': lesson.course_id, 'title': lesson.title,
+            'content_type': lesson.content_type,
+            'questions': [(q.id, q.correct_answer, len(json.loads(q.options or '[]')) or 4)
+                          for q in lesson.quiz_questions]
+        }
+    return catalog
+
+
+def create_users(connection, rng, count, start, end):
+    """Insert students registered across the date range, more of them early on"""
+    from werkzeug.security import generate_password_hash
+
+    password_hash = generate_password_hash('password')  # Hashing is slow; every student shares one
+    first_id = connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM "user"').fetchone()[0]
+    users, rows = [], []
+    for offset in range(count):
+        user_id = first_id + offset
+        created = start + (end - start) * rng.betavariate(1.0, 2.0)
+        ip = f'{rng.randint(11, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+        users.append((user_id, created, ip))
+        rows.append((user_id, f'student{user_id}', f'student{user_id}@example.com', password_hash,
+                     format_timestamp(created)))
+    connection.execute('BEGIN')
+    connection.executemany(
+        'INSERT INTO "user" (id, username, email, password_hash, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+    connection.execute('COMMIT')
+    users.sort(key=lambda user: user[1])
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic users and clickstream events')
+    parser.add_argument('--events', type=int, default=1_000_000, help='Approximate number of events')
+    parser.add_argument('--users', type=int, help='Students to create (default: events / 200)')
+    parser.add_argument('--days', type=int, default=90, help='Days of history')
+    parser.add_argument('--end', default=datetime.utcnow().strftime('%Y-%m-%d'),
+                        help='Last day of history, YYYY-MM-DD (default: today)')
+    parser.add_argument('--courses', type=int, default=5, help='Total courses, added as needed')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Generator processes')
+    parser.add_argument('--seed', type=int, default=1, help='Same seed, same data')
+    parser.add_argument('--rebuild-aggregates', action='store_true',
+                        help='Replay the events into the aggregate tables afterwards (slow for large runs)')
+    args = parser.parse_args()
+
+    from app import create_app, create_tables
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        create_tables()
+        if db.engine.url.get_backend_name() != 'sqlite':
+            parser.error('the generator writes directly into SQLite databases only')
+        database = db.engine.url.database
+        catalog = ensure_catalog(args.courses)
+        db.session.remove()
+        db.engine.dispose()
+
+    rng = random.Random(args.seed)
+    end = (datetime.strptime(args.end, '%Y-%m-%d') + timedelta(days=1) - datetime(1970, 1, 1)).total_seconds()
+    start = end - args.days * 86400
+    connection = bulk_insert.connect(database)
+    users = create_users(connection, rng, args.users or max(1, int(args.events * USERS_PER_EVENT)), start, end)
+    print(f"Created {len(users)} students")
+
+    began = time.perf_counter()
+    slices = max(1, math.ceil(args.events / SLICE_EVENTS))
+    slice_seconds = (end - start) / slices
+    bounds = [(start + index * slice_seconds, start + (index + 1) * slice_seconds) for index in range(slices)]
+    # Each slice gets the share of the events its hours of the day carry
+    covered = [0.0]
+    for slice_start, slice_end in bounds:
+        covered.append(covered[-1] + sum(weight for _, _, weight in hour_windows(slice_start, slice_end)))
+    scratch = tempfile.mkdtemp(prefix='generate_data_')
+    tasks = [(index, args.seed, os.path.join(scratch, f'slice{index}.db'), slice_start, slice_end,
+              round(args.events * covered[index + 1] / covered[-1]) - round(args.events * covered[index] / covered[-1]))
+             for index, (slice_start, slice_end) in enumerate(bounds)]
+
+    columns = ', '.join(bulk_insert.EVENT_COLUMNS)
+    total_events = total_attempts = 0
+    with bulk_insert.deferred_indexes(connection), multiprocessing.Pool(
+            args.workers, initializer=init_worker, initargs=(users, catalog)) as pool:
+        # Slices are copied in order as they finish, while later ones are still generating
+        for index, path, events, attempts in pool.imap(generate_slice, tasks):
+            connection.execute('ATTACH DATABASE ? AS slice', (path,))
+            connection.execute('BEGIN')
+            connection.execute(f'INSERT INTO clickstream_event ({columns}) '
+                               f'SELECT {columns} FROM slice.events ORDER BY rowid')
+            connection.execute('INSERT INTO quiz_attempt (user_id, lesson_id, score, answers, completed_at) '
+                               'SELECT * FROM slice.attempts')
+            connection.execute('COMMIT')
+            connection.execute('DETACH DATABASE slice')
+            os.remove(path)
+            total_events += events
+            total_attempts += attempts
+            print(f"  slice {index + 1}/{slices}: {total_events} events", end='\r', flush=True)
+        print()
+        print("Rebuilding indexes...")
+    os.rmdir(scratch)
+    connection.close()
+
+    elapsed = time.perf_counter() - began
+    print(f"Wrote {total_events} events and {total_attempts} quiz attempts in {elapsed:.1f}s "
+          f"({total_events / elapsed:,.0f} events/s)")
+
+    bulk_insert.rebuild_aggregates(app, run=args.rebuild_aggregates)
+
+
+if __name__ == "__main__":
+    main()
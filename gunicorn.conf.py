@@ -0,0 +1,40 @@
+"""
+Gunicorn Configuration
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is loaded once in the master (preload_app) and workers are forked
+from it, so the imported code and templates are shared copy-on-write.
+
+Workers are threaded (gthread): a request waiting on a password hash
+(see password_hashing.py), an export or the database leaves the worker's
+other threads serving pages. Async workers such as gevent are not
+supported; they need monkey patching the password and export pools
+were not written for.
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything loaded so far into the permanent generation. The
+    # collector then never writes to those objects' headers in the workers,
+    # which would otherwise copy the shared pages into every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections must not be shared across processes; drop any the master
+    # may have opened so each worker creates its own
+    from models import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
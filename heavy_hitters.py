@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Heavy Hitters
+Space-Saving summaries for finding the most frequent items of a stream
+(e.g. the most clicked elements) in a fixed number of counters.
+
+A summary is a dict {item: [count, error]} holding at most `capacity`
+items. When a new item arrives and the summary is full, it takes over
+the counter of the least frequent item and inherits its count as error,
+so counts are over-estimates by at most `error`, which is never more than
+total / capacity. Any item occurring more often than that is guaranteed
+to be in the summary.
+"""
+
+import heapq
+
+CAPACITY = 100  # Counters per summary; reported top lists are much shorter
+
+
+def add(summary, item, weight=1, capacity=CAPACITY):
+    """Count `weight` occurrences of an item"""
+    if item in summary:
+        summary[item][0] += weight
+    elif len(summary) < capacity:
+        summary[item] = [weight, 0]
+    else:
+        evicted = min(summary, key=lambda key: summary[key][0])
+        count = summary.pop(evicted)[0]
+        summary[item] = [count + weight, count]
+    return summary
+
+
+def add_counts(summary, counts, capacity=CAPACITY):
+    """Add a {item: occurrences} batch, largest first so rare items evict last"""
+    for item, weight in sorted(counts.items(), key=lambda pair: -pair[1]):
+        add(summary, item, weight, capacity)
+    return summary
+
+
+def merge(summaries, capacity=CAPACITY):
+    """Combine summaries of disjoint streams (e.g. consecutive hours).
+
+    Counts and errors are summed and the `capacity` largest kept, which
+    keeps the same error bound over the combined stream. An item missing
+    from a full summary may still have occurred up to that summary's
+    smallest count times, so that much is added to both its count and
+    its error; missing from a summary with spare counters, it never
+    occurred there.
+    """
+    summaries = list(summaries)
+    combined = {}
+    for summary in summaries:
+        for item in summary:
+            combined.setdefault(item, [0, 0])
+    for summary in summaries:
+        floor = min(count for count, _ in summary.values()) if len(summary) >= capacity else 0
+        for item, entry in combined.items():
+            count, error = summary.get(item, (floor, floor))
+            entry[0] += count
+            entry[1] += error
+    kept = heapq.nlargest(capacity, combined.items(), key=lambda pair: pair[1][0])
+    return {item: entry for item, entry in kept}
+
+
+def top(summary, n=20):
+    """The n most frequent items as [(item, count, error)], most frequent first"""
+    return [(item, count, error)
+            for item, (count, error) in heapq.nlargest(n, summary.items(), key=lambda pair: pair[1][0])]
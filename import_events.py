@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Bulk Event Import
+Loads clickstream events from CSV, NDJSON or Parquet files straight into
+the database: archives, data merged from another deployment, or the CSV
+written by view_data.py (option 7, export_events_to_csv()).
+
+Input is read and validated in chunks and inserted with executemany,
+with the event indexes and search triggers dropped until the end. Each
+chunk is committed together with the file's checkpoint, so an
+interrupted import resumes after the last committed chunk when run
+again; a killed import's committed events are added to the search
+index when the app or the next import recreates the triggers. Events that carry an event_id are inserted with INSERT OR IGNORE,
+so events already in the database are skipped.
+
+Usage:
+    python import_events.py clickstream_events.csv
+    python import_events.py archive.ndjson --chunk-size 100000
+    python import_events.py archive.parquet --rebuild-aggregates
+    python import_events.py clickstream_events.csv --restart   # ignore the checkpoint
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import bulk_insert
+import event_data
+
+# Header written by view_data.export_events_to_csv(). That file quotes every
+# field without escaping quotes inside them (e.g. in additional_data JSON),
+# so it is split on the '","' between fields instead of parsed as CSV
+VIEW_DATA_HEADER = ('Timestamp,Event Type,Element ID,Element Type,Page URL,Username,Session ID,'
+                    'Video ID,Video Action,Video Time,Quiz ID,Question ID,Answer Selected,Additional Data')
+
+MAX_REJECTS_LOGGED = 1000
+
+
+def column_name(header):
+    """'Event Type' -> 'event_type'"""
+    return '_'.join(header.strip().lower().split())
+
+
+def read_view_data_csv(f):
+    """Records of a view_data.py export, as dicts keyed by column name"""
+    columns = [column_name(name) for name in VIEW_DATA_HEADER.split(',')]
+    separators = len(columns) - 1
+    for line in f:
+        # A field containing a newline continues the record on the next line
+        while line.count('","') < separators or not line.rstrip('\r\n').endswith('"'):
+            more = next(f, None)
+            if more is None:
+                break
+            line += more
+        values = line.rstrip('\r\n')[1:-1].split('","')
+        if len(values) != len(columns):
+            yield ValueError(f'expected {len(columns)} quoted fields, found {len(values)}')
+            continue
+        yield dict(zip(columns, values))
+
+
+def read_csv(path):
+    f = open(path, newline='', encoding='utf-8')
+    header = f.readline()
+    if header.strip() == VIEW_DATA_HEADER:
+        yield from read_view_data_csv(f)
+    else:
+        f.seek(0)
+        reader = csv.reader(f)
+        columns = [column_name(name) for name in next(reader)]
+        for values in reader:
+            yield dict(zip(columns, values))
+    f.close()
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield ValueError(f'invalid JSON: {e}')
+                continue
+            yield {column_name(k): v for k, v in record.items()} if isinstance(record, dict) \
+                else ValueError('each line must be a JSON object')
+
+
+def read_parquet(path):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet input needs pyarrow: pip install pyarrow")
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=65536):
+        for record in batch.to_pylist():
+            yield {column_name(k): v for k, v in record.items()}
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson, 'jsonl': read_ndjson, 'parquet': read_parquet}
+
+
+def parse_timestamp(value):
+    """Normalize a timestamp to how SQLAlchemy stores DateTime in SQLite (naive UTC).
+
+    Accepts 'YYYY-MM-DD HH:MM:SS[.ffffff]', ISO 8601 with 'T', 'Z' or an
+    offset, and Unix times in seconds or milliseconds.
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+        seconds = float(value)
+        if seconds > 1e11:  # Milliseconds
+            seconds /= 1000
+        return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None).isoformat(' ', 'microseconds')
+    else:
+        text = str(value).strip()
+        # Fast path for the common naive forms
+        if len(text) in (19, 26) and text[4] == '-' and text[10] in ' T' and text[13] == ':':
+            text = text[:10] + ' ' + text[11:]
+            return text + '.000000' if len(text) == 19 else text
+        moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.isoformat(' ', 'microseconds')
+
+
+class EventMapper:
+    """Validates input records and maps them to clickstream_event rows"""
+
+    def __init__(self, connection, source_name):
+        from models import ClickstreamEvent
+        columns = ClickstreamEvent.__table__.columns
+        self.lengths = {name: getattr(columns[name].type, 'length', None) for name in bulk_insert.EVENT_COLUMNS}
+        self.usernames = dict(connection.execute('SELECT username, id FROM "user"'))
+        self.user_ids = set(self.usernames.values())
+        self.default_session = f'import:{source_name}'
+        self.unknown_users = 0
+
+    def text(self, record, name):
+        value = record.get(name)
+        if value is None or value == '':
+            return None
+        if not isinstance(value, str):
+            value = str(value)
+        length = self.lengths[name]
+        return value[:length] if length else value
+
+    def user_id(self, record):
+        user_id = record.get('user_id')
+        if user_id not in (None, ''):
+            user_id = int(user_id)
+            if user_id not in self.user_ids:
+                self.unknown_users += 1
+                return None
+            return user_id
+        username = record.get('username')
+        if username in (None, '', 'Anonymous'):
+            return None
+        if username not in self.usernames:
+            self.unknown_users += 1
+        return self.usernames.get(username)
+
+    def row(self, record):
+        """The clickstream_event values of a record; raises ValueError if it is invalid"""
+        event_type = self.text(record, 'event_type')
+        if not event_type:
+            raise ValueError('event_type is required')
+        timestamp = parse_timestamp(record.get('timestamp'))
+        if timestamp is None:
+            raise ValueError('timestamp is required')
+
+        additional_data = record.get('additional_data')
+        if isinstance(additional_data, str) and additional_data:
+            try:
+                additional_data = json.loads(additional_data)
+            except ValueError:
+                pass
+        if additional_data in (None, ''):
+            additional_data = {}
+        elif not isinstance(additional_data, dict):
+            additional_data = {'value': additional_data}
+        video_time = record.get('video_time')
+        video_time = float(video_time) if video_time not in (None, '') else None
+        columns = {
+            'video_id': self.text(record, 'video_id'),
+            'video_action': self.text(record, 'video_action'),
+            'video_time': video_time,
+            'quiz_id': self.text(record, 'quiz_id'),
+            'question_id': self.text(record, 'question_id'),
+            'answer_selected': self.text(record, 'answer_selected'),
+        }
+
+        return (
+            self.user_id(record),
+            self.text(record, 'session_id') or self.default_session,
+            event_type,
+            self.text(record, 'element_id'),
+            self.text(record, 'element_type'),
+            self.text(record, 'page_url'),
+            timestamp,
+            *event_data.pack(additional_data, columns).values(),
+            self.text(record, 'ip_address'),
+            self.text(record, 'event_id'),
+            parse_timestamp(record.get('client_timestamp')),
+            *columns.values(),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load clickstream events from CSV, NDJSON or Parquet')
+    parser.add_argument('path', help='Input file')
+    parser.add_argument('--format', choices=sorted(READERS), help='Input format (default: from the extension)')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per transaction and checkpoint')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+    parser.add_argument('--rebuild-aggregates', action='store_true',
+                        help='Replay the events into the aggregate tables afterwards')
+    args = parser.parse_args()
+
+    input_format = args.format or os.path.splitext(args.path)[1].lstrip('.').lower()
+    if input_format not in READERS:
+        parser.error('unknown input format; pass --format')
+    source = os.path.abspath(args.path)
+    stat = os.stat(source)
+    fingerprint = f'{stat.st_size}:{int(stat.st_mtime)}'
+
+    from app import create_app, create_tables
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        create_tables()
+        if db.engine.url.get_backend_name() != 'sqlite':
+            parser.error('the importer writes directly into SQLite databases only')
+        database = db.engine.url.database
+        db.engine.dispose()
+
+    connection = bulk_insert.connect(database)
+    checkpoint = connection.execute(
+        'SELECT fingerprint, rows_done, inserted, rejected, finished_at FROM import_checkpoint WHERE source = ?',
+        (source,)
+    ).fetchone()
+    rows_done = inserted = rejected = 0
+    if checkpoint and not args.restart:
+        if checkpoint[0] != fingerprint:
+            raise SystemExit(f"{args.path} changed since the last import; pass --restart to import it again")
+        if checkpoint[4]:
+            raise SystemExit(f"{args.path} was already imported ({checkpoint[2]} events); pass --restart to import it again")
+        rows_done, inserted, rejected = checkpoint[1:4]
+        print(f"Resuming after {rows_done} records")
+    now = datetime.utcnow().isoformat(' ', 'microseconds')
+    connection.execute(
+        'INSERT OR REPLACE INTO import_checkpoint (source, fingerprint, rows_done, inserted, rejected, started_at, updated_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', (source, fingerprint, rows_done, inserted, rejected, now, now))
+
+    mapper = EventMapper(connection, os.path.basename(source))
+    columns = ', '.join(bulk_insert.EVENT_COLUMNS)
+    insert_sql = (f"INSERT OR IGNORE INTO clickstream_event ({columns}) "
+                  f"VALUES ({', '.join('?' * len(bulk_insert.EVENT_COLUMNS))})")
+    rejects_path = source + '.rejects.ndjson'
+    rejects = open(rejects_path, 'a' if rows_done else 'w', encoding='utf-8')
+
+    records = READERS[input_format](source)
+    records = itertools.islice(records, rows_done, None)  # Skip what earlier runs committed
+    began = time.perf_counter()
+    loaded_now = 0
+    with bulk_insert.deferred_indexes(connection, keep_unique=True):
+        while True:
+            chunk = list(itertools.islice(records, args.chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for number, record in enumerate(chunk, rows_done + 1):
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    rows.append(mapper.row(record))
+                except (ValueError, TypeError) as e:
+                    rejected += 1
+                    if rejected <= MAX_REJECTS_LOGGED:
+                        rejects.write(json.dumps({'record': number, 'error': str(e)}) + '\n')
+
+            connection.execute('BEGIN')
+            before = connection.total_changes
+            connection.executemany(insert_sql, rows)
+            inserted += connection.total_changes - before
+            rows_done += len(chunk)
+            connection.execute(
+                'UPDATE import_checkpoint SET rows_done = ?, inserted = ?, rejected = ?, updated_at = ? WHERE source = ?',
+                (rows_done, inserted, rejected, datetime.utcnow().isoformat(' ', 'microseconds'), source))
+            connection.execute('COMMIT')
+            loaded_now += len(chunk)
+            elapsed = time.perf_counter() - began
+            print(f"  {rows_done} records, {inserted} inserted, {rejected} rejected "
+                  f"({loaded_now / elapsed:,.0f} records/s)", end='\r', flush=True)
+        print()
+        print("Rebuilding indexes...")
+
+    connection.execute('UPDATE import_checkpoint SET finished_at = ? WHERE source = ?',
+                       (datetime.utcnow().isoformat(' ', 'microseconds'), source))
+    rejects.close()
+    if not rejected:
+        os.remove(rejects_path)
+    connection.close()
+
+    elapsed = time.perf_counter() - began
+    print(f"Imported {inserted} events from {rows_done} records in {elapsed:.1f}s; "
+          f"{rows_done - inserted - rejected} duplicates skipped, {rejected} rejected")
+    if rejected:
+        print(f"Rejected records are listed in {rejects_path}")
+    if mapper.unknown_users:
+        print(f"{mapper.unknown_users} events named students not in this database and were stored as anonymous")
+
+    bulk_insert.rebuild_aggregates(app, run=args.rebuild_aggregates)
+
+
+if __name__ == "__main__":
+    main()
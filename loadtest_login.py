@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Login Storm Load Test
+Simulates the start of a class: N students logging in at the same moment,
+while a probe keeps requesting a cheap page. Reports the probe's latency
+percentiles before and during the storm, and how the logins themselves
+fared (successes, 503s from a full password hashing queue, errors).
+
+With hashing on the request thread the probe's tail grows with N; with
+the password hashing pool (PASSWORD_HASH_WORKERS >= 1, the default) and
+threaded gunicorn workers it should stay close to the idle numbers.
+
+Run it against a server started separately, e.g.
+`gunicorn -c gunicorn.conf.py wsgi:app`. The students are registered on
+the first run and reused afterwards.
+
+Usage:
+    python loadtest_login.py                                   # 50 logins against localhost:8000
+    python loadtest_login.py --url http://127.0.0.1:5000 --logins 200
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+PASSWORD = 'loadtest-password'
+
+
+def username(index):
+    return f'loadtest_{index:04d}'
+
+
+def register_students(url, count):
+    """Register any of the test students that do not exist yet"""
+    for index in range(count):
+        session = requests.Session()
+        response = session.post(f'{url}/login', data={'username': username(index), 'password': PASSWORD},
+                                allow_redirects=False)
+        if response.status_code == 302 and '/login' not in response.headers.get('Location', ''):
+            continue  # Already registered
+        session.post(f'{url}/register', data={
+            'username': username(index), 'email': f'{username(index)}@example.com', 'password': PASSWORD
+        }, allow_redirects=False)
+
+
+def login(url, index, results):
+    start = time.perf_counter()
+    try:
+        response = requests.post(f'{url}/login', data={'username': username(index), 'password': PASSWORD},
+                                 allow_redirects=False, timeout=120)
+        location = response.headers.get('Location', '')
+        if response.status_code == 302 and '/login' not in location:
+            outcome = 'ok'
+        elif response.status_code == 503:
+            outcome = 'busy'
+        else:
+            outcome = f'http {response.status_code}'
+    except requests.RequestException as e:
+        outcome = type(e).__name__
+    results.append((outcome, time.perf_counter() - start))
+
+
+def probe(url, path, stop, latencies):
+    """Request `path` back to back until `stop` is set"""
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(url + path, timeout=120)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        return 'too few samples'
+    cuts = statistics.quantiles(latencies, n=100)
+    return (f'{len(latencies)} requests, p50 {cuts[49] * 1000:.0f} ms, p95 {cuts[94] * 1000:.0f} ms, '
+            f'p99 {cuts[98] * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms')
+
+
+def measure_probe(url, path, seconds=None, during=None):
+    """Probe latencies for `seconds`, or for as long as `during` runs"""
+    stop = threading.Event()
+    latencies = []
+    thread = threading.Thread(target=probe, args=(url, path, stop, latencies))
+    thread.start()
+    if during:
+        during()
+    else:
+        time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure other routes while many students log in at once')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running server')
+    parser.add_argument('--logins', type=int, default=50, help='Number of simultaneous logins')
+    parser.add_argument('--probe', default='/static/js/clickstream.js', help='Cheap path to time meanwhile')
+    parser.add_argument('--idle-seconds', type=float, default=5, help='How long to probe before the storm')
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+
+    print("Login Storm Load Test")
+    print("=" * 50)
+    print(f"Registering {args.logins} test students...")
+    register_students(url, args.logins)
+
+    idle = measure_probe(url, args.probe, seconds=args.idle_seconds)
+    print(f"Probe {args.probe} idle:   {percentiles(idle)}")
+
+    results = []
+
+    def storm():
+        threads = [threading.Thread(target=login, args=(url, index, results)) for index in range(args.logins)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    start = time.perf_counter()
+    during = measure_probe(url, args.probe, during=storm)
+    elapsed = time.perf_counter() - start
+    print(f"Probe {args.probe} during: {percentiles(during)}")
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print(f"{args.logins} logins in {elapsed:.1f}s: " + ', '.join(f'{k} {v}' for k, v in sorted(outcomes.items())))
+    print(f"Login latency: {percentiles([seconds for _, seconds in results])}")
+
+
+if __name__ == "__main__":
+    main()
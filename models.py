@@ -0,0 +1,303 @@
+"""
+Database Models
+All tables of the learning website. The SQLAlchemy extension is created
+here unbound and attached to the app in app.create_app().
+"""
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from flask_login import UserMixin
+from datetime import datetime
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class SnapshotRoutingSession(Session):
+    """Session that reads from the analytics snapshot while a request asks for it.
+
+    A view decorated with app.reads_snapshot sets g.snapshot_engine;
+    queries and session.connection() then use that engine, while
+    flushes and INSERT/UPDATE/DELETE statements still go to the live
+    database (the snapshot is opened read-only, so a stray write fails
+    instead of being lost).
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and not isinstance(clause, UpdateBase):
+            engine = g.get('snapshot_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': SnapshotRoutingSession})
+
+# Database Models
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(120), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    clickstream_events = db.relationship('ClickstreamEvent', backref='user', lazy=True)
+    quiz_attempts = db.relationship('QuizAttempt', backref='user', lazy=True)
+
+class Course(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    lessons = db.relationship('Lesson', backref='course', lazy=True)
+
+class Lesson(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)  # 'text', 'video', 'quiz'
+    content = db.Column(db.Text)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    order = db.Column(db.Integer, default=0)
+    
+    # Relationships
+    quiz_questions = db.relationship('QuizQuestion', backref='lesson', lazy=True)
+
+class QuizQuestion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    question = db.Column(db.Text, nullable=False)
+    options = db.Column(db.Text)  # JSON string of options
+    correct_answer = db.Column(db.Integer, nullable=False)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
+
+class QuizAttempt(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    answers = db.Column(db.Text)  # JSON string of user answers
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ClickstreamEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Nullable for anonymous users
+    session_id = db.Column(db.String(100), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)  # 'page_view', 'click', 'video_action', 'quiz_action'
+    element_id = db.Column(db.String(100), nullable=True)
+    element_type = db.Column(db.String(50), nullable=True)  # 'button', 'link', 'video', 'quiz_question'
+    page_url = db.Column(db.String(500), nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    additional_data = db.Column(db.Text)  # JSON string for extra data
+    ip_address = db.Column(db.String(45), nullable=True)  # IPv4/IPv6 support
+    
+    # Client-generated UUID; unique so retried uploads are stored only once
+    event_id = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    client_timestamp = db.Column(db.DateTime, nullable=True)  # When the browser recorded the event
+    
+    # For video tracking
+    video_id = db.Column(db.String(100), nullable=True)
+    video_action = db.Column(db.String(50), nullable=True)  # 'play', 'pause', 'seek', 'complete'
+    video_time = db.Column(db.Float, nullable=True)
+    
+    # For quiz tracking
+    quiz_id = db.Column(db.String(100), nullable=True)
+    question_id = db.Column(db.String(100), nullable=True)
+    answer_selected = db.Column(db.String(100), nullable=True)
+    
+    # additional_data keys promoted to columns at ingest; the rest of the
+    # dict is in extra_data (see event_data.py). additional_data itself is
+    # only set on events stored before this split
+    button_text = db.Column(db.String(200), nullable=True)
+    link_text = db.Column(db.String(200), nullable=True)
+    score = db.Column(db.Float, nullable=True)
+    page_title = db.Column(db.String(200), nullable=True)
+    referrer = db.Column(db.String(500), nullable=True)
+    click_x = db.Column(db.Float, nullable=True)
+    click_y = db.Column(db.Float, nullable=True)
+    sample_rate = db.Column(db.Float, nullable=True)  # Fraction of this event type the client kept; NULL for all
+    extra_data = db.Column(db.LargeBinary, nullable=True)
+    
+    # Derived at ingest from the uploading request (see enrichment.py)
+    device_type = db.Column(db.String(20), nullable=True)  # 'desktop', 'mobile', 'tablet', 'bot'
+    browser = db.Column(db.String(50), nullable=True)
+    os = db.Column(db.String(50), nullable=True)
+    country = db.Column(db.String(2), nullable=True)  # ISO 3166 code, from the IP range database
+    region = db.Column(db.String(100), nullable=True)
+
+class AdminUser(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(120), nullable=False)
+    is_admin = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VideoWatch(db.Model):
+    """Merged watched intervals of one user for one video, updated at ingest"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    video_id = db.Column(db.String(100), nullable=False)
+    intervals = db.Column(db.Text, default='[]')  # JSON list of [start, end] in seconds
+    watched_seconds = db.Column(db.Float, default=0.0)  # Length of the interval union
+    playing = db.Column(db.Boolean, default=False)
+    position = db.Column(db.Float, nullable=True)  # Last known playback position
+    dropoff_bucket = db.Column(db.Integer, nullable=True)  # Where playback last stopped
+    last_event_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'video_id'),)
+
+class VideoStats(db.Model):
+    """Per-video totals over all VideoWatch rows, updated at ingest"""
+    video_id = db.Column(db.String(100), primary_key=True)
+    duration = db.Column(db.Float, default=0.0)  # Furthest position seen
+    viewers = db.Column(db.Integer, default=0)
+    watched_seconds = db.Column(db.Float, default=0.0)  # Sum of each viewer's interval union
+    heatmap = db.Column(db.Text, default='[]')  # JSON viewer-seconds per bucket
+    dropoffs = db.Column(db.Text, default='[]')  # JSON count of viewers per bucket
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SessionNavigation(db.Model):
+    """The page a session is currently on, used to extend the transition index"""
+    session_id = db.Column(db.String(100), primary_key=True)
+    page = db.Column(db.String(500), nullable=False)
+    entered_at = db.Column(db.DateTime, nullable=False)  # Arrival on the current page
+    last_seen_at = db.Column(db.DateTime, nullable=False)
+
+class PageTransition(db.Model):
+    """How often sessions moved from one page to the next, and how long they stayed"""
+    from_page = db.Column(db.String(500), primary_key=True)
+    to_page = db.Column(db.String(500), primary_key=True)
+    count = db.Column(db.Integer, default=0)
+    dwell_histogram = db.Column(db.Text, default='{}')  # JSON {bucket: count} of dwell seconds on from_page
+
+class SessionPageVisit(db.Model):
+    """First and last time a session viewed a page, used for funnel queries"""
+    session_id = db.Column(db.String(100), primary_key=True)
+    page = db.Column(db.String(500), primary_key=True, index=True)
+    first_seen = db.Column(db.DateTime, nullable=False)
+    last_seen = db.Column(db.DateTime, nullable=False)
+    views = db.Column(db.Integer, default=1)
+
+class UserActivitySummary(db.Model):
+    """Running per-student totals, updated at ingest and on quiz submission"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    total_events = db.Column(db.Integer, default=0)
+    event_counts = db.Column(db.Text, default='{}')  # JSON {event_type: count}
+    lessons_viewed = db.Column(db.Text, default='[]')  # JSON sorted list of lesson ids
+    active_seconds = db.Column(db.Float, default=0.0)  # Sum of gaps between events shorter than the idle timeout
+    active_spans = db.Column(db.Text, nullable=True, default='[]')  # JSON recent [start, end] epoch seconds of activity
+    quiz_attempts = db.Column(db.Integer, default=0)
+    quiz_score_total = db.Column(db.Float, default=0.0)  # For the average score
+    quiz_best_scores = db.Column(db.Text, default='{}')  # JSON {lesson_id: best score}
+    
+    user = db.relationship('User', backref=db.backref('activity_summary', uselist=False))
+
+class LessonProgress(db.Model):
+    """A student's progress through one lesson, updated at ingest and on quiz submission"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), primary_key=True)
+    viewed = db.Column(db.Boolean, default=False)
+    first_viewed_at = db.Column(db.DateTime, nullable=True)
+    video_watched_percent = db.Column(db.Float, nullable=True)  # Share of the video in the watched intervals
+    quiz_best_score = db.Column(db.Float, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)  # First time the lesson counted as completed
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UniqueVisitorSketch(db.Model):
+    """HyperLogLog sketches of one page, lesson, course or the whole site for one day"""
+    dimension = db.Column(db.String(20), primary_key=True)  # 'site', 'page', 'lesson' or 'course'
+    key = db.Column(db.String(500), primary_key=True)  # Page path or id; '' for the site
+    day = db.Column(db.Date, primary_key=True)
+    users = db.Column(db.LargeBinary, nullable=False)  # unique_counts sketches, as pack() stores them
+    sessions = db.Column(db.LargeBinary, nullable=False)
+    ips = db.Column(db.LargeBinary, nullable=False)
+
+class TopClickSummary(db.Model):
+    """Space-Saving counters of the most clicked values of one field in one hour or day"""
+    field = db.Column(db.String(20), primary_key=True)  # 'element_id', 'page_url' or 'button_text'
+    period = db.Column(db.String(10), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    total = db.Column(db.Integer, default=0)  # Clicks counted, for the error bound
+    counters = db.Column(db.Text, default='{}')  # JSON {value: [count, error]}, see heavy_hitters
+
+class EventCountRollup(db.Model):
+    """Events of one type on one page in an hour or day, for the time-series API (see timeseries.py)"""
+    period = db.Column(db.String(10), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    event_type = db.Column(db.String(50), primary_key=True)
+    page = db.Column(db.String(500), primary_key=True)  # Normalized path, '' if the event had none
+    count = db.Column(db.Integer, default=0)
+
+class RetentionCohort(db.Model):
+    """Students who registered in a week (Monday start), see retention.py"""
+    cohort_week = db.Column(db.Date, primary_key=True)
+    users = db.Column(db.Integer, default=0)
+    computed_at = db.Column(db.DateTime, nullable=True)
+
+class CohortActivity(db.Model):
+    """How many students of a signup cohort were active in a later week"""
+    cohort_week = db.Column(db.Date, primary_key=True)
+    activity_week = db.Column(db.Date, primary_key=True, index=True)
+    active_users = db.Column(db.Integer, default=0)
+    computed_at = db.Column(db.DateTime, nullable=True)
+
+class ExportJob(db.Model):
+    """An export requested by an admin and built in the background"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    format = db.Column(db.String(10), nullable=False)  # 'xlsx', 'csv' or 'ndjson'
+    filters = db.Column(db.Text, default='{}')  # JSON date range and event type filters
+    cache_key = db.Column(db.String(64), nullable=False, index=True)  # Format + filters + data version
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'done', 'failed'
+    rows_total = db.Column(db.Integer, nullable=True)
+    rows_done = db.Column(db.Integer, default=0)
+    file_path = db.Column(db.String(500), nullable=True)
+    file_size = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    requested_by = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Last progress report
+
+class FeedConsumer(db.Model):
+    """A downstream reader of the event change feed and the last event id it has loaded (see change_feed.py)"""
+    name = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, default=0)  # Events with ids up to this one are loaded
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ImportCheckpoint(db.Model):
+    """Progress of a bulk import, committed with each chunk so it can resume (see import_events.py)"""
+    source = db.Column(db.String(500), primary_key=True)  # Absolute path of the input file
+    fingerprint = db.Column(db.String(100), nullable=False)  # Size and mtime, to notice a changed file
+    rows_done = db.Column(db.Integer, default=0)  # Input records consumed so far
+    inserted = db.Column(db.Integer, default=0)
+    rejected = db.Column(db.Integer, default=0)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+def upgrade_schema():
+    """Bring an existing database up to the current models.
+
+    db.create_all() only creates missing tables, so columns and indexes
+    added to existing tables since a database was created are added here.
+    New columns must be nullable. Must run inside an app context.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=connection.dialect)
+                    connection.execute(db.text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    ))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Navigation Analytics
+Pure helpers for the page-transition index: page normalization and a
+compact log-scale histogram used to keep median dwell times without
+storing every sample.
+"""
+
+import math
+from urllib.parse import urlsplit
+
+# A gap longer than this between two page views starts a new visit
+SESSION_TIMEOUT_SECONDS = 30 * 60
+
+# Dwell histogram buckets grow by this ratio, so medians are within ~12%
+DWELL_BUCKET_RATIO = 1.25
+
+# Endpoints that are requested but never viewed. Server-side events such
+# as quiz submissions and logouts are stored with these URLs, but count
+# towards no page in the aggregates
+NON_PAGE_PREFIXES = ('/api/', '/admin/api/', '/static/')
+NON_PAGE_PATHS = ('/logout',)
+
+
+def normalize_page(url):
+    """Reduce a page URL to its path, e.g. 'http://host/lesson/3?x=1' -> '/lesson/3'"""
+    if not url:
+        return None
+    path = urlsplit(url).path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    return path[:500]
+
+
+def event_page(url):
+    """The page an event happened on, or None if its URL is an API or other non-page endpoint"""
+    page = normalize_page(url)
+    if page and (page.startswith(NON_PAGE_PREFIXES) or page in NON_PAGE_PATHS):
+        return None
+    return page
+
+
+def dwell_bucket(seconds):
+    """Histogram bucket for a dwell time; bucket 0 holds everything under a second"""
+    if seconds < 1:
+        return 0
+    return 1 + int(math.log(seconds) / math.log(DWELL_BUCKET_RATIO))
+
+
+def bucket_midpoint(bucket):
+    """Representative dwell time in seconds for a histogram bucket"""
+    if bucket == 0:
+        return 0.5
+    low = DWELL_BUCKET_RATIO ** (bucket - 1)
+    return math.sqrt(low * low * DWELL_BUCKET_RATIO)
+
+
+def add_dwell(histogram, seconds):
+    """Count one dwell time in a histogram stored as {bucket: count}"""
+    key = str(dwell_bucket(seconds))
+    histogram[key] = histogram.get(key, 0) + 1
+    return histogram
+
+
+def histogram_median(histogram):
+    """Approximate median dwell time in seconds from a histogram"""
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+    seen = 0
+    for bucket in sorted(histogram, key=int):
+        seen += histogram[bucket]
+        if seen * 2 >= total:
+            return round(bucket_midpoint(int(bucket)), 1)
+    return None
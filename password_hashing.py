@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Password Hashing Pool
+Runs werkzeug's PBKDF2 password hashing and checking in a small pool of
+worker processes instead of on the request thread.
+
+One hash is hundreds of thousands of SHA-256 rounds: a few hundred
+milliseconds of CPU that holds the GIL. When a whole class logs in at
+the start of a lesson, hashing inline leaves every web worker busy and
+every other page waits behind it. With the pool, a login request only
+waits on a future, which releases the GIL, so the other threads of a
+gthread worker keep serving pages, and hashing never uses more than the
+pool's processes however many logins arrive.
+
+The queue in front of the pool is bounded as well. A login that cannot
+get a slot within QUEUE_WAIT seconds, or whose hash takes longer than
+RESULT_TIMEOUT, raises Busy; the routes answer it with 503 and
+Retry-After instead of piling up more work. A pool whose process died
+(killed for memory, say) is replaced, so later logins work again.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+QUEUE_WAIT = 5  # Seconds a request waits for a slot in the queue
+RESULT_TIMEOUT = 30  # Seconds a request waits for its hash
+
+_settings = (0, 0)  # (worker processes, queued hashes), see configure()
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """Too many password hashes are queued already"""
+
+
+def configure(workers, queue_size):
+    """Settings for the pool this process starts on first use; workers=0 hashes inline"""
+    global _settings
+    _settings = (workers, queue_size)
+
+
+def _get_pool():
+    """The pool of this web worker, started on first use.
+
+    Like the export pool, created lazily so each gunicorn worker starts
+    its own after the fork, with spawned rather than forked processes.
+    """
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            workers, queue_size = _settings
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(workers + queue_size)
+        return _pool, _slots
+
+
+def _discard_pool(pool):
+    """Forget a broken pool, unless another request has replaced it already"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(function, *args):
+    if not _settings[0]:
+        return function(*args)
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=QUEUE_WAIT):
+        raise Busy()
+    try:
+        for attempt in range(2):
+            try:
+                return pool.submit(function, *args).result(timeout=RESULT_TIMEOUT)
+            except BrokenProcessPool:
+                # A worker process died; retry once on a new pool
+                _discard_pool(pool)
+                pool = _get_pool()[0]
+        raise Busy()
+    except TimeoutError:
+        raise Busy()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    """generate_password_hash(password), computed in the pool"""
+    return _run(generate_password_hash, password)
+
+
+def check_password(password_hash, password):
+    """check_password_hash(password_hash, password), computed in the pool"""
+    return _run(check_password_hash, password_hash, password)
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Token-Bucket Rate Limiting
+Admission control for the tracking endpoints. Buckets live in a store
+that can be shared by all gunicorn workers:
+
+- SharedMemoryBucketStore keeps buckets in an anonymous shared mmap
+  created at import. With preload_app the master imports it before
+  forking, so every worker sees the same buckets and counters.
+- LocalBucketStore is a per-process dict, used as a stand-in where
+  shared memory is unavailable (each worker then limits on its own).
+"""
+
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+# Counters reported by /admin/api/rate_limits
+COUNTERS = ['requests_allowed', 'requests_rejected', 'events_allowed',
+            'events_rejected', 'events_throttled']
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+
+def _refill(tokens, updated_at, now, capacity, refill_per_second):
+    return min(capacity, tokens + (now - updated_at) * refill_per_second)
+
+
+class LocalBucketStore:
+    """Buckets in a dict owned by this process"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, capacity, refill_per_second, now):
+        """Remove `cost` tokens if available; returns seconds to wait, 0 if allowed"""
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, capacity, refill_per_second)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / refill_per_second if refill_per_second else float('inf')
+            self.buckets[key] = (tokens, now)  # Re-inserted last, so the oldest key is first
+            if len(self.buckets) > self.max_keys:
+                self.buckets.pop(next(iter(self.buckets)))
+            return wait
+
+    def incr(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def read_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class SharedMemoryBucketStore:
+    """Buckets in a fixed-size 4-way set-associative table in shared memory.
+
+    Each slot holds (key hash, tokens, last update). A key missing from its
+    set replaces the least recently updated slot, so an evicted client
+    simply starts again with a full bucket.
+    """
+
+    SLOT = struct.Struct('<Qdd')
+    WAYS = 4
+
+    def __init__(self, sets=16384):
+        self.sets = sets
+        self.counters_size = 8 * len(COUNTERS)
+        self.memory = mmap.mmap(-1, self.counters_size + sets * self.WAYS * self.SLOT.size)
+        self.lock = multiprocessing.Lock()
+
+    def take(self, key, cost, capacity, refill_per_second, now):
+        """Remove `cost` tokens if available; returns seconds to wait, 0 if allowed"""
+        key_hash = _key_hash(key)
+        base = self.counters_size + (key_hash % self.sets) * self.WAYS * self.SLOT.size
+        with self.lock:
+            slot_offset = None
+            oldest_offset, oldest_time = None, None
+            for way in range(self.WAYS):
+                offset = base + way * self.SLOT.size
+                slot_hash, tokens, updated_at = self.SLOT.unpack_from(self.memory, offset)
+                if slot_hash == key_hash:
+                    slot_offset = offset
+                    break
+                if oldest_time is None or updated_at < oldest_time:
+                    oldest_offset, oldest_time = offset, updated_at
+
+            if slot_offset is None:
+                slot_offset = oldest_offset
+                tokens, updated_at = capacity, now
+            tokens = _refill(tokens, updated_at, now, capacity, refill_per_second)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / refill_per_second if refill_per_second else float('inf')
+            self.SLOT.pack_into(self.memory, slot_offset, key_hash, tokens, now)
+            return wait
+
+    def incr(self, counter, amount=1):
+        offset = COUNTERS.index(counter) * 8
+        with self.lock:
+            value, = struct.unpack_from('<q', self.memory, offset)
+            struct.pack_into('<q', self.memory, offset, value + amount)
+
+    def read_counters(self):
+        with self.lock:
+            values = struct.unpack_from(f'<{len(COUNTERS)}q', self.memory, 0)
+        return dict(zip(COUNTERS, values))
+
+
+def create_store():
+    """Shared-memory store where the platform supports it, else a local one"""
+    try:
+        return SharedMemoryBucketStore()
+    except (OSError, ValueError, ImportError):
+        return LocalBucketStore()
+
+
+class TokenBucketLimiter:
+    """Per-IP request limits, per-client event limits and per-event-type quotas.
+
+    Limits are (capacity, refill per second) pairs read from the config
+    passed to each call, so they can differ between apps sharing a store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def allow_request(self, ip_address, limits):
+        """Charge one request to the client IP; returns seconds to wait, 0 if allowed"""
+        capacity, refill = limits['requests_per_ip']
+        wait = self.store.take(f'ip:{ip_address}', 1, capacity, refill, time.monotonic())
+        self.store.incr('requests_rejected' if wait else 'requests_allowed')
+        return wait
+
+    def admit_events(self, client_key, events, limits):
+        """Apply the client's event and event-type budgets to a batch of event dicts.
+
+        `client_key` names who is charged (an account or an IP address).
+        Returns (admitted events, seconds to wait). If the client budget
+        cannot cover the batch nothing is admitted; otherwise events of
+        types over their own quota are dropped and the rest admitted.
+        """
+        now = time.monotonic()
+        capacity, refill = limits['events_per_client']
+        wait = self.store.take(f'client:{client_key}', len(events), capacity, refill, now) if events else 0.0
+        if wait:
+            self.store.incr('events_rejected', len(events))
+            return [], wait
+
+        quotas = limits.get('event_types', {})
+        admitted = []
+        for event in events:
+            quota = quotas.get(event.get('event_type'))
+            if quota and self.store.take(f'type:{client_key}:{event["event_type"]}', 1,
+                                         quota[0], quota[1], now):
+                continue
+            admitted.append(event)
+
+        throttled = len(events) - len(admitted)
+        if throttled:
+            self.store.incr('events_throttled', throttled)
+        self.store.incr('events_allowed', len(admitted))
+        return admitted, 0.0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cohort Retention
+Materializes weekly signup-cohort retention: for every cohort (the week
+students registered) and every later week, how many of them were active.
+
+Both tables are partitioned by week. A refresh recomputes only the two
+newest activity weeks (the current, still filling week and the one before
+it, which can still receive back-dated events), so its cost depends on
+recent traffic rather than the whole event history.
+"""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+# SQLite date modifiers giving the Monday that starts a timestamp's week
+WEEK_START = "date({column}, '-6 days', 'weekday 1')"
+
+WEEKS_RECOMPUTED = 2
+
+
+def week_start(day):
+    """Monday of the week containing a date or datetime"""
+    if isinstance(day, datetime):
+        day = day.date()
+    return day - timedelta(days=day.weekday())
+
+
+def refresh_retention(connection, full=False):
+    """Recompute the newest weeks (or everything) of both retention tables.
+
+    Returns the first activity week recomputed, or None for a full rebuild.
+    """
+    start = None
+    if not full:
+        latest = connection.execute(text("SELECT MAX(activity_week) FROM cohort_activity")).scalar()
+        if latest:
+            start = date.fromisoformat(str(latest)) - timedelta(weeks=WEEKS_RECOMPUTED - 1)
+
+    now = datetime.utcnow()
+    since = start.isoformat() if start else '0000-00-00'
+    connection.execute(text("DELETE FROM cohort_activity WHERE activity_week >= :since"), {'since': since})
+    connection.execute(text(f"""
+        INSERT INTO cohort_activity (cohort_week, activity_week, active_users, computed_at)
+        SELECT {WEEK_START.format(column='u.created_at')} AS cohort_week,
+               weekly.activity_week, COUNT(*), :now
+        FROM (
+            SELECT DISTINCT user_id, {WEEK_START.format(column='timestamp')} AS activity_week
+            FROM clickstream_event
+            WHERE user_id IS NOT NULL AND timestamp >= :since
+        ) AS weekly
+        JOIN "user" u ON u.id = weekly.user_id
+        WHERE weekly.activity_week >= {WEEK_START.format(column='u.created_at')}
+        GROUP BY cohort_week, weekly.activity_week
+    """), {'since': since, 'now': now})
+
+    # A student's signup week never changes, so older cohorts keep their size
+    connection.execute(text("DELETE FROM retention_cohort WHERE cohort_week >= :since"), {'since': since})
+    connection.execute(text(f"""
+        INSERT INTO retention_cohort (cohort_week, users, computed_at)
+        SELECT {WEEK_START.format(column='created_at')} AS cohort_week, COUNT(*), :now
+        FROM "user"
+        WHERE created_at IS NOT NULL AND {WEEK_START.format(column='created_at')} >= :since
+        GROUP BY cohort_week
+    """), {'since': since, 'now': now})
+    return start
+
+
+def retention_matrix(cohorts, activity, max_weeks=12):
+    """Arrange cohort sizes and activity rows into one row per cohort.
+
+    `cohorts` is [(cohort_week, users)] and `activity` is
+    [(cohort_week, activity_week, active_users)]. Each row lists weeks
+    since signup 0..max_weeks - 1 with the share of the cohort active.
+    """
+    active = {(cohort_week, activity_week): users for cohort_week, activity_week, users in activity}
+    latest_week = week_start(datetime.utcnow())
+    rows = []
+    for cohort_week, users in sorted(cohorts):
+        weeks = []
+        for offset in range(max_weeks):
+            activity_week = cohort_week + timedelta(weeks=offset)
+            if activity_week > latest_week:
+                break
+            count = active.get((cohort_week, activity_week), 0)
+            weeks.append({
+                'week': offset,
+                'active_users': count,
+                'retention': round(count / users, 4) if users else 0.0
+            })
+        rows.append({'cohort_week': cohort_week.isoformat(), 'users': users, 'weeks': weeks})
+    return rows
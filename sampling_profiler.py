@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+On-Demand Sampling Profiler
+Profiles single live requests without restarting the server under a
+debugger. A request is profiled when an admin asks for it, with an
+`X-Profile: 1` header or a `?_profile=1` query parameter, or when it falls
+into PROFILE_SAMPLE_RATE (a fraction of all requests, 0 by default).
+
+For a profiled request a background thread samples the request thread's
+Python stack every PROFILE_INTERVAL_MS milliseconds. Nothing is traced
+or instrumented, so the request runs at close to full speed, and other
+requests are not affected at all. The samples are written to
+PROFILE_DIR in the collapsed-stack format read by flamegraph.pl and
+speedscope, next to a small JSON file describing the request; the admin
+profiles page lists them.
+"""
+
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app, g, request
+
+TRIGGER_HEADER = 'X-Profile'
+TRIGGER_PARAMETER = '_profile'
+
+
+class StackSampler(threading.Thread):
+    """Counts the distinct call stacks of one thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name=f'stack-sampler-{thread_id}', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.labels = {}  # code object -> frame label
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[self.collapse(frame)] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+    def collapse(self, frame):
+        """'outermost;...;innermost' frame labels of a stack"""
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label is None:
+                label = self.labels[code] = frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+
+def frame_label(code):
+    """'function (package/module.py:line)' for a code object"""
+    filename = code.co_filename
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            filename = filename[len(path) + 1:]
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def should_profile(is_admin):
+    if request.headers.get(TRIGGER_HEADER) == '1' or request.args.get(TRIGGER_PARAMETER) == '1':
+        return is_admin()
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def save_profile(directory, name, sampler, metadata, kept):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + '.folded'), 'w', encoding='utf-8') as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+
+    # Names start with the time, so the oldest profiles sort first
+    names = sorted(entry[:-len('.json')] for entry in os.listdir(directory) if entry.endswith('.json'))
+    for old in names[:-kept]:
+        for suffix in ('.folded', '.json'):
+            try:
+                os.remove(os.path.join(directory, old + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory, limit=100):
+    """Metadata of the newest profiles, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((entry[:-len('.json')] for entry in os.listdir(directory) if entry.endswith('.json')),
+                   reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name + '.json'), encoding='utf-8') as f:
+                profiles.append(dict(json.load(f), name=name))
+        except (OSError, ValueError):
+            continue  # Removed or still being written
+    return profiles
+
+
+def profile_path(directory, name, suffix):
+    """Path of a stored profile, or None if the name is not one"""
+    if not name or os.path.basename(name) != name or name.startswith('.'):
+        return None
+    path = os.path.join(directory, name + suffix)
+    return path if os.path.isfile(path) else None
+
+
+def hottest_functions(path, limit=30):
+    """Functions by samples spent in them (self) and under them (total)"""
+    own = collections.Counter()
+    total = collections.Counter()
+    samples = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if not stack:
+                continue
+            count = int(count)
+            samples += count
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+    return samples, [{
+        'function': function,
+        'total': count,
+        'self': own[function],
+        'total_percent': round(100 * count / samples, 1) if samples else 0.0,
+        'self_percent': round(100 * own[function] / samples, 1) if samples else 0.0
+    } for function, count in total.most_common(limit)]
+
+
+def init_app(app, is_admin):
+    """Profile requests that ask for it (admins only) or are sampled"""
+
+    @app.before_request
+    def start_sampling():
+        if not should_profile(is_admin):
+            return
+        started_at = datetime.utcnow()
+        g.profile_name = f"{started_at:%Y%m%d-%H%M%S}-{(request.endpoint or 'unknown').replace('.', '-')}-{uuid.uuid4().hex[:8]}"
+        g.profile_started = (started_at, time.perf_counter())
+        g.profile_sampler = StackSampler(threading.get_ident(), app.config['PROFILE_INTERVAL_MS'] / 1000)
+        g.profile_sampler.start()
+
+    @app.after_request
+    def name_profile(response):
+        # Sampled requests are profiled for anyone, but only admins are told
+        if 'profile_name' in g and is_admin():
+            response.headers[TRIGGER_HEADER] = g.profile_name
+        return response
+
+    @app.teardown_request
+    def finish_sampling(exception):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        sampler.stop()
+        started_at, started = g.profile_started
+        metadata = {
+            'created_at': started_at.isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            'samples': sum(sampler.stacks.values()),
+            'interval_ms': app.config['PROFILE_INTERVAL_MS'],
+            'error': repr(exception) if exception else None
+        }
+        save_profile(app.config['PROFILE_DIR'], g.profile_name, sampler, metadata, app.config['PROFILES_KEPT'])
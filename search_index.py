@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Full-Text Search Index
+SQLite FTS5 tables over the searchable parts of clickstream events and
+lessons, kept in sync with their source tables by triggers.
+"""
+
+import re
+
+from sqlalchemy import text
+
+# Searchable text of an event. Button and link text have their own columns;
+# events stored before that have them in the additional_data JSON, which is
+# free-form, so only pull keys out of it when it is valid JSON
+_EVENT_VALUES = """{prefix}.id, {prefix}.element_id, {prefix}.page_url,
+    COALESCE({prefix}.button_text, CASE WHEN json_valid({prefix}.additional_data)
+         THEN json_extract({prefix}.additional_data, '$.button_text') END),
+    COALESCE({prefix}.link_text, CASE WHEN json_valid({prefix}.additional_data)
+         THEN json_extract({prefix}.additional_data, '$.link_text') END)"""
+
+SEARCH_SCHEMA = [
+    # Contentless: the text already lives in clickstream_event, so the index
+    # only stores the inverted lists and results are joined back by rowid
+    """CREATE VIRTUAL TABLE IF NOT EXISTS event_search USING fts5(
+        element_id, page_url, button_text, link_text,
+        content='', tokenize='unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS clickstream_event_search_insert
+    AFTER INSERT ON clickstream_event BEGIN
+        INSERT INTO event_search(rowid, element_id, page_url, button_text, link_text)
+        VALUES ({_EVENT_VALUES.format(prefix='new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS clickstream_event_search_delete
+    AFTER DELETE ON clickstream_event BEGIN
+        INSERT INTO event_search(event_search, rowid, element_id, page_url, button_text, link_text)
+        VALUES ('delete', {_EVENT_VALUES.format(prefix='old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS clickstream_event_search_update
+    AFTER UPDATE OF element_id, page_url, additional_data, button_text, link_text ON clickstream_event BEGIN
+        INSERT INTO event_search(event_search, rowid, element_id, page_url, button_text, link_text)
+        VALUES ('delete', {_EVENT_VALUES.format(prefix='old')});
+        INSERT INTO event_search(rowid, element_id, page_url, button_text, link_text)
+        VALUES ({_EVENT_VALUES.format(prefix='new')});
+    END""",
+    # External content: reads title/content from the lesson table, which
+    # makes snippet() available for highlighting
+    """CREATE VIRTUAL TABLE IF NOT EXISTS lesson_search USING fts5(
+        title, content,
+        content='lesson', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS lesson_search_insert AFTER INSERT ON lesson BEGIN
+        INSERT INTO lesson_search(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lesson_search_delete AFTER DELETE ON lesson BEGIN
+        INSERT INTO lesson_search(lesson_search, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lesson_search_update AFTER UPDATE OF title, content ON lesson BEGIN
+        INSERT INTO lesson_search(lesson_search, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO lesson_search(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+# Indexes events added while the triggers were dropped (see bulk_insert.py)
+INDEX_EVENTS_AFTER = (
+    f"INSERT INTO event_search(rowid, element_id, page_url, button_text, link_text) "
+    f"SELECT {_EVENT_VALUES.format(prefix='clickstream_event')} FROM clickstream_event "
+    f"WHERE clickstream_event.id > :last_id"
+)
+
+# Bulk loads drop the event triggers (see bulk_insert.py) and record here
+# the last event id indexed before they did. A load killed before putting
+# the triggers back leaves its row behind, and the events after it are
+# indexed when create_search_index next creates the triggers
+PENDING_SCHEMA = "CREATE TABLE IF NOT EXISTS event_search_pending (last_id INTEGER NOT NULL)"
+
+# Markers used by snippet(); they cannot occur in normal text, so the
+# snippet can be HTML-escaped first and the markers swapped for <mark> after
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+
+def create_search_index(connection, rebuild=False):
+    """Create the FTS tables and triggers, indexing existing rows on first run.
+
+    Returns True if the index was (re)built from the source tables.
+    """
+    existing = connection.execute(text(
+        "SELECT name FROM sqlite_master WHERE name IN ('event_search', 'lesson_search')"
+    )).scalars().all()
+
+    if rebuild:
+        connection.execute(text("DROP TABLE IF EXISTS event_search"))
+        connection.execute(text("DROP TABLE IF EXISTS lesson_search"))
+        existing = []
+
+    # CREATE TRIGGER IF NOT EXISTS keeps an outdated trigger, so triggers
+    # whose definition changed since the database was created are replaced
+    triggers = dict(connection.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"
+    )).all())
+
+    # Events a killed bulk load added without the triggers
+    connection.execute(text(PENDING_SCHEMA))
+    pending = connection.execute(text("SELECT MIN(last_id) FROM event_search_pending")).scalar()
+    if pending is not None:
+        if 'event_search' in existing and 'clickstream_event_search_insert' not in triggers:
+            connection.execute(text(INDEX_EVENTS_AFTER), {'last_id': pending})
+        connection.execute(text("DELETE FROM event_search_pending"))
+    for statement in SEARCH_SCHEMA:
+        match = re.match(r'\s*CREATE TRIGGER IF NOT EXISTS (\w+)', statement)
+        if match and match.group(1) in triggers \
+                and triggers[match.group(1)] != statement.replace(' IF NOT EXISTS', '', 1):
+            connection.execute(text(f'DROP TRIGGER "{match.group(1)}"'))
+        connection.execute(text(statement))
+
+    if 'event_search' not in existing:
+        connection.execute(text(INDEX_EVENTS_AFTER), {'last_id': 0})
+    if 'lesson_search' not in existing:
+        connection.execute(text("INSERT INTO lesson_search(lesson_search) VALUES ('rebuild')"))
+    return len(existing) < 2
+
+
+def build_fts_query(query):
+    """Turn free text typed by an admin into a safe FTS5 MATCH expression.
+
+    Each whitespace-separated term becomes a quoted phrase (so punctuation
+    like '/lesson/3' or 'question_5' cannot break the query syntax), all
+    terms must match, and the last term also matches as a prefix.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    terms = [term for term in terms if re.search(r'\w', term)]
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += '*'
+    return ' '.join(phrases)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Analytics Snapshot
+A read-only copy of the database for the admin reports and view_data.py,
+so their long scans never hold locks on the file /api/track_event
+writes to.
+
+refresh() copies the live database with SQLite's online backup API into
+a temporary file and renames it over the snapshot. The copy runs
+STEP_PAGES pages at a time and lets go of its read lock between steps,
+so an upload waits at most one step to commit. SQLite restarts a backup
+whose source is written to between steps; after MAX_RESTARTS restarts
+the rest is copied in a single step instead, which holds the read lock
+for the whole copy (well under a second for a few hundred MB) but is
+sure to finish. Connections already reading the old snapshot keep
+reading it until they close; new connections open the new file.
+
+The finished copy holds exactly the data committed when the last step
+ran, and that time is stored in the snapshot's snapshot_info table as
+the "data as of" the admin pages show. Only the standard library is
+used, so view_data.py can read snapshots without the app.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from urllib.parse import quote
+
+STEP_PAGES = 4096  # 16 MiB with the default 4 KiB pages
+STEP_SLEEP = 0.005  # Seconds between steps, for writers to get in
+MAX_RESTARTS = 3
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+_taken_at = {}
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def refresh(source_path, snapshot_path):
+    """Copy the database at source_path to snapshot_path; returns the time the data is as of"""
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    temporary = snapshot_path + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(temporary)
+    try:
+        remaining_before = [None]
+        restarts = [0]
+
+        def progress(status, remaining, total):
+            # A restarted backup copies the first step again, so no progress means a restart
+            if remaining_before[0] is not None and remaining >= remaining_before[0]:
+                restarts[0] += 1
+                if restarts[0] > MAX_RESTARTS:
+                    raise _TooManyRestarts()
+            remaining_before[0] = remaining
+
+        try:
+            source.backup(target, pages=STEP_PAGES, progress=progress, sleep=STEP_SLEEP)
+        except _TooManyRestarts:
+            source.backup(target, pages=-1)
+        taken_at = datetime.utcnow()
+
+        target.execute('CREATE TABLE snapshot_info (taken_at TEXT NOT NULL, source TEXT)')
+        target.execute('INSERT INTO snapshot_info VALUES (?, ?)',
+                       (taken_at.strftime(TIMESTAMP_FORMAT), os.path.abspath(source_path)))
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+    os.replace(temporary, snapshot_path)
+    return taken_at
+
+
+def taken_at(snapshot_path):
+    """When the data in a snapshot was copied, or None if there is no snapshot"""
+    try:
+        stat = os.stat(snapshot_path)
+    except OSError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns)
+    cached = _taken_at.get(snapshot_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    connection = connect(snapshot_path)
+    try:
+        row = connection.execute('SELECT taken_at FROM snapshot_info').fetchone()
+    except sqlite3.DatabaseError:
+        row = None  # Not a snapshot written by refresh()
+    finally:
+        connection.close()
+    value = datetime.strptime(row[0], TIMESTAMP_FORMAT) if row else None
+    _taken_at[snapshot_path] = (key, value)
+    return value
+
+
+def connect(snapshot_path):
+    """A read-only sqlite3 connection to a snapshot"""
+    return sqlite3.connect(uri(snapshot_path), uri=True)
+
+
+def uri(snapshot_path):
+    """SQLite URI that opens a snapshot read-only"""
+    return f'file:{quote(os.path.abspath(snapshot_path))}?mode=ro'
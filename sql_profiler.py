@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+SQL Statement Profiler
+Opt-in profiling of the SQL each request runs, for finding out why pages
+such as the admin dashboard or user activity view are slow.
+
+While a request runs, SQLAlchemy cursor events time every statement and
+group them by statement text, so repeated queries (N+1 patterns) show up
+as one line with a count. Responses to admins then carry the totals in
+X-SQL-Queries / X-SQL-Time-ms and a Server-Timing header, and their HTML
+pages get a panel listing the slowest statements; other clients get
+neither, as the timings would tell them about the queries. Statements
+slower than SQL_SLOW_QUERY_MS are written, with their EXPLAIN QUERY PLAN,
+to a rotating slow-query log.
+
+Enable with SQL_PROFILER = True (or SQL_PROFILER=1 in the environment).
+When it is off no listeners or hooks are registered at all, so ordinary
+requests pay nothing for it.
+"""
+
+import logging
+import logging.handlers
+import os
+import time
+
+from flask import g, has_request_context, render_template, request
+from sqlalchemy import event
+
+MAX_PARAMETERS_LOGGED = 500  # Characters of bound parameters written per slow statement
+
+
+class RequestProfile:
+    """Statements run by one request, grouped by statement text"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.total = 0.0
+        self.statements = {}  # statement -> [count, total seconds, slowest seconds, plan]
+
+    def record(self, statement, elapsed, plan=None):
+        self.count += 1
+        self.total += elapsed
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed, elapsed, plan]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+            if plan:
+                entry[3] = plan
+
+    def slowest(self, limit=10):
+        """The statements that took the most time in total, slowest first"""
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [{
+            'statement': statement,
+            'count': count,
+            'total_ms': round(total * 1000, 2),
+            'max_ms': round(slowest * 1000, 2),
+            'plan': plan
+        } for statement, (count, total, slowest, plan) in ranked[:limit]]
+
+
+def explain(cursor, statement, parameters, dialect='sqlite'):
+    """Query plan of a SELECT, one line per plan step"""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    try:
+        # A separate cursor on the same DBAPI connection, so SQLAlchemy's
+        # events (and this profiler) do not see the EXPLAIN itself
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            return [row[-1] for row in explain_cursor.fetchall()]
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+
+
+def create_slow_log(path, max_bytes, backups):
+    logger = logging.getLogger('sql_profiler.slow_queries')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not any(getattr(handler, 'baseFilename', None) == os.path.abspath(path) for handler in logger.handlers):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def init_app(app, engine, is_admin):
+    """Profile the statements `engine` runs during this app's requests.
+
+    `is_admin` is called after each request to decide whether the HTML
+    panel (which shows SQL text) may be added to the page.
+    """
+    slow_seconds = app.config['SQL_SLOW_QUERY_MS'] / 1000
+    slow_log = create_slow_log(app.config['SQL_SLOW_QUERY_LOG'], app.config['SQL_SLOW_QUERY_LOG_BYTES'],
+                               app.config['SQL_SLOW_QUERY_LOG_BACKUPS'])
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'sql_profile' in g:
+            conn.info.setdefault('sql_profiler_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('sql_profiler_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        profile = g.get('sql_profile')
+        if profile is None:
+            return
+        plan = None
+        if elapsed >= slow_seconds:
+            if not executemany:
+                plan = explain(cursor, statement, parameters, conn.dialect.name)
+            slow_log.info('%.1f ms %s %s\n%s\nparameters: %s%s', elapsed * 1000, request.method, request.path,
+                          statement, repr(parameters)[:MAX_PARAMETERS_LOGGED],
+                          ''.join(f'\n  {step}' for step in plan or ()))
+        profile.record(statement, elapsed, plan)
+
+    @event.listens_for(engine, 'handle_error')
+    def discard_timer(context):
+        # after_cursor_execute is not called for a failed statement
+        started = context.connection.info.get('sql_profiler_started') if context.connection else None
+        if started:
+            started.pop()
+
+    @app.before_request
+    def start_profile():
+        g.sql_profile = RequestProfile()
+
+    @app.after_request
+    def report_profile(response):
+        profile = g.pop('sql_profile', None)
+        if profile is None or not is_admin():
+            return response
+        sql_ms = profile.total * 1000
+        response.headers['X-SQL-Queries'] = str(profile.count)
+        response.headers['X-SQL-Time-ms'] = f'{sql_ms:.1f}'
+        response.headers.add('Server-Timing', f'sql;dur={sql_ms:.1f};desc="{profile.count} queries"')
+
+        if response.mimetype == 'text/html' and not response.direct_passthrough and not response.is_streamed:
+            body = response.get_data(as_text=True)
+            position = body.rfind('</body>')
+            if position != -1:
+                panel = render_template('sql_profile_panel.html', profile=profile,
+                                        request_ms=(time.perf_counter() - profile.started) * 1000,
+                                        statements=profile.slowest(), slow_ms=slow_seconds * 1000)
+                response.set_data(body[:position] + panel + body[position:])
+        return response
@@ -11,68 +11,199 @@ function generateSessionId() {
     return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
 }
 
-// Main tracking function
+// Generate a UUID for each event, so the server can drop retried duplicates
+function generateEventId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+        const r = Math.random() * 16 | 0;
+        return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+    });
+}
+
+// Tracking configuration - defaults, replaced by the server's /api/tracking_config
+const trackingConfig = {
+    flush_interval_ms: 10000,
+    max_batch_size: 50,
+    compress: true,
+    heartbeat_interval_ms: 60000,
+    mouse_path_interval_ms: 30000,
+    mouse_sample_ms: 500,
+    mouse_min_distance_px: 50,
+    burst_gap_ms: 2000,
+    sample_rates: {}
+};
+
+// Events waiting to be uploaded in the next batch
+let eventQueue = [];
+let flushTimer = null;
+
+// Load the tracking configuration, cached per tab for five minutes
+function loadTrackingConfig() {
+    const cached = JSON.parse(sessionStorage.getItem('tracking_config') || 'null');
+    if (cached && Date.now() - cached.loaded_at < 300000) {
+        Object.assign(trackingConfig, cached.config);
+        return Promise.resolve(trackingConfig);
+    }
+
+    return fetch('/api/tracking_config')
+        .then(response => response.json())
+        .then(config => {
+            Object.assign(trackingConfig, config);
+            sessionStorage.setItem('tracking_config', JSON.stringify({
+                config: config,
+                loaded_at: Date.now()
+            }));
+            return trackingConfig;
+        })
+        .catch(error => {
+            console.error('Error loading tracking config:', error);
+            return trackingConfig;
+        });
+}
+
+// Get the fraction of events of this type that should be kept
+function getSampleRate(eventType) {
+    const rate = trackingConfig.sample_rates[eventType];
+    return typeof rate === 'number' ? rate : 1;
+}
+
+// Main tracking function - events are sampled, queued and uploaded in batches
 function trackEvent(eventType, elementId, elementType, additionalData = {}) {
-    const eventData = {
+    const sampleRate = getSampleRate(eventType);
+    if (sampleRate < 1) {
+        if (Math.random() >= sampleRate) return;
+        // Lets the server weight sampled events back up to full counts
+        additionalData = { ...additionalData, sample_rate: sampleRate };
+    }
+
+    eventQueue.push({
+        event_id: generateEventId(),
         event_type: eventType,
         element_id: elementId,
         element_type: elementType,
         page_url: window.location.href,
-        additional_data: additionalData
-    };
+        additional_data: additionalData,
+        client_ts: Date.now()
+    });
+
+    if (eventQueue.length >= trackingConfig.max_batch_size) {
+        flushEvents();
+    } else if (!flushTimer) {
+        flushTimer = setTimeout(flushEvents, trackingConfig.flush_interval_ms);
+    }
+}
+
+// Upload all queued events in a single request
+function flushEvents(isUnloading = false) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    if (eventQueue.length === 0) return;
+
+    const batch = eventQueue;
+    eventQueue = [];
+    const body = JSON.stringify({ events: batch, sent_at: Date.now() });
+
+    sendBatch(body, isUnloading)
+        .then(data => {
+            console.log('Events tracked:', data.received);
+        })
+        .catch(error => {
+            console.error('Error tracking events:', error);
+            // Store failed events in localStorage for retry
+            storeFailedEvents(batch);
+        });
+}
+
+// POST a batch, gzip-compressed when the browser supports CompressionStream
+function sendBatch(body, isUnloading) {
+    const headers = { 'Content-Type': 'application/json' };
 
-    // Send to backend API
-    fetch('/api/track_event', {
+    // Compression is asynchronous, so a page being unloaded sends plain JSON
+    if (isUnloading || !trackingConfig.compress || typeof CompressionStream === 'undefined') {
+        return postEvents(body, headers, isUnloading);
+    }
+
+    const stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+    return new Response(stream).arrayBuffer().then(compressed => {
+        headers['Content-Encoding'] = 'gzip';
+        return postEvents(compressed, headers, false);
+    });
+}
+
+// Set when the server answers 429; uploads wait until then (events are kept for retry)
+let uploadsPausedUntil = 0;
+
+function postEvents(body, headers, keepalive) {
+    if (Date.now() < uploadsPausedUntil) {
+        return Promise.reject(new Error('Rate limited, retrying later'));
+    }
+
+    return fetch('/api/track_event', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(eventData)
+        headers: headers,
+        body: body,
+        keepalive: keepalive
     })
-    .then(response => response.json())
-    .then(data => {
-        console.log('Event tracked:', eventData);
-    })
-    .catch(error => {
-        console.error('Error tracking event:', error);
-        // Store failed events in localStorage for retry
-        storeFailedEvent(eventData);
+    .then(response => {
+        if (response.status === 429) {
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 60;
+            uploadsPausedUntil = Date.now() + retryAfter * 1000;
+        }
+        if (!response.ok) throw new Error('HTTP ' + response.status);
+        return response.json();
     });
 }
 
-// Store failed events for retry
-function storeFailedEvent(eventData) {
+// Failed events kept for retry; the oldest are dropped beyond this many
+const MAX_STORED_EVENTS = 1000;
+let retryInProgress = false;
+
+function loadFailedEvents() {
     const failedEvents = JSON.parse(localStorage.getItem('failed_events') || '[]');
-    failedEvents.push({
-        ...eventData,
-        timestamp: Date.now()
+    // Events stored by older versions of this script have no id yet
+    failedEvents.forEach(event => {
+        if (!event.event_id) event.event_id = generateEventId();
     });
-    localStorage.setItem('failed_events', JSON.stringify(failedEvents));
+    return failedEvents;
 }
 
-// Retry failed events
+// Store failed events for retry
+function storeFailedEvents(events) {
+    const failedEvents = loadFailedEvents();
+    const storedIds = new Set(failedEvents.map(event => event.event_id));
+    events.forEach(event => {
+        if (!storedIds.has(event.event_id)) failedEvents.push(event);
+    });
+    localStorage.setItem('failed_events', JSON.stringify(failedEvents.slice(-MAX_STORED_EVENTS)));
+}
+
+// Retry failed events one batch at a time. A batch is only removed from
+// storage once the server has accepted it, and the server ignores event
+// ids it already has, so a retry that partly succeeded is safe to repeat
 function retryFailedEvents() {
-    const failedEvents = JSON.parse(localStorage.getItem('failed_events') || '[]');
+    if (retryInProgress) return;
+    const failedEvents = loadFailedEvents();
     if (failedEvents.length === 0) return;
 
-    failedEvents.forEach((event, index) => {
-        fetch('/api/track_event', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(event)
-        })
-        .then(response => response.json())
-        .then(data => {
-            // Remove successful event from failed events
-            failedEvents.splice(index, 1);
-            localStorage.setItem('failed_events', JSON.stringify(failedEvents));
+    retryInProgress = true;
+    const batch = failedEvents.slice(0, trackingConfig.max_batch_size);
+    const body = JSON.stringify({ events: batch, sent_at: Date.now() });
+
+    sendBatch(body, false)
+        .then(() => {
+            // Re-read storage, since new failures may have been added meanwhile
+            const sentIds = new Set(batch.map(event => event.event_id));
+            const remaining = loadFailedEvents().filter(event => !sentIds.has(event.event_id));
+            localStorage.setItem('failed_events', JSON.stringify(remaining));
+            retryInProgress = false;
+            if (remaining.length > 0) retryFailedEvents();
         })
         .catch(error => {
-            console.error('Failed to retry event:', error);
+            console.error('Failed to retry events:', error);
+            retryInProgress = false;
         });
-    });
 }
 
 // Track page views
@@ -200,112 +331,167 @@ function getQuestionText(element) {
     return 'Not a quiz question';
 }
 
-// Track form interactions
+// Track form interactions - keystrokes are summarized into one event per burst
 function trackFormInteractions() {
+    const bursts = new Map();
+
+    function closeBurst(target) {
+        const burst = bursts.get(target);
+        if (!burst) return;
+        bursts.delete(target);
+        clearTimeout(burst.timer);
+
+        trackEvent('form_interaction', target.name || target.id || 'unknown_field', 'form_field', {
+            field_name: target.name,
+            field_type: target.type,
+            action: 'input_burst',
+            keystrokes: burst.keystrokes,
+            duration_ms: burst.lastAt - burst.startedAt
+        });
+    }
+
     document.addEventListener('input', function(event) {
         const target = event.target;
-        
-        if (target.tagName === 'INPUT' || target.tagName === 'TEXTAREA' || target.tagName === 'SELECT') {
-            // Track focus events
-            if (event.type === 'focus') {
-                trackEvent('form_interaction', target.name || target.id || 'unknown_field', 'form_field', {
-                    field_name: target.name,
-                    field_type: target.type,
-                    action: 'focus'
-                });
-            }
-            
-            // Track change events for select elements
-            if (event.type === 'change' && target.tagName === 'SELECT') {
-                trackEvent('form_interaction', target.name || target.id || 'unknown_field', 'form_field', {
-                    field_name: target.name,
-                    field_type: target.type,
-                    action: 'change',
-                    selected_value: target.value
-                });
+
+        if (target.tagName === 'INPUT' || target.tagName === 'TEXTAREA') {
+            const now = Date.now();
+            let burst = bursts.get(target);
+            if (!burst) {
+                burst = { keystrokes: 0, startedAt: now };
+                bursts.set(target, burst);
             }
+            burst.keystrokes++;
+            burst.lastAt = now;
+
+            clearTimeout(burst.timer);
+            burst.timer = setTimeout(() => closeBurst(target), trackingConfig.burst_gap_ms);
+        }
+    });
+
+    // Close any open burst when the field loses focus
+    document.addEventListener('focusout', function(event) {
+        closeBurst(event.target);
+    });
+
+    // Track change events for select elements
+    document.addEventListener('change', function(event) {
+        const target = event.target;
+
+        if (target.tagName === 'SELECT') {
+            trackEvent('form_interaction', target.name || target.id || 'unknown_field', 'form_field', {
+                field_name: target.name,
+                field_type: target.type,
+                action: 'change',
+                selected_value: target.value
+            });
         }
     });
+
+    window.addEventListener('pagehide', function() {
+        Array.from(bursts.keys()).forEach(closeBurst);
+    });
 }
 
 // Scroll tracking removed - not counting scroll events
 
 // Track time spent on page
 function trackTimeOnPage() {
-    let startTime = Date.now();
-    let timeTrackingInterval;
-    
-    // Track every 60 seconds (less frequent)
-    timeTrackingInterval = setInterval(function() {
+    const startTime = Date.now();
+
+    // Heartbeat at the configured interval instead of polling every second
+    const timeTrackingInterval = setInterval(function() {
         const timeSpent = Math.round((Date.now() - startTime) / 1000);
-        
-        if (timeSpent % 60 === 0 && timeSpent > 0) {
-            trackEvent('time_on_page', `time_${timeSpent}s`, 'time', {
-                time_spent_seconds: timeSpent,
-                page_url: window.location.href
-            });
-        }
-    }, 1000);
-    
+        trackEvent('time_on_page', `time_${timeSpent}s`, 'time', {
+            time_spent_seconds: timeSpent,
+            page_url: window.location.href
+        });
+    }, trackingConfig.heartbeat_interval_ms);
+
     // Track when leaving page
-    window.addEventListener('beforeunload', function() {
+    window.addEventListener('pagehide', function() {
         const totalTimeSpent = Math.round((Date.now() - startTime) / 1000);
         trackEvent('page_exit', 'page_exit', 'page', {
             time_spent_seconds: totalTimeSpent,
             page_url: window.location.href
         });
-        
+
         // Clear interval
         clearInterval(timeTrackingInterval);
     });
 }
 
-// Track mouse movements (throttled) - only for significant movements
+// Track mouse movements - points are folded into one polyline event per window
 function trackMouseMovements() {
-    let lastMoveTime = 0;
-    let lastPosition = { x: 0, y: 0 };
-    const throttleDelay = 5000; // Track every 5 seconds, only if moved significantly
-    
-    document.addEventListener('mousemove', function(event) {
-        const currentTime = Date.now();
-        const deltaX = Math.abs(event.clientX - lastPosition.x);
-        const deltaY = Math.abs(event.clientY - lastPosition.y);
-        
-        // Only track if moved more than 100px and enough time has passed
-        if (currentTime - lastMoveTime > throttleDelay && (deltaX > 100 || deltaY > 100)) {
-            trackEvent('mouse_movement', 'mouse_move', 'mouse', {
-                mouse_x: event.clientX,
-                mouse_y: event.clientY,
-                delta_x: deltaX,
-                delta_y: deltaY,
+    let path = [];
+    let windowStart = Date.now();
+    let lastPoint = null;
+
+    function emitPath() {
+        if (path.length > 0) {
+            trackEvent('mouse_movement', 'mouse_path', 'mouse', {
+                // Each point is [x, y, ms since window start]
+                points: path,
+                point_count: path.length,
+                window_start: windowStart,
                 page_url: window.location.href
             });
-            
-            lastMoveTime = currentTime;
-            lastPosition = { x: event.clientX, y: event.clientY };
         }
+        path = [];
+        windowStart = Date.now();
+    }
+
+    document.addEventListener('mousemove', function(event) {
+        const currentTime = Date.now();
+        if (lastPoint && currentTime - lastPoint.time < trackingConfig.mouse_sample_ms) return;
+
+        const deltaX = lastPoint ? Math.abs(event.clientX - lastPoint.x) : Infinity;
+        const deltaY = lastPoint ? Math.abs(event.clientY - lastPoint.y) : Infinity;
+        if (Math.max(deltaX, deltaY) < trackingConfig.mouse_min_distance_px) return;
+
+        path.push([event.clientX, event.clientY, currentTime - windowStart]);
+        lastPoint = { x: event.clientX, y: event.clientY, time: currentTime };
     });
+
+    setInterval(emitPath, trackingConfig.mouse_path_interval_ms);
+    window.addEventListener('pagehide', emitPath);
 }
 
-// Track keyboard interactions
+// Track keyboard interactions - shortcut bursts are summarized in one event
 function trackKeyboardInteractions() {
+    let combos = {};
+    let burstStart = null;
+    let burstTimer = null;
+
+    function emitBurst() {
+        if (burstStart === null) return;
+        trackEvent('keyboard', Object.keys(combos).join(' '), 'keyboard', {
+            combos: combos,
+            key_count: Object.values(combos).reduce((total, count) => total + count, 0),
+            duration_ms: Date.now() - burstStart
+        });
+        combos = {};
+        burstStart = null;
+    }
+
     document.addEventListener('keydown', function(event) {
         // Track specific key combinations
         if (event.ctrlKey || event.metaKey) {
             let keyCombo = '';
             if (event.ctrlKey) keyCombo += 'Ctrl+';
             if (event.metaKey) keyCombo += 'Cmd+';
+            if (event.altKey) keyCombo += 'Alt+';
+            if (event.shiftKey) keyCombo += 'Shift+';
             keyCombo += event.key.toUpperCase();
-            
-            trackEvent('keyboard', keyCombo, 'keyboard', {
-                key: event.key,
-                ctrl_key: event.ctrlKey,
-                meta_key: event.metaKey,
-                shift_key: event.shiftKey,
-                alt_key: event.altKey
-            });
+
+            if (burstStart === null) burstStart = Date.now();
+            combos[keyCombo] = (combos[keyCombo] || 0) + 1;
+
+            clearTimeout(burstTimer);
+            burstTimer = setTimeout(emitBurst, trackingConfig.burst_gap_ms);
         }
     });
+
+    window.addEventListener('pagehide', emitBurst);
 }
 
 // Track window resize events
@@ -347,6 +533,8 @@ function trackVisibilityChanges() {
                 action: 'hidden',
                 page_url: window.location.href
             });
+            // The tab may never become visible again, so upload now
+            flushEvents(true);
         } else {
             trackEvent('visibility_change', 'page_visible', 'visibility', {
                 action: 'visible',
@@ -361,19 +549,28 @@ function initializeTracking() {
     // Track initial page view
     trackPageView();
     
-    // Initialize all tracking modules
-    trackClicks();
-    trackFormInteractions();
-    trackTimeOnPage();
-    trackMouseMovements();
-    trackKeyboardInteractions();
-    trackWindowResize();
-    trackVisibilityChanges();
-    
-    // Retry any failed events
-    retryFailedEvents();
-    
-    console.log('Clickstream tracking initialized');
+    // Modules read intervals and thresholds from the config when they start
+    loadTrackingConfig().then(function() {
+        // Initialize all tracking modules
+        trackClicks();
+        trackFormInteractions();
+        trackTimeOnPage();
+        trackMouseMovements();
+        trackKeyboardInteractions();
+        trackWindowResize();
+        trackVisibilityChanges();
+
+        // Upload whatever is still queued when the page goes away. Registered
+        // after the modules' own pagehide handlers so their final events are sent
+        window.addEventListener('pagehide', function() {
+            flushEvents(true);
+        });
+        
+        // Retry any failed events
+        retryFailedEvents();
+        
+        console.log('Clickstream tracking initialized');
+    });
 }
 
 // Initialize tracking when DOM is loaded
@@ -387,5 +584,6 @@ if (document.readyState === 'loading') {
 window.clickstreamTracking = {
     trackEvent: trackEvent,
     trackPageView: trackPageView,
+    flushEvents: flushEvents,
     retryFailedEvents: retryFailedEvents
 };
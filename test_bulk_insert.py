@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for deferring the event indexes and search triggers during bulk loads
+"""
+
+import os
+import subprocess
+import sys
+
+import sqlalchemy
+
+import bulk_insert
+import search_index
+from models import db
+
+INSERT = ("INSERT INTO clickstream_event (session_id, event_type, element_id, timestamp) "
+          "VALUES ('s', 'click', ?, '2024-01-15 09:30:00.000000')")
+
+# A loader that dies inside deferred_indexes, as if SIGKILLed
+KILLED_LOAD = f"""
+import os, sys, bulk_insert
+connection = bulk_insert.connect(sys.argv[1])
+with bulk_insert.deferred_indexes(connection):
+    connection.executemany({INSERT!r}, [('loaded%d' % i,) for i in range(10)])
+    os._exit(9)
+"""
+
+
+def make_database(path):
+    engine = sqlalchemy.create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        search_index.create_search_index(connection)
+    return engine
+
+
+def matches(connection, term):
+    return connection.execute("SELECT COUNT(*) FROM event_search WHERE event_search MATCH ?", (term,)).fetchone()[0]
+
+
+def objects(connection):
+    return sorted(row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE tbl_name = 'clickstream_event' AND sql IS NOT NULL "
+        "AND type IN ('index', 'trigger')"))
+
+
+def test_load_restores_triggers_and_indexes_events(tmp_path):
+    make_database(tmp_path / 'events.db').dispose()
+    connection = bulk_insert.connect(str(tmp_path / 'events.db'))
+    before = objects(connection)
+    with bulk_insert.deferred_indexes(connection):
+        assert objects(connection) == []
+        connection.executemany(INSERT, [(f'loaded{i}',) for i in range(10)])
+    assert objects(connection) == before
+    assert matches(connection, 'loaded7') == 1
+    assert connection.execute('SELECT COUNT(*) FROM event_search_pending').fetchone()[0] == 0
+    connection.close()
+
+
+def test_killed_load_is_indexed_on_next_start(tmp_path):
+    engine = make_database(tmp_path / 'events.db')
+    connection = bulk_insert.connect(str(tmp_path / 'events.db'))
+    connection.execute(INSERT, ('before',))
+    connection.close()
+    killed = subprocess.run([sys.executable, '-c', KILLED_LOAD, str(tmp_path / 'events.db')],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert killed.returncode == 9
+
+    with engine.begin() as restart:
+        search_index.create_search_index(restart)
+    connection = bulk_insert.connect(str(tmp_path / 'events.db'))
+    assert matches(connection, 'loaded3') == 1
+    assert matches(connection, 'before') == 1  # Not indexed twice
+    assert connection.execute('SELECT COUNT(*) FROM event_search_pending').fetchone()[0] == 0
+    connection.execute(INSERT, ('after',))  # The trigger is back
+    assert matches(connection, 'after') == 1
+    connection.close()
+    engine.dispose()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests for the change feed cursor window in change_feed.py
+"""
+
+import pytest
+import sqlalchemy
+from sqlalchemy import delete, insert
+
+import change_feed
+from models import ClickstreamEvent, db
+
+_events = ClickstreamEvent.__table__
+
+
+@pytest.fixture
+def connection():
+    engine = sqlalchemy.create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    with engine.connect() as connection:
+        connection.execute(insert(_events), [
+            {'id': event_id, 'session_id': 's', 'event_type': 'click'} for event_id in range(1, 11)
+        ])
+        yield connection
+    engine.dispose()
+
+
+def test_window_within_the_table(connection):
+    assert change_feed.window_end(connection, 0, 4) == (4, True)
+    assert change_feed.window_end(connection, 4, 4) == (8, True)
+
+
+def test_window_reaching_the_end(connection):
+    assert change_feed.window_end(connection, 8, 4) == (10, False)
+    assert change_feed.window_end(connection, 6, 4) == (10, False)
+
+
+def test_window_past_the_end_keeps_the_cursor(connection):
+    assert change_feed.window_end(connection, 10, 4) == (10, False)
+    assert change_feed.window_end(connection, 50, 4) == (50, False)
+
+
+def test_window_skips_gaps_in_ids(connection):
+    connection.execute(delete(_events).where(_events.c.id.in_([3, 4, 5])))
+    assert change_feed.window_end(connection, 0, 4) == (7, True)
+
+
+def test_latest_id(connection):
+    assert change_feed.latest_id(connection) == 10
+    connection.execute(delete(_events))
+    assert change_feed.latest_id(connection) == 0
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for User-Agent parsing and IP range lookups in enrichment.py
+"""
+
+import ipaddress
+
+import pytest
+
+import enrichment
+from enrichment import IPRanges
+
+
+def ip(text):
+    return int(ipaddress.ip_address(text))
+
+
+@pytest.fixture
+def ranges():
+    return IPRanges([
+        (ip('1.0.0.0'), ip('1.0.0.255'), 'AU', 'Queensland'),
+        (ip('8.8.8.0'), ip('8.8.8.255'), 'US', None),
+        (ip('10.0.0.0'), ip('10.0.0.0'), 'IN', 'Maharashtra'),
+        (ip('2001:db8::'), ip('2001:db8::ffff'), 'DE', 'Berlin'),
+    ])
+
+
+@pytest.mark.parametrize('address, location', [
+    ('1.0.0.0', ('AU', 'Queensland')),        # First address of a range
+    ('1.0.0.255', ('AU', 'Queensland')),      # Last address of a range
+    ('8.8.8.8', ('US', None)),
+    ('10.0.0.0', ('IN', 'Maharashtra')),      # Single-address range
+    ('2001:db8::1', ('DE', 'Berlin')),
+    ('::ffff:8.8.8.8', ('US', None)),          # IPv4-mapped IPv6
+])
+def test_lookup_inside_ranges(ranges, address, location):
+    assert ranges.lookup(address) == location
+
+
+@pytest.mark.parametrize('address', ['0.255.255.255', '1.0.1.0', '9.9.9.9', '10.0.0.1', '2001:db9::', 'not an ip', ''])
+def test_lookup_outside_ranges(ranges, address):
+    assert ranges.lookup(address) == (None, None)
+
+
+def test_ranges_are_sorted_on_load():
+    ranges = IPRanges([(ip('9.0.0.0'), ip('9.0.0.9'), 'FR', None), (ip('2.0.0.0'), ip('2.0.0.9'), 'GB', None)])
+    assert ranges.lookup('2.0.0.5') == ('GB', None)
+    assert ranges.lookup('9.0.0.5') == ('FR', None)
+    assert len(ranges) == 2
+
+
+def test_load_csv(tmp_path):
+    path = tmp_path / 'ranges.csv'
+    path.write_text('first,last,country\n# comment\n1.0.0.0,1.0.0.255,au,Queensland\n134744064,134744319,US\n')
+    ranges = IPRanges.load(str(path))
+    assert ranges.lookup('1.0.0.7') == ('AU', 'Queensland')
+    assert ranges.lookup('8.8.8.8') == ('US', None)
+    assert len(ranges) == 2
+
+
+@pytest.mark.parametrize('user_agent, parsed', [
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/120.0.0.0 Safari/537.36', ('desktop', 'Chrome', 'Windows')),
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0', ('desktop', 'Edge', 'Windows')),
+    ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+     'Version/17.0 Mobile/15E148 Safari/604.1', ('mobile', 'Safari', 'iOS')),
+    ('Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/120.0.0.0 Safari/537.36', ('tablet', 'Chrome', 'Android')),
+    ('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)', ('bot', 'Other', 'Other')),
+    ('', (None, None, None)),
+])
+def test_parse_user_agent(user_agent, parsed):
+    assert enrichment.parse_user_agent(user_agent) == parsed
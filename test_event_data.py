@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for splitting additional_data into columns and a compressed remainder (event_data.py)
+"""
+
+import json
+
+import pytest
+
+import event_data
+
+
+def round_trip(data, columns=None):
+    row = event_data.pack(data, columns)
+    return row, event_data.load({**row, **(columns or {})})
+
+
+def test_promoted_keys_become_columns():
+    row, loaded = round_trip({'button_text': 'Next', 'score': 80, 'page_title': 'Lesson 1'})
+    assert row['button_text'] == 'Next' and row['score'] == 80 and row['page_title'] == 'Lesson 1'
+    assert row['extra_data'] is None
+    assert loaded == {'button_text': 'Next', 'score': 80, 'page_title': 'Lesson 1'}
+
+
+def test_values_that_do_not_fit_a_column_stay_in_the_remainder():
+    data = {'button_text': 'x' * 201, 'score': 'high'}
+    row, loaded = round_trip(data)
+    assert row['button_text'] is None and row['score'] is None
+    assert loaded == data
+
+
+def test_click_location_split_and_rejoined():
+    data = {'click_location': {'x': 10, 'y': 20, 'page_x': 15}}
+    row, loaded = round_trip(data)
+    assert (row['click_x'], row['click_y']) == (10, 20)
+    assert loaded == data
+
+
+def test_values_copied_to_event_columns_are_not_stored_twice():
+    columns = {'video_id': 'intro', 'video_time': 12.5}
+    row, loaded = round_trip({'video_id': 'intro', 'video_time': 12.5, 'other': 1}, columns)
+    assert event_data.decode(row['extra_data']) == {'other': 1}
+    assert loaded == {'video_id': 'intro', 'video_time': 12.5, 'other': 1}
+
+
+def test_empty_data():
+    row, loaded = round_trip(None)
+    assert all(value is None for value in row.values())
+    assert loaded == {}
+
+
+@pytest.mark.parametrize('data', [
+    {'a': 1},
+    {'window_width': 1280, 'window_height': 800, 'screen_width': 1920, 'screen_height': 1080},
+    {'text': 'ünïcödé', 'nested': {'list': [1, 2, 3]}},
+])
+def test_encode_round_trips(data):
+    assert event_data.decode(event_data.encode(data)) == data
+
+
+def test_encode_compresses_common_keys():
+    data = {'window_width': 1280, 'window_height': 800, 'screen_width': 1920, 'screen_height': 1080}
+    payload = event_data.encode(data)
+    assert payload[0] == event_data.DEFLATE_V1
+    assert len(payload) < len(json.dumps(data, separators=(',', ':')))
+
+
+def test_load_reads_legacy_json_column():
+    assert event_data.load({'additional_data': '{"a": 1}'}) == {'a': 1}
+    assert event_data.load({'additional_data': 'not json'}) == {'value': 'not json'}
+    assert event_data.load({'additional_data': '[1, 2]'}) == {'value': [1, 2]}
+
+
+def test_decode_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        event_data.decode(b'\x07{}')
+
+
+
+@pytest.mark.parametrize('sample_rate', [0.5, 1])
+def test_sample_rate_promoted(sample_rate):
+    row, loaded = round_trip({'sample_rate': sample_rate})
+    assert row['sample_rate'] == sample_rate
+    assert loaded == {'sample_rate': sample_rate}
+
+
+@pytest.mark.parametrize('sample_rate', [0, 2, -0.5, '0.5', True])
+def test_invalid_sample_rate_left_in_remainder(sample_rate):
+    row, loaded = round_trip({'sample_rate': sample_rate})
+    assert row['sample_rate'] is None
+    assert loaded == {'sample_rate': sample_rate}
+
+
+@pytest.mark.parametrize('sample_rate, weight', [(None, 1), (1, 1), (0.5, 2), (0.25, 4), (0.3, 3)])
+def test_weight(sample_rate, weight):
+    assert event_data.weight(sample_rate) == weight
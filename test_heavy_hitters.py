@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for the Space-Saving summaries in heavy_hitters.py
+"""
+
+import collections
+import random
+
+import heavy_hitters
+
+
+def summarize(stream, capacity):
+    summary = {}
+    for item in stream:
+        heavy_hitters.add(summary, item, capacity=capacity)
+    return summary
+
+
+def assert_bounds(summary, truth):
+    for item, (count, error) in summary.items():
+        assert count - error <= truth[item] <= count, item
+
+
+def test_exact_below_capacity():
+    summary = summarize('aabac', capacity=5)
+    assert summary == {'a': [3, 0], 'b': [1, 0], 'c': [1, 0]}
+
+
+def test_eviction_inherits_minimum_as_error():
+    summary = summarize('aab', capacity=1)
+    assert summary == {'b': [3, 2]}
+
+
+def test_add_counts_largest_first():
+    summary = heavy_hitters.add_counts({}, {'rare': 1, 'common': 10}, capacity=1)
+    assert summary == {'rare': [11, 10]}
+
+
+def test_merge_of_summaries_with_spare_counters_is_exact():
+    merged = heavy_hitters.merge([summarize('aab', 5), summarize('bc', 5)], capacity=5)
+    assert merged == {'a': [2, 0], 'b': [2, 0], 'c': [1, 0]}
+
+
+def test_merge_charges_items_missing_from_a_full_summary():
+    full = {'a': [5, 0], 'b': [3, 1]}
+    merged = heavy_hitters.merge([full, {'c': [4, 0]}], capacity=2)
+    # 'c' may have been evicted from the full summary after occurring up to 3 times
+    assert merged['c'] == [7, 3]
+    assert merged['a'] == [5, 0]
+
+
+def test_merge_keeps_bounds_on_skewed_streams():
+    rng = random.Random(1)
+    streams = [[int(rng.paretovariate(1.1)) for _ in range(5000)] for _ in range(4)]
+    merged = heavy_hitters.merge([summarize(stream, 20) for stream in streams], capacity=20)
+    assert len(merged) == 20
+    assert_bounds(merged, collections.Counter(item for stream in streams for item in stream))
+
+
+def test_top_orders_by_count():
+    summary = {'a': [1, 0], 'b': [5, 2], 'c': [3, 0]}
+    assert heavy_hitters.top(summary, 2) == [('b', 5, 2), ('c', 3, 0)]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Tests for timestamp normalization in import_events.py
+"""
+
+from datetime import datetime
+
+import pytest
+
+from import_events import parse_timestamp
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-01-15 09:30:00', '2024-01-15 09:30:00.000000'),
+    ('2024-01-15 09:30:00.123456', '2024-01-15 09:30:00.123456'),
+    ('2024-01-15T09:30:00', '2024-01-15 09:30:00.000000'),
+    ('2024-01-15T09:30:00Z', '2024-01-15 09:30:00.000000'),
+    ('2024-01-15T11:30:00+02:00', '2024-01-15 09:30:00.000000'),
+    ('2024-01-15T09:30:00.5', '2024-01-15 09:30:00.500000'),
+    (1705311000, '2024-01-15 09:30:00.000000'),
+    (1705311000.25, '2024-01-15 09:30:00.250000'),
+    ('1705311000', '2024-01-15 09:30:00.000000'),
+    (1705311000250, '2024-01-15 09:30:00.250000'),  # Milliseconds
+    (datetime(2024, 1, 15, 9, 30), '2024-01-15 09:30:00.000000'),
+])
+def test_parse_timestamp_forms(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, ''])
+def test_parse_timestamp_missing(value):
+    assert parse_timestamp(value) is None
+
+
+def test_parse_timestamp_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
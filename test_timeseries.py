@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for bucket choice and LTTB downsampling in timeseries.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import timeseries
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.mark.parametrize('span, points, bucket', [
+    (timedelta(hours=1), 100, ('1m', 60)),
+    (timedelta(hours=1), 5, ('5m', 300)),
+    (timedelta(days=1), 100, ('5m', 300)),
+    (timedelta(days=7), 100, ('1h', 3600)),         # Past the raw range limit
+    (timedelta(days=14), 100, ('1h', 3600)),
+    (timedelta(days=30), 100, ('6h', 21600)),
+    (timedelta(days=30), 10, ('1d', 86400)),
+    (timedelta(days=3650), 10, ('1w', 604800)),     # Nothing is small enough; largest bucket
+])
+def test_choose_bucket(span, points, bucket):
+    assert timeseries.choose_bucket(NOW - span, NOW, points, now=NOW) == bucket
+
+
+def test_choose_bucket_uses_days_past_hourly_retention():
+    start = NOW - timeseries.HOURLY_KEPT - timedelta(days=1)
+    assert timeseries.choose_bucket(start, start + timedelta(hours=2), 100, now=NOW) == ('1d', 86400)
+
+
+def test_bucket_origin_aligns_weeks_to_monday():
+    origin = timeseries.from_epoch(timeseries.bucket_origin(datetime(2024, 6, 5, 15, 30), 604800))
+    assert origin == datetime(2024, 6, 3)
+    assert origin.weekday() == 0
+
+
+def test_bucket_origin_hours():
+    assert timeseries.from_epoch(timeseries.bucket_origin(datetime(2024, 6, 5, 15, 30), 3600)) == datetime(2024, 6, 5, 15)
+
+
+def test_lttb_keeps_everything_when_under_threshold():
+    assert timeseries.lttb([1, 2, 3], 5) == [0, 1, 2]
+
+
+def test_lttb_keeps_ends_and_threshold_points():
+    values = [0, 1, 0, 1, 0, 1, 0, 1, 0, 1]
+    kept = timeseries.lttb(values, 4)
+    assert len(kept) == 4
+    assert kept[0] == 0 and kept[-1] == len(values) - 1
+    assert kept == sorted(set(kept))
+
+
+def test_lttb_keeps_the_spike():
+    values = [0] * 100
+    values[37] = 50
+    assert 37 in timeseries.lttb(values, 10)
+
+
+def test_lttb_below_three_points():
+    assert timeseries.lttb(list(range(10)), 2) == [0, 9]
+
+
+def test_downsample_aligns_series():
+    series = {'a': [0] * 100, 'b': [0] * 100}
+    series['a'][10] = 5
+    series['b'][80] = 5
+    chosen = timeseries.downsample(series, 10)
+    assert len(chosen) <= 10
+    assert 10 in chosen and 80 in chosen
+    assert timeseries.downsample(series, 200) == list(range(100))
+    assert timeseries.downsample({}, 10) == []
+
+
+def test_keep_top_sums_the_rest():
+    series = {'a': [1, 1], 'b': [5, 5], 'c': [2, 0], 'd': [0, 1]}
+    assert timeseries.keep_top(series, 2) == {'b': [5, 5], 'a': [1, 1], 'other': [2, 1]}
@@ -6,8 +6,10 @@ This script tests the tracking functionality by simulating user interactions.
 
 import requests
 import json
+import gzip
 import time
 import random
+import uuid
 
 # Configuration
 BASE_URL = "http://localhost:5000"
@@ -77,6 +79,47 @@ def test_tracking_api():
         print(f"✗ Tracking API failed: {response.status_code}")
         return False
 
+def test_batch_tracking_api():
+    """Test gzip-compressed batch uploads to the tracking API"""
+    print("Testing batched tracking API...")
+    
+    now = int(time.time() * 1000)
+    batch = {
+        "events": [
+            {
+                "event_type": "test_click",
+                "element_id": f"test_button_{i}",
+                "element_type": "button",
+                "page_url": f"{BASE_URL}/test",
+                "event_id": str(uuid.uuid4()),
+                "client_ts": now - i * 1000
+            }
+            for i in range(5)
+        ],
+        "sent_at": now
+    }
+    
+    response = requests.post(
+        f"{BASE_URL}/api/track_event",
+        data=gzip.compress(json.dumps(batch).encode('utf-8')),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    )
+    
+    if response.status_code == 200 and response.json().get("received") == 5:
+        print("✓ Batched tracking API working")
+    else:
+        print(f"✗ Batched tracking API failed: {response.status_code} {response.text}")
+        return False
+    
+    # Resending the same batch (as the retry queue may) must store nothing new
+    response = requests.post(f"{BASE_URL}/api/track_event", json=batch)
+    if response.status_code == 200 and response.json().get("duplicates") == 5:
+        print("✓ Duplicate events rejected")
+        return True
+    else:
+        print(f"✗ Duplicate events were stored: {response.status_code} {response.text}")
+        return False
+
 def test_page_views():
     """Test page view tracking"""
     print("Testing page views...")
@@ -252,6 +295,7 @@ def main():
     # Run individual tests
     test_page_views()
     test_tracking_api()
+    test_batch_tracking_api()
     test_quiz_functionality()
     
     # Simulate user journey
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the HyperLogLog sketches in unique_counts.py
+"""
+
+import unique_counts
+
+
+def sketch_of(values):
+    sketch = unique_counts.new_sketch()
+    for value in values:
+        unique_counts.add(sketch, value)
+    return sketch
+
+
+def test_empty_sketch_estimates_zero():
+    assert unique_counts.estimate(unique_counts.new_sketch()) == 0
+
+
+def test_adding_a_counted_value_changes_nothing():
+    sketch = unique_counts.new_sketch()
+    assert unique_counts.add(sketch, 'user-1')
+    assert not unique_counts.add(sketch, 'user-1')
+
+
+def test_small_counts_are_exact():
+    assert unique_counts.estimate(sketch_of(range(50))) == 50
+
+
+def test_large_count_within_error_bound():
+    estimate = unique_counts.estimate(sketch_of(range(100000)))
+    assert abs(estimate - 100000) < 100000 * 0.03  # Standard error is about 0.8%
+
+
+def test_merge_is_register_wise_maximum():
+    a, b = sketch_of(range(0, 3000)), sketch_of(range(2000, 5000))
+    merged = unique_counts.merge(bytearray(a), b)
+    assert merged == bytearray(max(x, y) for x, y in zip(a, b))
+    assert merged == sketch_of(range(5000))
+
+
+def test_pack_round_trips_sparse_and_dense():
+    for count in (0, 1, 100, 1500, 20000):
+        sketch = sketch_of(range(count))
+        packed = unique_counts.pack(sketch)
+        assert unique_counts.unpack(packed) == sketch
+        assert len(packed) <= unique_counts.REGISTERS
+
+
+def test_pack_is_small_for_few_values():
+    assert unique_counts.pack(unique_counts.new_sketch()) == b''
+    assert len(unique_counts.pack(sketch_of(['only-visitor']))) == 3
+
+
+def test_unpack_reads_dense_rows():
+    sketch = sketch_of(range(10))
+    assert unique_counts.unpack(bytes(sketch)) == sketch
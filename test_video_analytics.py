@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for the watched-interval helpers in video_analytics.py
+"""
+
+import video_analytics
+
+
+def test_merge_interval_into_empty():
+    assert video_analytics.merge_interval([], 10, 20) == ([[10, 20]], 10)
+
+
+def test_merge_interval_disjoint_stays_sorted():
+    merged, added = video_analytics.merge_interval([[30, 40]], 10, 20)
+    assert merged == [[10, 20], [30, 40]]
+    assert added == 10
+
+
+def test_merge_interval_overlap_counts_only_new_seconds():
+    merged, added = video_analytics.merge_interval([[0, 10], [20, 30]], 5, 25)
+    assert merged == [[0, 30]]
+    assert added == 10  # 10-20 was not watched before
+
+
+def test_merge_interval_rewatch_adds_nothing():
+    assert video_analytics.merge_interval([[0, 60]], 10, 20) == ([[0, 60]], 0)
+
+
+def test_merge_interval_touching_intervals_join():
+    assert video_analytics.merge_interval([[0, 10]], 10, 15) == ([[0, 15]], 5)
+
+
+def test_advance_playback_rejects_jumps_faster_than_playback():
+    state = {'playing': False, 'position': None}
+    assert video_analytics.advance_playback(state, 'play', 0.0, 0) is None
+    assert video_analytics.advance_playback(state, 'progress', 10.0, 10) == (0.0, 10.0)
+    assert video_analytics.advance_playback(state, 'progress', 300.0, 10) is None  # A seek, not playback
+
+
+def test_add_to_heatmap_splits_across_buckets():
+    assert video_analytics.add_to_heatmap([], 3, 12, bucket_seconds=5) == [2.0, 5.0, 2.0]
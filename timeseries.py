@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Event Time Series
+Bucketing and downsampling behind /admin/api/timeseries.
+
+Counts are read from event_count_rollup, the hourly and daily event
+counts per type and page that are kept up to date at ingest, so a long
+range costs one primary key range scan over a few rows per bucket. Short
+ranges that want minute buckets are counted from clickstream_event
+through its timestamp index instead.
+
+The bucket size is the smallest one that splits the range into at most
+a few times the number of points asked for. Each series is then cut down
+to that number of points with Largest-Triangle-Three-Buckets (LTTB),
+which keeps the peaks and dips that averaging buckets would flatten.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+import event_data
+import navigation_analytics
+
+# (name, seconds), smallest first
+BUCKETS = (('1m', 60), ('5m', 300), ('15m', 900), ('1h', 3600), ('6h', 21600), ('1d', 86400), ('1w', 604800))
+
+HOUR = 3600
+DAY = 86400
+
+# Buckets per point requested before downsampling
+OVERSAMPLE = 4
+# Minute buckets count raw events, so only for ranges this short
+RAW_RANGE_LIMIT = timedelta(days=2)
+# Hourly rollups older than this are deleted; longer ago, buckets are whole days
+HOURLY_KEPT = timedelta(days=92)
+
+# Weeks start on Monday; the epoch was a Thursday
+WEEK_OFFSET = 4 * DAY
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def to_epoch(moment):
+    return int((moment - datetime(1970, 1, 1)).total_seconds())
+
+
+def from_epoch(seconds):
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
+
+
+def allowed_buckets(start, end, now=None):
+    """The (name, seconds) buckets that can be served for a range"""
+    now = now or datetime.utcnow()
+    smallest = 60
+    if end - start > RAW_RANGE_LIMIT:
+        smallest = HOUR
+    if start < now - HOURLY_KEPT:
+        smallest = DAY
+    return [bucket for bucket in BUCKETS if bucket[1] >= smallest]
+
+
+def choose_bucket(start, end, points, now=None):
+    """Smallest allowed bucket that gives at most points * OVERSAMPLE buckets"""
+    candidates = allowed_buckets(start, end, now)
+    span = (end - start).total_seconds()
+    for bucket in candidates:
+        if span / bucket[1] <= points * OVERSAMPLE:
+            return bucket
+    return candidates[-1]
+
+
+def bucket_origin(moment, seconds):
+    """Epoch seconds of the start of the bucket containing a moment"""
+    offset = WEEK_OFFSET if seconds % (7 * DAY) == 0 else 0
+    epoch = to_epoch(moment)
+    return epoch - (epoch - offset) % seconds
+
+
+def count_series(connection, start, end, seconds, group_by=None, event_types=(), page=None):
+    """Event counts per bucket in [start, end).
+
+    Returns (origin, slots, {series key: [count per slot]}), where origin
+    is the epoch second the first slot starts at. Series are keyed by
+    event type, by page or, without group_by, a single 'total'. Buckets
+    of an hour or more are read from the rollup table, smaller ones from
+    the events themselves.
+    """
+    origin = bucket_origin(start, seconds)
+    slots = max(math.ceil((to_epoch(end) - origin) / seconds), 1)
+    rollup = seconds >= HOUR
+    params = {
+        'origin': origin, 'seconds': seconds,
+        'start': from_epoch(origin).strftime(TIMESTAMP_FORMAT),
+        'end': end.strftime(TIMESTAMP_FORMAT),
+    }
+    if rollup:
+        table, time_column, page_column, value = 'event_count_rollup', 'bucket_start', 'page', 'SUM("count")'
+        conditions = ['period = :period']
+        params['period'] = 'day' if seconds >= DAY else 'hour'
+    else:
+        # Sampled event types count 1 / sample_rate each, as in the rollups
+        table, time_column, page_column, value = ('clickstream_event', 'timestamp', 'page_url',
+                                                  f'CAST(SUM({event_data.WEIGHT_SQL}) AS INTEGER)')
+        conditions = []
+    conditions += [f'{time_column} >= :start', f'{time_column} < :end']
+    if event_types:
+        conditions.append('event_type IN :event_types')
+        params['event_types'] = list(event_types)
+    if page and rollup:
+        conditions.append('page = :page')
+        params['page'] = page
+
+    key_column = {'type': 'event_type', 'page': page_column}.get(group_by, "''")
+    # Raw page URLs still carry hosts and query strings, and API endpoints
+    # count as no page as in the rollups, so pages are normalized and
+    # filtered here rather than in SQL
+    filter_column = page_column if page and not rollup else "''"
+    statement = text(f"""
+        SELECT (CAST(strftime('%s', {time_column}) AS INTEGER) - :origin) / :seconds AS slot,
+               {key_column} AS series, {filter_column} AS filter_page, {value} AS events
+        FROM {table}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY slot, series, filter_page
+    """)
+    if event_types:
+        statement = statement.bindparams(bindparam('event_types', expanding=True))
+
+    series = {}
+    for slot, key, filter_page, events in connection.execute(statement, params):
+        if page and not rollup and navigation_analytics.event_page(filter_page) != page:
+            continue
+        if group_by == 'page' and not rollup:
+            key = navigation_analytics.event_page(key)
+        key = (key or '') if group_by else 'total'
+        if 0 <= slot < slots:
+            counts = series.setdefault(key, [0] * slots)
+            counts[slot] += events
+    return origin, slots, series
+
+
+def keep_top(series, limit):
+    """The `limit` largest series by total, the rest summed into 'other'"""
+    ranked = sorted(series.items(), key=lambda item: sum(item[1]), reverse=True)
+    kept = dict(ranked[:limit])
+    if len(ranked) > limit:
+        other = kept.setdefault('other', [0] * len(ranked[0][1]))
+        for _, counts in ranked[limit:]:
+            for slot, count in enumerate(counts):
+                other[slot] += count
+    return kept
+
+
+def lttb(values, threshold):
+    """Indexes of the points of `values` that LTTB keeps, at most `threshold` of them.
+
+    The first and last points are always kept; the rest are split into
+    threshold - 2 equal buckets and from each the point forming the
+    largest triangle with the previously kept point and the average of
+    the next bucket is chosen.
+    """
+    count = len(values)
+    if threshold >= count:
+        return list(range(count))
+    if threshold < 3:
+        return [0, count - 1]
+
+    kept = [0]
+    size = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        first = int(bucket * size) + 1
+        last = int((bucket + 1) * size) + 1
+        next_first, next_last = last, min(int((bucket + 2) * size) + 1, count)
+        if next_first >= next_last:
+            next_first, next_last = count - 1, count
+        average_x = (next_first + next_last - 1) / 2
+        average_y = sum(values[next_first:next_last]) / (next_last - next_first)
+
+        previous_y = values[previous]
+        best, best_area = first, -1.0
+        for index in range(first, last):
+            area = abs((previous - average_x) * (values[index] - previous_y)
+                       - (previous - index) * (average_y - previous_y))
+            if area > best_area:
+                best, best_area = index, area
+        kept.append(best)
+        previous = best
+    kept.append(count - 1)
+    return kept
+
+
+def downsample(series, points):
+    """Slot indexes to return for a set of series, at most `points` of them.
+
+    Each series is reduced with LTTB and the kept slots of all series are
+    merged, so every series has a value at every timestamp returned (what
+    stacked charts need). With several series this can exceed `points`;
+    the merge is then reduced again with LTTB on the summed counts.
+    """
+    if not series:
+        return []
+    slots = len(next(iter(series.values())))
+    if slots <= points:
+        return list(range(slots))
+    chosen = set()
+    for counts in series.values():
+        chosen.update(lttb(counts, points))
+    chosen = sorted(chosen)
+    if len(chosen) > points:
+        totals = [sum(counts[slot] for counts in series.values()) for slot in chosen]
+        chosen = [chosen[index] for index in lttb(totals, points)]
+    return chosen
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Video Watch-Interval Aggregation
+Pure helpers that turn a stream of play/pause/seek/progress events into
+merged watched intervals, rewatch heatmaps and drop-off histograms.
+The Flask app stores the results; nothing here touches the database.
+"""
+
+# Width of one heatmap / drop-off bucket in seconds of video
+BUCKET_SECONDS = 5
+
+# Playback may run at up to this speed (playbackRate), plus some slack
+# for event delivery jitter, when checking that a segment is plausible
+MAX_PLAYBACK_RATE = 2.0
+SLACK_SECONDS = 2.0
+
+
+def advance_playback(state, action, position, elapsed_seconds):
+    """Apply one video event to the playback state.
+
+    Returns the (start, end) segment of video watched since the previous
+    event, or None. elapsed_seconds is the wall-clock time since the
+    previous event and is used to reject jumps that were really seeks.
+    """
+    if position is None:
+        return None
+
+    segment = None
+    last_position = state['position']
+    if state['playing'] and last_position is not None and action != 'seek':
+        watched = position - last_position
+        limit = elapsed_seconds * MAX_PLAYBACK_RATE + SLACK_SECONDS
+        if 0 < watched <= limit:
+            segment = (last_position, position)
+
+    if action == 'play':
+        state['playing'] = True
+    elif action in ('pause', 'complete'):
+        state['playing'] = False
+    state['position'] = position
+    return segment
+
+
+def merge_interval(intervals, start, end):
+    """Add [start, end] to a sorted list of disjoint intervals.
+
+    Returns the new list and how many seconds were not covered before.
+    """
+    merged = []
+    new_start, new_end = start, end
+    overlap = 0.0
+    for a, b in intervals:
+        if b < new_start or a > new_end:
+            merged.append([a, b])
+        else:
+            overlap += max(0.0, min(b, end) - max(a, start))
+            new_start = min(new_start, a)
+            new_end = max(new_end, b)
+    merged.append([new_start, new_end])
+    merged.sort()
+    return merged, (end - start) - overlap
+
+
+def add_to_heatmap(heatmap, start, end, bucket_seconds=BUCKET_SECONDS):
+    """Add the seconds of [start, end] to each bucket it overlaps.
+
+    Each bucket holds viewer-seconds, so heatmap[i] / bucket_seconds is
+    the number of times that part of the video was watched.
+    """
+    last_bucket = int(end // bucket_seconds)
+    if len(heatmap) <= last_bucket:
+        heatmap.extend([0.0] * (last_bucket + 1 - len(heatmap)))
+    for bucket in range(int(start // bucket_seconds), last_bucket + 1):
+        bucket_start = bucket * bucket_seconds
+        covered = min(end, bucket_start + bucket_seconds) - max(start, bucket_start)
+        if covered > 0:
+            heatmap[bucket] = round(heatmap[bucket] + covered, 3)
+    return heatmap
+
+
+def move_dropoff(dropoffs, old_bucket, new_bucket):
+    """Move one viewer's drop-off point between histogram buckets"""
+    if old_bucket == new_bucket:
+        return dropoffs
+    if len(dropoffs) <= new_bucket:
+        dropoffs.extend([0] * (new_bucket + 1 - len(dropoffs)))
+    if old_bucket is not None and old_bucket < len(dropoffs) and dropoffs[old_bucket] > 0:
+        dropoffs[old_bucket] -= 1
+    dropoffs[new_bucket] += 1
+    return dropoffs
+
+
+def bucket_for(position, bucket_seconds=BUCKET_SECONDS):
+    """Index of the bucket containing a video position"""
+    return int(max(position, 0) // bucket_seconds)
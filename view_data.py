@@ -6,13 +6,26 @@ This script allows you to view and analyze the data collected by the learning we
 
 import sqlite3
 import json
+import os
 from datetime import datetime
 import sys
 
+import event_data
+import snapshot
+
+# Written by `flask --app app refresh-snapshot`; read instead of the live
+# database when present, so browsing here never holds up event uploads
+SNAPSHOT_PATH = os.environ.get('ANALYTICS_SNAPSHOT', os.path.join('instance', 'analytics_snapshot.db'))
+
 def connect_db():
-    """Connect to the SQLite database"""
+    """Connect to the analytics snapshot, or to the SQLite database if there is none"""
     try:
-        conn = sqlite3.connect('learning_website.db')
+        taken_at = snapshot.taken_at(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+        if taken_at:
+            conn = snapshot.connect(SNAPSHOT_PATH)
+            print(f"Data as of {taken_at:%Y-%m-%d %H:%M:%S} UTC (analytics snapshot {SNAPSHOT_PATH})")
+        else:
+            conn = sqlite3.connect('learning_website.db')
         conn.row_factory = sqlite3.Row  # This allows column access by name
         return conn
     except sqlite3.OperationalError:
@@ -131,12 +144,9 @@ def view_clickstream_events(conn, limit=20):
             print(f"Answer: {event['answer_selected']}")
         
         # Show additional data if available
-        if event['additional_data']:
-            try:
-                additional = json.loads(event['additional_data'])
-                print(f"Additional Data: {json.dumps(additional, indent=2)}")
-            except:
-                print(f"Additional Data: {event['additional_data']}")
+        additional = event_data.load(event)
+        if additional:
+            print(f"Additional Data: {json.dumps(additional, indent=2)}")
         
         print("-" * 50)
 
@@ -238,7 +248,15 @@ def export_events_to_csv(conn, filename='clickstream_events.csv'):
             ce.quiz_id,
             ce.question_id,
             ce.answer_selected,
-            ce.additional_data
+            ce.additional_data,
+            ce.button_text,
+            ce.link_text,
+            ce.score,
+            ce.page_title,
+            ce.referrer,
+            ce.click_x,
+            ce.click_y,
+            ce.extra_data
         FROM clickstream_event ce
         LEFT JOIN user u ON ce.user_id = u.id
         ORDER BY ce.timestamp DESC
@@ -256,6 +274,7 @@ def export_events_to_csv(conn, filename='clickstream_events.csv'):
             
             # Write data
             for event in events:
+                additional = event_data.load(event)
                 row = [
                     event['timestamp'] or '',
                     event['event_type'] or '',
@@ -270,7 +289,7 @@ def export_events_to_csv(conn, filename='clickstream_events.csv'):
                     event['quiz_id'] or '',
                     event['question_id'] or '',
                     event['answer_selected'] or '',
-                    event['additional_data'] or ''
+                    json.dumps(additional) if additional else ''
                 ]
                 f.write(','.join(f'"{str(field)}"' for field in row) + '\n')
         
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""
+WSGI Entry Point
+Builds the application once at import time for WSGI servers:
+
+    flask --app app init-db                # once, creates tables and sample data
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import create_app
+
+app = create_app()